@@ -17,6 +17,9 @@
 #
 from ctypes import c_int, c_double, c_void_p, cdll, pointer
 import numpy as np
+from ...util.PyC import load_C
+
+product = load_C("mat_vec_prod_engine", flags="-O3")    # was a prebuilt ./libMatVecProd.so, relative to the working directory
 
 
 
@@ -59,9 +62,6 @@ def diag_act_on_vec(
     
     # Calling C function diag_act_on_vec()
     #
-    lib = "./libMatVecProd.so"
-    product = cdll.LoadLibrary(lib)
-    
     product.diag_act_on_vec(
                             total_ld_c,
                             eigval_list_c,
@@ -144,8 +144,6 @@ def coupling_act_on_vec(
     
     # Calling C function coupling_act_on_vec()
     #
-    lib = "./libMatVecProd.so"
-    product = cdll.LoadLibrary(lib)
     product.coupling_act_on_vec(
                                 num_state1_c,
                                 num_state2_c,
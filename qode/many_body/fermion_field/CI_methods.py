@@ -15,11 +15,14 @@
 #    You should have received a copy of the GNU General Public License
 #    along with Qode.  If not, see <http://www.gnu.org/licenses/>.
 #
+import numpy
 from ...util import struct, indented
 from ...math import linear_inner_product_space
 from ...math.lanczos import lowest_eigen, lowest_eigen_one_by_one
+from ...math import davidson
 from .CI_space_traits import CI_space_traits
 from .field_op_ham import Hamiltonian
+from .string_ham import StringHamiltonian
 from . import configurations
 
 
@@ -50,6 +53,14 @@ def dimer_configs(frag0, frag1, Sz=0):
 
     return configs, nested
 
+def dimer_spin_orbs(frag0, frag1):
+    """ spin-orbital indices (in the layout of dimer_configs) of the spin-down and spin-up partners of each dimer spatial orbital """
+    n_spatial_0 = frag0.basis.n_spatial_orb
+    n_spatial_1 = frag1.basis.n_spatial_orb
+    dn_orbs = list(range(n_spatial_0)) + [2*n_spatial_0 +               p for p in range(n_spatial_1)]
+    up_orbs = [n_spatial_0 + p for p in range(n_spatial_0)] + [2*n_spatial_0 + n_spatial_1 + p for p in range(n_spatial_1)]
+    return dn_orbs, up_orbs
+
 
 
 def _act_Sops(Sops, state_in):
@@ -59,14 +70,24 @@ def _act_Sops(Sops, state_in):
         state += Sop_state
     return state
 
-def lanczos_ground(integrals, configs, occupied, n_states=1, thresh=None, printout=print, n_threads=1, full_ints=None):
+def lanczos_ground(integrals, configs, occupied, n_states=1, thresh=None, printout=print, n_threads=1, full_ints=None, sparse=False, strings=False, solver="lanczos", max_bytes=None, scratch=None, resources=None):
+    if solver not in ("lanczos", "davidson"):  raise ValueError("solver must be \"lanczos\" or \"davidson\"")
+    if resources is not None:      # a util.parallel.resources, which supplies the threads for the Hamiltonian and (if not given) max_bytes
+        n_threads = resources.n_threads
+        if max_bytes is None:  max_bytes = resources.max_bytes
     options = struct(printout=indented(printout))
     if thresh is not None:         # if not defined/passed forward ...
         options.thresh = thresh    # ... default from lanczos takes over
+    if max_bytes is not None and solver=="lanczos":    # bounds the memory held by Lanczos vectors, spilling older ones to files in scratch
+        options.max_bytes, options.scratch = max_bytes, scratch
 
     N, h, V  = integrals("N h V")
     CI_space = linear_inner_product_space(CI_space_traits(configs))
-    H        = CI_space.lin_op(Hamiltonian(h,V, n_threads=n_threads))
+    if strings:    # True for monomer layout, or a pair of spin-down/up orbital lists (see dimer_spin_orbs); configs must be a tensor product of strings
+        dn_orbs, up_orbs = (None, None) if strings is True else strings
+        H = CI_space.lin_op(StringHamiltonian(h,V, dn_orbs, up_orbs))
+    else:
+        H = CI_space.lin_op(Hamiltonian(h,V, n_threads=n_threads, sparse=sparse))    # sparse=True or "auto" to precompute the matrix for many iterations
     guess    = CI_space.member(CI_space.aux.basis_vec(occupied))
 
     energy = (guess|H|guess)
@@ -81,7 +102,16 @@ def lanczos_ground(integrals, configs, occupied, n_states=1, thresh=None, printo
         printout(f"Proper norm of guess = {norm}")
         printout(f"Proper expectation energy of guess = {energy} -> {energy+N}")
 
-    if n_states==1:
+    if solver=="davidson":    # diagonally preconditioned; thresh is then on residual norms
+        guesses = [guess]
+        for i in numpy.argsort(H.diagonal().op):    # further guesses are the determinants with lowest diagonal energies
+            if len(guesses)==n_states:  break
+            if guess.v[i]==0:
+                unit = numpy.zeros(len(guess.v), dtype=guess.v.dtype)
+                unit[i] = 1
+                guesses += [CI_space.member(unit)]
+        results = davidson.lowest_eigen(H, guesses, **options)
+    elif n_states==1:
         results = lowest_eigen(H, [guess], **options)    # in theory, can just go to "else" directly, but out of caution, leave old functionality alone for now
     else:
         results = lowest_eigen_one_by_one(H, [guess]*n_states, **options)    # a little weird to demand multiple states from one guess, but can refine later
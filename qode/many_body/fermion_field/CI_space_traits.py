@@ -17,6 +17,7 @@
 #
 import numpy
 from ...util.PyC import Double
+from ...math.numpy_space import linear_combination
 from . import field_op
 
 
@@ -55,6 +56,9 @@ class CI_space_traits(object):
     def copy(v):
         return v.copy()
     @staticmethod
+    def linear_combination(coeffs, vecs, out=None):
+        return linear_combination(coeffs, vecs, out)    # fused, see numpy_space
+    @staticmethod
     def scale(c,v):
         v *= c
     @staticmethod
@@ -65,13 +69,29 @@ class CI_space_traits(object):
     def dot(v,w):
         return v.dot(w)
     def act_on_vec(self, op, v):
+        if isinstance(op, numpy.ndarray):  return op * v    # a diagonal operator (see below)
         return op(v, self.configs)
     def back_act_on_vec(self, v, op):
+        if isinstance(op, numpy.ndarray):  return op * v
         return op(v, self.configs)
+    def act_on_vec_block_accumulate(self, op, v_block, out_block, coeff=1):
+        if isinstance(op, numpy.ndarray):
+            for v,out in zip(v_block,out_block):  out += coeff * op * v
+        elif hasattr(op, "accumulate"):
+            op.accumulate(list(out_block), list(v_block), self.configs, coeff)    # Hamiltonian increments output directly
+        else:
+            for out,Ov in zip(out_block, op(list(v_block), self.configs)):  linear_combination([coeff], [Ov], out)
+    def act_on_vec_accumulate(self, op, v, out, coeff=1):
+        self.act_on_vec_block_accumulate(op, [v], [out], coeff)
+    def diagonal(self, op):
+        return op.diagonal(self.configs)
+    @staticmethod
+    def function_on_diags(func, op):
+        return func(op)    # applied to the whole array at once, so func must be written with numpy-compatible arithmetic
     def act_on_vec_block(self, op, v_block):
-        return [ op(v, self.configs) for v in v_block ]
+        return op(list(v_block), self.configs)    # Hamiltonian acts on the whole block in one pass
     def back_act_on_vec_block(self, v_block, op):
-        return [ op(v, self.configs) for v in v_block ]
+        return op(list(v_block), self.configs)    # Hamiltonian is Hermitian (real symmetric)
     @staticmethod
     def dot_vec_blocks(v_block,w_block):
         return numpy.array([[CI_space_traits.dot(v,w) for v in v_block] for w in w_block])
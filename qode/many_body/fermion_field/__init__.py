@@ -17,8 +17,11 @@
 #
 from . import field_op
 from .field_op_ham    import Hamiltonian
+from .string_ham      import StringHamiltonian
+from .densities       import density_store, stream_densities, store_densities
 from .CI_space_traits import CI_space_traits
 from .configurations  import dn_up_elec, combine_orb_lists, all_configs, Sz_configs, decompose_configs, recompose_configs, config_combination, tensor_product_configs, print_configs
+from .configurations  import num_configs, all_configs_packed, iter_configs_packed, Sz_configs_packed, tensor_product_configs_packed, unpack_configs
 from . import CI_methods
 
 # Contains direct interfaces to low-level (bit-fiddling) code for operating on configutations strings
@@ -29,6 +32,8 @@ from . import CI_methods
 
 # The next layer up builds on field_op.py (etc) but do not know about each other
 #   field_op_ham.py       given appropriate sets if integrals resolves the action of the Hamiltonian on a list of coefficients given low-level config reps
+#   string_ham.py         alternative to field_op_ham.py for tensor-product (spin-down x spin-up string) spaces, acting via precomputed string replacements
+#   densities.py          streams transition densities in memory-bounded blocks of bra-ket pairs, optionally to/from disk
 #   CI_space_traits.py    connects arrays of coefficients to low-level reps of configurations for building state vectors
 
 # An isolated module (no dependencies on foregoing) that generates lists of configs represented as integers.
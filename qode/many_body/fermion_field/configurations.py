@@ -15,6 +15,7 @@
 #    You should have received a copy of the GNU General Public License
 #    along with Qode.  If not, see <http://www.gnu.org/licenses/>.
 #
+import math
 import numpy
 
 
@@ -139,6 +140,111 @@ def tensor_product_configs(configsX, orb_counts):
 
 
 
+# The functions below generate the same configurations as all_configs, Sz_configs and tensor_product_configs above, in
+# the same (ascending) order, but never as python integers.  Instead, they are produced directly in the "packed" layout
+# used by field_op.c, as a 2-D numpy array with one row per configuration, and each row holding the configuration in
+# n_int integers of orbs_per_int bits (low-order orbitals in the first integer), where n_int is the minimum sufficient
+# for the largest configuration (matching field_op.packed_configs, see its from_packed() constructor).  They rely on the
+# fact that the ascending order of configurations with a given number of electrons among given orbitals is the
+# colexicographic order of the combinations of occupied orbitals, so that any range of them can be generated directly
+# from their ranks (the combinatorial number system), vectorized over configurations.  This also allows the
+# configurations to be streamed in chunks of bounded size (iter_configs_packed).
+
+def _active_orbs(num_tot_orb, frozen_occ_orbs, frozen_vrt_orbs):
+    """ the (ascending) orbitals that are neither frozen occupied nor frozen virtual """
+    frozen = set(frozen_occ_orbs or []) | set(frozen_vrt_orbs or [])
+    return [p for p in range(num_tot_orb) if p not in frozen]
+
+def num_configs(num_tot_orb, num_active_elec, frozen_occ_orbs=None, frozen_vrt_orbs=None):
+    """ the number of configurations that all_configs would return for the same arguments """
+    return math.comb(len(_active_orbs(num_tot_orb, frozen_occ_orbs, frozen_vrt_orbs)), num_active_elec)
+
+def _num_ints(highest_orb, orbs_per_int):
+    """ number of integers per configuration if the highest occupied orbital in any configuration is as given (-1 for none) """
+    return 1 + (highest_orb+1)//orbs_per_int
+
+def _set_orbs(packed, rows, orbs, orbs_per_int):
+    """ set the bits for the given orbitals (one per row, or a scalar for all rows) in the given rows of a packed array """
+    orbs = numpy.asarray(orbs, dtype=numpy.int64)
+    packed[rows, orbs//orbs_per_int] |= numpy.left_shift(numpy.int64(1), orbs%orbs_per_int)
+
+def all_configs_packed(num_tot_orb, num_active_elec, orbs_per_int, frozen_occ_orbs=None, frozen_vrt_orbs=None, begin=0, end=None):
+    """ configurations begin through end-1 (all by default) of those given by all_configs, in packed form """
+    active_orbs = numpy.array(_active_orbs(num_tot_orb, frozen_occ_orbs, frozen_vrt_orbs), dtype=numpy.int64)
+    frozen_occ_orbs = sorted(set(frozen_occ_orbs or []))
+    m, k = len(active_orbs), num_active_elec
+    if end is None:  end = math.comb(m, k)
+    highest_orb = max([-1] + list(frozen_occ_orbs) + (list(active_orbs[m-k:]) if k>0 else []))    # highest orbital of the last configuration
+    packed = numpy.zeros((max(0,end-begin), _num_ints(highest_orb, orbs_per_int)), dtype=numpy.int64)
+    rows  = numpy.arange(len(packed))
+    ranks = numpy.arange(begin, begin+len(packed), dtype=numpy.int64)
+    for j in range(k, 0, -1):    # peel off the highest remaining occupied orbital of each configuration (within the active ones)
+        binom = numpy.array([math.comb(t, j) for t in range(m+1)], dtype=numpy.int64)
+        t = numpy.searchsorted(binom, ranks, side="right") - 1    # largest t such that t-choose-j does not exceed the rank
+        ranks -= binom[t]
+        _set_orbs(packed, rows, active_orbs[t], orbs_per_int)
+    for p in frozen_occ_orbs:
+        _set_orbs(packed, rows, p, orbs_per_int)
+    return packed
+
+def iter_configs_packed(num_tot_orb, num_active_elec, orbs_per_int, frozen_occ_orbs=None, frozen_vrt_orbs=None, chunk_size=2**20):
+    """ generator over consecutive chunks (of at most chunk_size) of all_configs_packed, all with the same number of integers per configuration """
+    n_configs = num_configs(num_tot_orb, num_active_elec, frozen_occ_orbs, frozen_vrt_orbs)
+    for begin in range(0, n_configs, chunk_size):
+        yield all_configs_packed(num_tot_orb, num_active_elec, orbs_per_int, frozen_occ_orbs, frozen_vrt_orbs, begin, min(begin+chunk_size, n_configs))
+
+def _highest_orb(packed, orbs_per_int):
+    """ highest occupied orbital over the configurations in a packed array (assuming ascending order, so looks only at the last) """
+    if len(packed)==0:  return -1
+    last = packed[-1]
+    for n in reversed(range(len(last))):
+        if last[n]!=0:  return n*orbs_per_int + int(last[n]).bit_length() - 1
+    return -1
+
+def _shift_packed(packed, shift, n_ints, orbs_per_int):
+    """ the packed configurations with orbital indices increased by shift, with n_ints integers per configuration """
+    result = numpy.zeros((len(packed), n_ints), dtype=numpy.int64)
+    q, r = divmod(shift, orbs_per_int)
+    mask = (1 << orbs_per_int) - 1
+    words = packed.astype(numpy.uint64)
+    for n in range(packed.shape[1]):
+        low  = (words[:,n] << numpy.uint64(r)) & numpy.uint64(mask)
+        high =  words[:,n] >> numpy.uint64(orbs_per_int - r)
+        if n+q<n_ints:    result[:,n+q]   |= low.astype(numpy.int64)
+        if n+q+1<n_ints:  result[:,n+q+1] |= high.astype(numpy.int64)
+    return result
+
+def tensor_product_configs_packed(packedX, orb_counts, orbs_per_int):
+    """ as for tensor_product_configs, but with the subsystem and supersystem configurations in packed form """
+    shifts = [0]
+    for orb_count in orb_counts[:-1]:  shifts += [shifts[-1] + orb_count]
+    highest_orb = max([-1] + [shift+_highest_orb(packed, orbs_per_int) for packed,shift in zip(packedX,shifts) if _highest_orb(packed, orbs_per_int)>=0])
+    n_ints = _num_ints(highest_orb, orbs_per_int)
+    result = numpy.zeros([len(packed) for packed in reversed(packedX)] + [n_ints], dtype=numpy.int64)    # last subsystem is the slowest index
+    for X,(packed,shift) in enumerate(zip(packedX,shifts)):
+        axis  = len(packedX) - 1 - X
+        shape = [1]*len(packedX) + [n_ints]
+        shape[axis] = len(packed)
+        result |= _shift_packed(packed, shift, n_ints, orbs_per_int).reshape(shape)    # bits of subsystems do not overlap, so OR is addition
+    return result.reshape(-1, n_ints)
+
+def Sz_configs_packed(n_spatial, n_elec, Sz, core, orbs_per_int):
+    """ as for Sz_configs, but with all configurations in packed form """
+    n_elec_dn, n_elec_up = dn_up_elec(n_elec, Sz)
+    dn_configs = all_configs_packed(n_spatial, n_elec_dn-len(core), orbs_per_int, frozen_occ_orbs=core)
+    up_configs = all_configs_packed(n_spatial, n_elec_up-len(core), orbs_per_int, frozen_occ_orbs=core)
+    configs = tensor_product_configs_packed([dn_configs,up_configs], [n_spatial,n_spatial], orbs_per_int)
+    return configs, (dn_configs, up_configs)
+
+def unpack_configs(packed, orbs_per_int):
+    """ the python-integer configurations from a packed array (for inspection or for interfacing with the functions above) """
+    configs = [0] * len(packed)
+    for n in reversed(range(packed.shape[1])):
+        for i,word in enumerate(packed[:,n].tolist()):  configs[i] = (configs[i] << orbs_per_int) + word
+    return configs
+
+
+
 def print_configs(nested, orb_counts, printout=print, _indent=""):
     """ given a list of configurations (maybe in multiply nested representation), print the bit-string representation for each configuration """
     num_orb = orb_counts[-1]
@@ -0,0 +1,105 @@
+#    (C) Copyright 2025 Anthony D. Dutoi
+#
+#    This file is part of Qode.
+#
+#    Qode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Qode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Qode.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import math
+import itertools
+import numpy
+from ...util import parallel
+from . import field_op
+
+# For catalogs of transition densities between many bra and ket states, field_op.build_densities would hold all
+# len(bras)*len(kets) tensors in memory at once.  Here, stream_densities instead yields them for rectangular blocks of
+# bra-ket pairs, with the block size chosen so that the storage for one block (including any thread-private copies made
+# by the C code) stays within max_bytes.  Every block requires a traversal of the ket configurations, so it pays to pass
+# a wisdom object (field_op.det_densities), which is generated on the first block and applied on the rest.  Optionally,
+# each block is written to a density_store on disk, from which individual tensors can be read back lazily (memory mapped).
+# With n_workers>1, blocks are computed concurrently on a util.parallel.thread_pool (the C code releases the GIL), each with
+# n_threads OpenMP threads and a share of max_bytes, but still yielded in order.
+
+
+
+# The job of this class is to keep density tensors in a directory, one .npy file per (op_string, bra, ket) key, and to
+# hand them back memory mapped (read-only), so that only the parts actually used are read from disk.  Packed densities
+# (see field_op.packed_density) are kept packed, and are handed back as packed_density objects wrapping the memory map.
+class density_store(object):
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+    def _path(self, key, packed):
+        op_string, bra, ket = key
+        suffix = ".packed.npy" if packed else ".npy"
+        return os.path.join(self.directory, f"{op_string}.{bra}.{ket}{suffix}")
+    def __contains__(self, key):
+        return os.path.exists(self._path(key, False)) or os.path.exists(self._path(key, True))
+    def __setitem__(self, key, rho):
+        if isinstance(rho, field_op.packed_density):  numpy.save(self._path(key, True),  rho.packed)
+        else:                                          numpy.save(self._path(key, False), rho)
+    def __getitem__(self, key):
+        op_string = key[0]
+        if os.path.exists(self._path(key, False)):
+            return numpy.load(self._path(key, False), mmap_mode="r")
+        if os.path.exists(self._path(key, True)):
+            packed = numpy.load(self._path(key, True), mmap_mode="r")
+            n, n_orbs = max(op_string.count("c"), op_string.count("a")), 0
+            rows = packed.shape[0] if op_string.count("c")==n else packed.shape[1]
+            while math.comb(n_orbs, n)<rows:  n_orbs += 1    # recover edge dimension from number of combinations
+            return field_op.packed_density(op_string, n_orbs, packed)
+        raise KeyError(key)
+
+
+
+def _block_shape(n_bras, n_kets, bytes_per_pair, n_threads, max_bytes):
+    """ the numbers of bras and kets per block, such that a block (and its thread-private copies) fits in max_bytes """
+    n_pairs = max(1, max_bytes // (bytes_per_pair * n_threads))
+    n_kets_block = min(n_kets, n_pairs)
+    n_kets_block = -(-n_kets // -(-n_kets // n_kets_block))    # same number of blocks, but evened out
+    n_bras_block = min(n_bras, max(1, n_pairs // n_kets_block))
+    n_bras_block = -(-n_bras // -(-n_bras // n_bras_block))
+    return n_bras_block, n_kets_block
+
+def stream_densities(op_string, n_orbs, bras, kets, bra_configs, ket_configs, thresh, wisdom=None, antisymmetrize=True, packed=False, max_bytes=2**30, store=None, printout=print, n_threads=1, n_workers=1):
+    """ generator over blocks of transition densities, yielding (bra indices, ket indices, densities[bra][ket] for the block) """
+    n_create  = op_string.count("c")
+    n_annihil = op_string.count("a")
+    if packed:  bytes_per_pair = 8 * math.comb(n_orbs, n_create) * math.comb(n_orbs, n_annihil)
+    else:       bytes_per_pair = 8 * n_orbs**(n_create + n_annihil)
+    with parallel.thread_pool(n_workers, threads_per_task=n_threads) as pool:    # blocks computed concurrently, within the global core budget
+        n_bras_block, n_kets_block = _block_shape(len(bras), len(kets), bytes_per_pair, n_threads, max_bytes // max(1,pool.n_workers))
+        reduction = "auto"
+        if n_threads>1:    # budget above already accounts for private copies, if they fit at all
+            reduction = "private" if (bytes_per_pair * n_threads <= max_bytes // max(1,pool.n_workers)) else "atomic"
+        blocks = []
+        for bra_beg in range(0, len(bras), n_bras_block):
+            for ket_beg in range(0, len(kets), n_kets_block):
+                blocks += [(range(bra_beg, min(bra_beg+n_bras_block, len(bras))), range(ket_beg, min(ket_beg+n_kets_block, len(kets))))]
+        def compute(bra_indices, ket_indices):
+            rho = field_op.build_densities(op_string, n_orbs, [bras[i] for i in bra_indices], [kets[j] for j in ket_indices], bra_configs, ket_configs, thresh, wisdom, antisymmetrize, printout=printout, n_threads=n_threads, reduction=reduction, packed=packed)
+            return bra_indices, ket_indices, rho
+        results = pool.imap(compute, blocks[1:])    # the first block is done alone, since it may generate the wisdom that the rest apply
+        for bra_indices, ket_indices, rho in itertools.chain([compute(*blocks[0])] if blocks else [], results):
+            if store is not None:
+                for i,bra in enumerate(bra_indices):
+                    for j,ket in enumerate(ket_indices):
+                        store[op_string, bra, ket] = rho[i][j]
+            yield bra_indices, ket_indices, rho
+            del rho
+
+def store_densities(store, op_string, n_orbs, bras, kets, bra_configs, ket_configs, thresh, wisdom=None, antisymmetrize=True, packed=False, max_bytes=2**30, printout=print, n_threads=1, n_workers=1):
+    """ computes all densities for the given bras and kets block by block, writing them to store (a density_store), which is returned """
+    for _ in stream_densities(op_string, n_orbs, bras, kets, bra_configs, ket_configs, thresh, wisdom, antisymmetrize, packed, max_bytes, store, printout, n_threads, n_workers):  pass
+    return store
@@ -29,7 +29,9 @@
  * which it projects.  This look-up relies on the fact that the configuration
  * strings are stored in ascending order according to the interpretation of
  * their bit strings as integers.  This step (implemented via bisection search)
- * is the most expensive part of this algorithm.
+ * is the most expensive part of this algorithm.  It can be reduced to a (usually)
+ * constant-time operation if an optional hash table of the configurations is
+ * given (see build_config_hash() below), which is then searched instead.
  *
  * On the inside of this code (which may differ from the outside) we imagine
  * the binary representation of the integers used to represent configurations
@@ -74,6 +76,7 @@
  */
 
 #include <stdlib.h>       // exit()
+#include <stdint.h>       // uint64_t
 #include <string.h>       // memcpy()
 #include <math.h>         // fabs()
 #include "PyC_types.h"    // PyInt, BigInt, Double
@@ -90,12 +93,18 @@
 #define OP_ACTION   1    // for acting an operator on a vector to produce a new vector
 #define COMPUTE_D   2    // for computing density tensors between sets of bras and kets
 #define WISDOM_ONLY 3    // for computing the lookup tables only (only GENERATE below makes sense with this)
+#define MATRIX_ELEM 4    // for listing (or just counting) the individual nonzero matrix elements of an operator between configurations
 
 // What to do with the pointers to the wisdom (lookup) tables provided at the top level.
 #define IGNORE      0    // ignore them (probably NULL)
 #define GENERATE    1    // populate them
 #define APPLY       2    // use the information to avoid calling the bisection_search function
 
+// How the threads avoid colliding when incrementing the output (the new states for OP_ACTION, or the tensors for COMPUTE_D).
+#define REDUCE_ATOMIC  0    // all threads increment the same output, with each update protected by omp atomic
+#define REDUCE_PRIVATE 1    // each thread (but the first) increments its own zeroed copy of the output, which are summed in at the end
+#define REDUCE_OWNER   2    // (OP_ACTION only, symmetric operators) each ket index "pulls" contributions into its own slot of the output
+
 // This utility divides val into its sign and absolute value without having to worry about
 // whether to hardcode the use of abs(), labs(), llabs(), etc.  It also shifts the absolute
 // value from fortran-style indexing to C-style indexing (see comments above and below).
@@ -185,6 +194,163 @@ PyInt bisect_search(BigInt* config, BigInt* configs, PyInt n_configint, PyInt lo
 
 
 
+// A hash of a configuration (composed of n_configint BigInts), mixing the components together, followed
+// by the finalizer from the splitmix64 generator, so that the low-order bits are usable for addressing.
+//
+uint64_t config_hash(BigInt* config, PyInt n_configint)
+    {
+    uint64_t h = 0;
+    for (PyInt i=0; i<n_configint; i++)  {h = (h ^ (uint64_t)config[i]) * 0x9E3779B97F4A7C15ULL;}
+    h ^= h >> 30;  h *= 0xBF58476D1CE4E5B9ULL;
+    h ^= h >> 27;  h *= 0x94D049BB133111EBULL;
+    h ^= h >> 31;
+    return h;
+    }
+
+// Populate an open-addressing (linear probing) hash table for an array of configs (given that each
+// configuration requires n_configint BigInts), to be searched by hash_search() below.  The table size
+// must be a power of 2 that is larger than n_configs (twice as large or more keeps the probe sequences
+// short), and it should come in zeroed.  Each slot holds the index of a config, shifted by one
+// (fortran-style) so that zero signals an empty slot.
+// Needs to be accessible to python.
+//
+void build_config_hash(BigInt* configs, PyInt n_configs, PyInt n_configint, BigInt* table, PyInt table_size)
+    {
+    uint64_t mask = (uint64_t)table_size - 1;
+    for (PyInt n=0; n<n_configs; n++)
+        {
+        uint64_t slot = config_hash(configs + (n * n_configint), n_configint) & mask;
+        while (table[slot] != 0)  {slot = (slot + 1) & mask;}    // linear probing to the first empty slot
+        table[slot] = n + 1;
+        }
+    return;
+    }
+
+// The index of a config in an array of configs (given that each configuration requires n_configint
+// BigInts), using a hash table populated by build_config_hash().  Returns -1 if config not in configs.
+// Also needs to be accessible to python.
+//
+PyInt hash_search(BigInt* config, BigInt* configs, PyInt n_configint, BigInt* table, PyInt table_size)
+    {
+    uint64_t mask = (uint64_t)table_size - 1;
+    uint64_t slot = config_hash(config, n_configint) & mask;
+    while (table[slot] != 0)    // an empty slot ends the probe sequence, so config is not present
+        {
+        PyInt   n = table[slot] - 1;                           // undo fortran-style indexing
+        BigInt* test_config = configs + (n * n_configint);    // pointer arithmetic for start of test_config
+        PyInt   i = 0;
+        while (i<n_configint && config[i]==test_config[i])  {i++;}
+        if (i == n_configint)  {return n;}    // only happens if all components equal
+        slot = (slot + 1) & mask;
+        }
+    return -1;
+    }
+
+// Dispatch to the hash table search, if a table is given (table_size > 0), or else to the bisection search.
+//
+PyInt find_config(BigInt* config, BigInt* configs, PyInt n_configs, PyInt n_configint, BigInt* table, PyInt table_size)
+    {
+    if (table_size > 0)  {return   hash_search(config, configs, n_configint, table, table_size);}
+    else                 {return bisect_search(config, configs, n_configint, 0, n_configs-1);}
+    }
+
+
+
+// Resolve a configuration into lists of the indices of its occupied and empty orbitals (in ascending
+// order), also recording the cumulative number of occupied orbitals at or below each index (for phases).
+//
+void unpack_config(BigInt* config,      // array of integers collectively holding the configuration
+                   PyInt   n_orbs,      // number of orbitals represented in the configuration
+                   int*    occupied,    // storage for the indices of the occupied orbitals (length n_orbs)
+                   int*    n_occ,       // number of occupied orbitals (output)
+                   int*    empty,       // storage for the indices of the empty orbitals (length n_orbs)
+                   int*    n_emt,       // number of empty orbitals (output)
+                   int*    cum_occ)     // storage for the cumulative number of occupied orbitals (length n_orbs)
+    {
+    int n_bits = orbs_per_configint();    // number of bits/orbitals in a BigInt
+    *n_occ = 0;                           // running index for cataloging the occupied orbitals ...
+    *n_emt = 0;                           // ... and the empty ones
+    for (int p=0; p<n_orbs; p++)    // loop over all orbitals
+        {
+        int Q = p / n_bits;                                              // Q=quotient:  in which component of config is orbital p?
+        int r = p % n_bits;                                              // r=remainder: which bit in ^this component is this orbital?
+        if (config[Q] & ((BigInt)1<<r))  {occupied[(*n_occ)++] = p;}    // if bit r is "on" in component Q, it is occupied, ...
+        else                             {   empty[(*n_emt)++] = p;}    // ... otherwise it is empty
+        cum_occ[p] = *n_occ;                                             // set after incrementing n_occ (so cumulative occupancy "counting this orb")
+        }
+    return;
+    }
+
+
+
+// The innermost update for OP_ACTION.  The ket configuration (index config_idx_R) of each vector in Psi_R connects
+// to the bra configuration (index config_idx_L) of the corresponding vector in Psi_L with matrix element val.  For
+// REDUCE_OWNER, the operator is symmetric, so the same matrix element connects the bra coefficients of Psi_R to the
+// ket slot of Psi_L, which is written only by the thread that owns this ket.
+//
+static inline void increment_output(int      reduction,       // REDUCE_ATOMIC, REDUCE_PRIVATE, or REDUCE_OWNER (see resolve() below)
+                                    Double** Psi_L,           // states being produced (incremented)
+                                    Double** Psi_R,           // states being acted on
+                                    PyInt    n_Psi,           // number of states in each of Psi_L and Psi_R
+                                    Double   val,             // the (phased) matrix element
+                                    BigInt   config_idx_L,    // index of the bra configuration
+                                    BigInt   config_idx_R)    // index of the ket configuration
+    {
+    if (reduction == REDUCE_OWNER)
+        {
+        for (int v=0; v<n_Psi; v++)  {Psi_L[v][config_idx_R] += val * Psi_R[v][config_idx_L];}    // pull into the owned slot
+        }
+    else if (reduction == REDUCE_ATOMIC)
+        {
+        for (int v=0; v<n_Psi; v++)    // for each vector in the input set ...
+            {
+            Double update = val * Psi_R[v][config_idx_R];    // ... connect the input configuration ...
+            #pragma omp atomic                               // ... (in a thread-safe way) ...
+            Psi_L[v][config_idx_L] += update;                // ... to the slot of the output
+            }
+        }
+    else
+        {
+        for (int v=0; v<n_Psi; v++)  {Psi_L[v][config_idx_L] += val * Psi_R[v][config_idx_R];}    // this thread's own (or private) output
+        }
+    return;
+    }
+
+
+
+// For the packed (symmetry-unique) storage of density tensors, this translates the linear index of an element of the
+// full tensor into the index of the element with the creation indices and the annihilation indices each in ascending
+// order (ranked in colexicographic order, creation substring as the slow index), and gives the phase of the permutation
+// between the two.  The packing array holds n_create and n_annihil, followed by a table of binomial coefficients, such
+// that packing[2 + j*(n_orbs+1) + m] is m-choose-j (for j from 0 up to the larger of n_create and n_annihil).
+//
+static inline BigInt pack_index(BigInt   full_idx,    // linear index in the full tensor
+                                PyInt    n_orbs,      // edge dimension of the full tensor
+                                BigInt*  packing,     // the packing information described above
+                                int*     phase)       // output: the phase of the permutation (as a reference)
+    {
+    int     n_create  = packing[0];
+    int     n_annihil = packing[1];
+    BigInt* binom     = packing + 2;
+    int     n_axes    = n_create + n_annihil;
+    int     idx[n_axes];
+    for (int i=n_axes-1; i>=0; i--)  {idx[i] = full_idx % n_orbs;  full_idx /= n_orbs;}    // the last axis is the fastest
+    int n_swaps = 0;
+    for (int i=1; i<n_axes; i++)    // insertion sort, separately for creation and annihilation substrings (very short)
+        {
+        int beg = (i < n_create) ? 0 : n_create;
+        for (int j=i; (j>beg) && (idx[j-1]>idx[j]); j--)  {int tmp=idx[j];  idx[j]=idx[j-1];  idx[j-1]=tmp;  n_swaps++;}
+        }
+    BigInt rank_c = 0;
+    BigInt rank_a = 0;
+    for (int j=0; j<n_create;  j++)  {rank_c += binom[(j+1)*(n_orbs+1) + idx[j]];}
+    for (int j=0; j<n_annihil; j++)  {rank_a += binom[(j+1)*(n_orbs+1) + idx[n_create+j]];}
+    *phase = (n_swaps%2) ? -1 : 1;
+    return rank_c * binom[n_annihil*(n_orbs+1) + n_orbs] + rank_a;
+    }
+
+
+
 // The recursive kernel for looping over orbital indices of a string of field operators for the
 // purpose of either acting an operator that is a linear combination of such strings or
 // computing the separate matrix elements of all such strings.  See comments with the driver
@@ -221,6 +387,8 @@ void resolve_recur(int      mode,              // OP_ACTION or COMPUTE_D (determ
                    BigInt*  configs_L,         // configuration strings representing the basis for the states in Psi_L
                    PyInt    n_configs_L,       // number of configurations in the basis configs_L
                    PyInt    n_configint_L,     // number of BigInts needed to store a single configuration in configs_L
+                   BigInt*  hash_L,            // hash table for configs_L (see build_config_hash()), unused if n_hash_L is zero
+                   PyInt    n_hash_L,          // size of the hash table for configs_L (zero to use bisection search instead)
                    Double** Psi_R,             // states being acted on (RHS of equation) for OP_ACTION; states in the ket (on right) for COMPUTE_D
                    PyInt    n_Psi_R,           // number of states in Psi_R (for OP_ACTION, must have n_Psi_L==n_Psi_R, above)
                    BigInt*  config_R,          // ket (right-hand) configuration being acted upon at present layer of recursion
@@ -229,6 +397,8 @@ void resolve_recur(int      mode,              // OP_ACTION or COMPUTE_D (determ
                    Double** tensors,           // tensor of matrix elements (sole entry) for OP_ACTION, or storage for output (array of arrays) for COMPUTE_D
                    PyInt    n_orbs,            // edge dimension of the tensor(s)
                    PyInt    global_phase,      // a global phase to be applied to the operator action
+                   int      reduction,         // REDUCE_ATOMIC, REDUCE_PRIVATE, or REDUCE_OWNER (see resolve() below; only used when incrementing output)
+                   BigInt*  packing,           // for COMPUTE_D, NULL for full storage of tensors, otherwise packed storage (see pack_index())
                    int*     occupied,          // indices of orbitals that are occupied in the configuration at the present level of recursion (not necessarily in order)
                    int      n_occ,             // number of orbitals that are occupied at the present level of recursion
                    int*     empty,             // indices of orbitals that are empty in the configuration at the present level of recursion (not necessarily in order)
@@ -297,7 +467,7 @@ void resolve_recur(int      mode,              // OP_ACTION or COMPUTE_D (determ
             if (reset_p_0)  {q_0 = 0;}    // ... unless we are switching from annihilation to creation operators
             *other_orb_list_entry = p;    // if we annihlated orbital p, we will want to loop over its creation as well (vice versa has no effect (or harm))
             // recur, passing through appropriately modified quantities (see below about inline updates)
-            resolve_recur(mode, n_create, n_annihil, Psi_L, n_Psi_L, configs_L, n_configs_L, n_configint_L, Psi_R, n_Psi_R, p_config_R, config_idx_R, n_configint_R, tensors, n_orbs, global_phase, occupied, n_occ, empty, n_emt, p_cum_occ, p_permute, op_idx+p*stride, stride*n_orbs, factor, q_0, thresh, wisdom, wisdom_det_idx, wisdom_op_idx);
+            resolve_recur(mode, n_create, n_annihil, Psi_L, n_Psi_L, configs_L, n_configs_L, n_configint_L, hash_L, n_hash_L, Psi_R, n_Psi_R, p_config_R, config_idx_R, n_configint_R, tensors, n_orbs, global_phase, reduction, packing, occupied, n_occ, empty, n_emt, p_cum_occ, p_permute, op_idx+p*stride, stride*n_orbs, factor, q_0, thresh, wisdom, wisdom_det_idx, wisdom_op_idx);
             }
         }
     else if (mode == OP_ACTION)    // bottom out option
@@ -313,7 +483,7 @@ void resolve_recur(int      mode,              // OP_ACTION or COMPUTE_D (determ
                 int r = p % n_bits;                                // ... modified configuration ...
                 memcpy(p_config_R, config_R, n_bytes_config_R);    // ... as discussed ...
                 p_config_R[Q] = p_config_R[Q] ^ ((BigInt)1<<r);    // ... above
-                BigInt config_idx_L = bisect_search(p_config_R, configs_L, n_configint_L, 0, n_configs_L-1);    // EXPENSIVE! -- find left-basis index of full string on right config
+                BigInt config_idx_L = find_config(p_config_R, configs_L, n_configs_L, n_configint_L, hash_L, n_hash_L);    // EXPENSIVE! -- find left-basis index of full string on right config
                 int i = (*wisdom_op_idx)++;                                         // get and increment the running index of the lookup table (whether used or not)
                 if (wisdom == GENERATE)  {wisdom_det_idx[i] = config_idx_L + 1;}    // if generating lookup table, store the left/bra index (fortran-style indexing)
                 if (config_idx_L != -1)    // do nothing if action takes outside of space of configurations
@@ -323,12 +493,7 @@ void resolve_recur(int      mode,              // OP_ACTION or COMPUTE_D (determ
                     if (compute_it)
                         {
                         val *= global_phase * phase;                             // ... delayed until we know operation was nonzero
-                        for (int v=0; v<n_Psi_R; v++)    // for each vector in the input set ...
-                            {
-                            Double update = val * Psi_R[v][config_idx_R];    // ... connect the input configuration ...
-                            #pragma omp atomic                               // ... (in a thread-safe way) ...
-                            Psi_L[v][config_idx_L] += update;                // ... to the slot of the output
-                            }
+                        increment_output(reduction, Psi_L, Psi_R, n_Psi_R, val, config_idx_L, config_idx_R);
                         }
                     if (wisdom == GENERATE)  {wisdom_det_idx[i] *= phase;}       // if generating lookup table, store the phase as the sign of the index (explains fortran-style indexing)
                     }
@@ -344,25 +509,38 @@ void resolve_recur(int      mode,              // OP_ACTION or COMPUTE_D (determ
             int r = p % n_bits;                                // ... modified configuration ...
             memcpy(p_config_R, config_R, n_bytes_config_R);    // ... as discussed ...
             p_config_R[Q] = p_config_R[Q] ^ ((BigInt)1<<r);    // ... above
-            BigInt config_idx_L = bisect_search(p_config_R, configs_L, n_configint_L, 0, n_configs_L-1);    // EXPENSIVE! -- find left-basis index of full string on right config
+            BigInt config_idx_L = find_config(p_config_R, configs_L, n_configs_L, n_configint_L, hash_L, n_hash_L);    // EXPENSIVE! -- find left-basis index of full string on right config
             int i = (*wisdom_op_idx)++;                                         // get and increment the running index of the lookup table (whether used or not)
             if (wisdom == GENERATE)  {wisdom_det_idx[i] = config_idx_L + 1;}    // if generating lookup table, store the left/bra index (fortran-style indexing)
             if (config_idx_L != -1)    // do nothing if action takes outside of space of configurations
                 {
-                int p_op_idx = p*stride + op_idx;                            // finish building tensor index (done inline with recursion above)
+                BigInt p_op_idx = p*stride + op_idx;                         // finish building tensor index (done inline with recursion above)
                 int p_permute = permute + cum_occ[n_orbs-1] - cum_occ[p];    // final permutation and ...
                 int phase = (p_permute%2) ? -1 : 1;                          // ... computation of resulting phase
+                int pack_phase = 1;                                          // (kept separate from phase, which may go into the wisdom)
+                if (packing != NULL)                                         // translate to packed storage, with phase to reach ascending-index element
+                    {
+                    p_op_idx = pack_index(p_op_idx, n_orbs, packing, &pack_phase);
+                    }
                 int braket = 0;                                              // initialize a running index for the bra-ket pairs
                 for (int vL=0; vL<n_Psi_L; vL++)    // loop over the bra states ...
                     {
-                    Double coeff_L = global_phase * phase * Psi_L[vL][config_idx_L];    // ... and get the phased coefficient of the left configuration for each state
+                    Double coeff_L = global_phase * pack_phase * phase * Psi_L[vL][config_idx_L];    // ... and get the phased coefficient of the left configuration for each state
                     if (fabs(coeff_L) > thresh)    // do nothing if left coefficient is too small (thresh considers also ket coefficient)
                         {
                         for (int vR=0; vR<n_Psi_R; vR++)    // loop over the ket states ...
                             {
                             Double update = coeff_L * Psi_R[vR][config_idx_R];    // ... and add the (phased) product of the left and right coefficients ...
-                            #pragma omp atomic                                    // ... (in a thread-safe way) ...
-                            tensors[braket++][p_op_idx] += update;                // ... to the precomputed location in the tensor for the corresponding bra-ket pair (which is incremented)
+                            if (reduction == REDUCE_ATOMIC)
+                                {
+                                #pragma omp atomic                                // ... (in a thread-safe way, if this output is shared) ...
+                                tensors[braket][p_op_idx] += update;              // ... to the precomputed location in the tensor for the corresponding bra-ket pair ...
+                                }
+                            else
+                                {
+                                tensors[braket][p_op_idx] += update;
+                                }
+                            braket++;                                             // ... (which is incremented)
                             }
                         }
                     else
@@ -374,6 +552,35 @@ void resolve_recur(int      mode,              // OP_ACTION or COMPUTE_D (determ
                 }
             }
         }
+    else if (mode == MATRIX_ELEM)    // bottom out option
+        {
+        // In this mode, there are no state vectors.  Psi_L[0] and wisdom_det_idx point to this ket's segment of storage for the values
+        // and bra indices of the matrix elements (in order of discovery, possibly with repeats), or both are NULL if only counting them.
+        for (int p_=p_0; p_<p_n; p_++)    // final orbital loop (see above)
+            {
+            int p = orb_list[p_];                                   // absolute index (see above)
+            Double val = factor * tensors[0][p*stride + op_idx];    // finish building tensor index (done inline with recursion above) and get integral from only tensor
+            if (fabs(val) > thresh)    // do nothing if the integral is too small
+                {
+                int Q = p / n_bits;                                // build ...
+                int r = p % n_bits;                                // ... modified configuration ...
+                memcpy(p_config_R, config_R, n_bytes_config_R);    // ... as discussed ...
+                p_config_R[Q] = p_config_R[Q] ^ ((BigInt)1<<r);    // ... above
+                BigInt config_idx_L = find_config(p_config_R, configs_L, n_configs_L, n_configint_L, hash_L, n_hash_L);    // EXPENSIVE! -- find left-basis index of full string on right config
+                if (config_idx_L != -1)    // do nothing if action takes outside of space of configurations
+                    {
+                    int p_permute = permute + cum_occ[n_orbs-1] - cum_occ[p];    // final permutation and ...
+                    int phase = (p_permute%2) ? -1 : 1;                          // ... computation of resulting phase
+                    BigInt i = (*wisdom_op_idx)++;                               // get and increment the running count of matrix elements for this ket
+                    if (wisdom_det_idx != NULL)    // if not only counting, record the bra index and the phased value
+                        {
+                        wisdom_det_idx[i] = config_idx_L;
+                        Psi_L[0][i] = val * global_phase * phase;
+                        }
+                    }
+                }
+            }
+        }
     else if (mode == WISDOM_ONLY)    // bottom out option
         {
         for (int p_=p_0; p_<p_n; p_++)    // final orbital loop (see above)
@@ -383,7 +590,7 @@ void resolve_recur(int      mode,              // OP_ACTION or COMPUTE_D (determ
             int r = p % n_bits;                                // ... modified configuration ...
             memcpy(p_config_R, config_R, n_bytes_config_R);    // ... as discussed ...
             p_config_R[Q] = p_config_R[Q] ^ ((BigInt)1<<r);    // ... above
-            BigInt config_idx_L = bisect_search(p_config_R, configs_L, n_configint_L, 0, n_configs_L-1);    // EXPENSIVE! -- find left-basis index of full string on right config
+            BigInt config_idx_L = find_config(p_config_R, configs_L, n_configs_L, n_configint_L, hash_L, n_hash_L);    // EXPENSIVE! -- find left-basis index of full string on right config
             int i = (*wisdom_op_idx)++;              // get and increment the running index of the lookup table
             wisdom_det_idx[i] = config_idx_L + 1;    // store the left/bra index (fortran-style indexing)
             if (config_idx_L != -1)    // do nothing if action takes outside of space of configurations
@@ -420,6 +627,8 @@ void resolve_recur_wise(int      mode,              // OP_ACTION or COMPUTE_D (d
                         Double** tensors,           // tensor of matrix elements (sole entry) for OP_ACTION, or storage for output (array of arrays) for COMPUTE_D
                         PyInt    n_orbs,            // edge dimension of the tensor(s)
                         PyInt    global_phase,      // a global phase to be applied to the operator action
+                        int      reduction,         // REDUCE_ATOMIC, REDUCE_PRIVATE, or REDUCE_OWNER (see resolve() below; only used when incrementing output)
+                        BigInt*  packing,           // for COMPUTE_D, NULL for full storage of tensors, otherwise packed storage (see pack_index())
                         int*     occupied,          // indices of orbitals that are occupied in the configuration at the present level of recursion (not necessarily in order)
                         int      n_occ,             // number of orbitals that are occupied at the present level of recursion
                         int*     empty,             // indices of orbitals that are empty in the configuration at the present level of recursion (not necessarily in order)
@@ -470,7 +679,7 @@ void resolve_recur_wise(int      mode,              // OP_ACTION or COMPUTE_D (d
             if (reset_p_0)  {q_0 = 0;}    // ... unless we are switching from annihilation to creation operators
             *other_orb_list_entry = p;    // if we annihlated orbital p, we will want to loop over its creation as well (vice versa has no effect (or harm))
             // recur, passing through appropriately modified quantities (see below about inline updates)
-            resolve_recur_wise(mode, n_create, n_annihil, Psi_L, n_Psi_L, Psi_R, n_Psi_R, config_idx_R, tensors, n_orbs, global_phase, occupied, n_occ, empty, n_emt, op_idx+p*stride, stride*n_orbs, factor, q_0, thresh, wisdom_det_idx, wisdom_op_idx);
+            resolve_recur_wise(mode, n_create, n_annihil, Psi_L, n_Psi_L, Psi_R, n_Psi_R, config_idx_R, tensors, n_orbs, global_phase, reduction, packing, occupied, n_occ, empty, n_emt, op_idx+p*stride, stride*n_orbs, factor, q_0, thresh, wisdom_det_idx, wisdom_op_idx);
             }
         }
     else if (mode == OP_ACTION)    // bottom out option
@@ -488,12 +697,7 @@ void resolve_recur_wise(int      mode,              // OP_ACTION or COMPUTE_D (d
                 if (config_idx_L != -1)    // do nothing if action takes outside of space of configurations
                     {
                     val *= global_phase * phase;    // rephase the tensor element
-                    for (int v=0; v<n_Psi_R; v++)    // for each vector in the input set ...
-                        {
-                        Double update = val * Psi_R[v][config_idx_R];    // ... connect the input configuration ...
-                        #pragma omp atomic                               // ... (in a thread-safe way) ...
-                        Psi_L[v][config_idx_L] += update;                // ... to the slot of the output
-                        }
+                    increment_output(reduction, Psi_L, Psi_R, n_Psi_R, val, config_idx_L, config_idx_R);
                     }
                 }
             else
@@ -513,7 +717,13 @@ void resolve_recur_wise(int      mode,              // OP_ACTION or COMPUTE_D (d
             extract(&phase, &config_idx_L, wisdom_det_idx[i]);    // extract the phase and bra index from the lookup table
             if (config_idx_L != -1)    // do nothing if action takes outside of space of configurations
                 {
-                int p_op_idx = p*stride + op_idx;                            // finish building tensor index (done inline with recursion above)
+                BigInt p_op_idx = p*stride + op_idx;                         // finish building tensor index (done inline with recursion above)
+                if (packing != NULL)                                         // translate to packed storage, with phase to reach ascending-index element
+                    {
+                    int pack_phase;
+                    p_op_idx = pack_index(p_op_idx, n_orbs, packing, &pack_phase);
+                    phase *= pack_phase;
+                    }
                 int braket = 0;                                              // initialize a running index for the bra-ket pairs
                 for (int vL=0; vL<n_Psi_L; vL++)    // loop over the bra states ...
                     {
@@ -523,8 +733,16 @@ void resolve_recur_wise(int      mode,              // OP_ACTION or COMPUTE_D (d
                         for (int vR=0; vR<n_Psi_R; vR++)    // loop over the ket states ...
                             {
                             Double update = coeff_L * Psi_R[vR][config_idx_R];    // ... and add the (phased) product of the left and right coefficients ...
-                            #pragma omp atomic                                    // ... (in a thread-safe way) ...
-                            tensors[braket++][p_op_idx] += update;                // ... to the precomputed location in the tensor for the corresponding bra-ket pair (which is incremented)
+                            if (reduction == REDUCE_ATOMIC)
+                                {
+                                #pragma omp atomic                                // ... (in a thread-safe way, if this output is shared) ...
+                                tensors[braket][p_op_idx] += update;              // ... to the precomputed location in the tensor for the corresponding bra-ket pair ...
+                                }
+                            else
+                                {
+                                tensors[braket][p_op_idx] += update;
+                                }
+                            braket++;                                             // ... (which is incremented)
                             }
                         }
                     else
@@ -566,6 +784,15 @@ void resolve_recur_wise(int      mode,              // OP_ACTION or COMPUTE_D (d
 // loop over the ket configurations, with loops over orbital indices and ket (and perhaps bra)
 // coefficients delegated to the recursive kernel.
 //
+// Since different ket configurations contribute to the same output elements, the threads must be
+// kept from colliding when they increment them.  With REDUCE_ATOMIC every update is protected
+// by omp atomic, which costs no memory but serializes the threads when they hit the same elements.
+// With REDUCE_PRIVATE, each thread has its own copy of the output, and these are summed at the end,
+// which scales well as long as there is memory for n_threads-1 copies.  With REDUCE_OWNER (only for
+// OP_ACTION with a symmetric operator), the roles of bra and ket configurations are swapped at the
+// bottom of the recursion, so that each ket configuration gathers its own output element, which
+// is written by no other thread.  The choice is made by the caller (see field_op.py).
+//
 void resolve(int      mode,               // OP_ACTION or COMPUTE_D (determines whether using Psi_L for storing new states or as bras)
              PyInt    n_create,           // number of creation operators
              PyInt    n_annihil,          // number of annihilation operators
@@ -574,6 +801,8 @@ void resolve(int      mode,               // OP_ACTION or COMPUTE_D (determines
              BigInt*  configs_L,          // configuration strings representing the basis for the states in Psi_L
              PyInt    n_configs_L,        // number of configurations in the basis configs_L
              PyInt    n_configint_L,      // number of BigInts needed to store a single configuration in configs_L
+             BigInt*  hash_L,             // hash table for configs_L (see build_config_hash()), unused if n_hash_L is zero
+             PyInt    n_hash_L,           // size of the hash table for configs_L (zero to use bisection search instead)
              Double** Psi_R,              // states being acted on (RHS of equation) for OP_ACTION; states in the ket (on right) for COMPUTE_D
              PyInt    n_Psi_R,            // number of states in Psi_R (for OP_ACTION, must have n_Psi_L==n_Psi_R, above)
              BigInt*  configs_R,          // configuration strings representing the basis for the states in Psi_R
@@ -586,63 +815,119 @@ void resolve(int      mode,               // OP_ACTION or COMPUTE_D (determines
              PyInt    wisdom,             // IGNORE, GENERATE, or APPLY (determines what, if anything, we will do with pointers to the wisdom/lookup tables)
              Int**    wisdom_occupied,    // for each ket config, a list (in ascending order) of the orbitals occupied in that ket
              BigInt** wisdom_det_idx,     // for each ket config, a list of the (possibly negated) index that each respective field-operator string gives projection onto
-             PyInt    n_threads)          // number of threads to spread the work over
+             PyInt    n_threads,          // number of threads to spread the work over
+             PyInt    reduction,          // REDUCE_ATOMIC, REDUCE_PRIVATE, or REDUCE_OWNER (see below)
+             BigInt*  packing)            // for COMPUTE_D, NULL for full storage of tensors, otherwise packed storage (see pack_index())
     {
-    omp_set_num_threads(n_threads);       // declare the number of threads to use
-    int n_bits = orbs_per_configint();    // number of bits/orbitals in a BigInt
+    omp_set_num_threads(n_threads);    // declare the number of threads to use
+
+    // The output being incremented (and its shape) is the left-hand states for OP_ACTION, or the tensors for COMPUTE_D
+    Double** output   = (mode == OP_ACTION) ? Psi_L       : tensors;
+    PyInt    n_output = (mode == OP_ACTION) ? n_Psi_L     : n_Psi_L * n_Psi_R;
+    BigInt   out_len  = (mode == OP_ACTION) ? n_configs_L : 1;
+    if (mode == COMPUTE_D)
+        {
+        if (packing == NULL)  {for (int i=0; i<n_create+n_annihil; i++)  {out_len *= n_orbs;}}
+        else                  {out_len = packing[2 + n_create*(n_orbs+1) + n_orbs] * packing[2 + n_annihil*(n_orbs+1) + n_orbs];}
+        }
+    if ((mode != OP_ACTION) && (mode != COMPUTE_D))  {n_output = 0;}    // nothing to increment (eg, WISDOM_ONLY)
 
-    #pragma omp parallel for               // divide the outermost loop over the threads (omp atomic at update to avoid race condition)
-    for (PyInt n=0; n<n_configs_R; n++)    // loop over configurations in ket basis
+    // With REDUCE_PRIVATE, all threads but the first get a zeroed copy of the output (the first thread writes to the output itself),
+    // and the copies are summed into the output at the end.  If there is only one thread, no protection is needed at all.  If the
+    // copies cannot be allocated, fall back to REDUCE_ATOMIC.  With REDUCE_OWNER (symmetric operators only), each thread pulls
+    // contributions into the output slots of the ket configurations it handles, so no two threads write the same slot.
+    Double* private_out = (Double*)NULL;
+    if ((n_threads == 1) || (n_output == 0))  {reduction = REDUCE_PRIVATE;}
+    else if (reduction == REDUCE_PRIVATE)
         {
-        Double biggest = 0;    // eventual value of the biggest coefficient for a given ket configuration
-        for (int v=0; v<n_Psi_R; v++)    // loop over ket states
+        private_out = (Double*)calloc((n_threads-1) * n_output * out_len, sizeof(Double));
+        if (private_out == NULL)  {reduction = REDUCE_ATOMIC;}
+        }
+
+    // With REDUCE_OWNER, the coefficient multiplying a matrix element is not that of the ket configuration being looped over, so
+    // ket configurations cannot be skipped based on their own coefficients, and thresh is applied relative to the biggest overall.
+    Double biggest_all = 0;
+    if (reduction == REDUCE_OWNER)
+        {
+        for (int v=0; v<n_Psi_R; v++)
             {
-            Double size = fabs(Psi_R[v][n]);          // get the configuration coefficient ...
-            if (size > biggest)  {biggest = size;}    // ... for each state and compare to others
+            for (PyInt n=0; n<n_configs_R; n++)  {if (fabs(Psi_R[v][n]) > biggest_all)  {biggest_all = fabs(Psi_R[v][n]);}}
             }
+        }
 
-        if ((biggest > thresh) || (wisdom == GENERATE))    // do nothing if the configuration has no significant coefficients, unless we are generating wisdom/lookup tables
+    #pragma omp parallel
+        {
+        Double** Psi_L_t   = Psi_L;      // the left-hand states ...
+        Double** tensors_t = tensors;    // ... and tensors to be used by this thread, one of which ...
+        Double*  output_t[n_output>0 ? n_output : 1];    // ... might be replaced by a private copy of the output
+        int thread = omp_get_thread_num();
+        if ((private_out != NULL) && (thread > 0))
             {
-            BigInt* config = configs_R + (n * n_configint_R);    // config[] is now an array of integers collectively holding the present configuration
-
-            int occupied[n_orbs];   // for indices of orbitals that are occupied in the present configuration (will be appended out of order in recursion)
-            int empty[n_orbs];      // for indices of orbitals that are empty    in the present configuration (will be appended out of order in recursion
-            int cum_occ[n_orbs];    // for the cumulative number of orbitals at or below a given index that are occupied (for phase calculations)
-            int n_occ = 0;          // eventual number of occupied orbitals (also a running index for cataloging their indices below)
-            int n_emt = 0;          // eventual number of empty    orbitals (also a running index for cataloging their indices below)
-            for (int p=0; p<n_orbs; p++)    // loop over all orbitals
-                {
-                int Q = p / n_bits;                                          // Q=quotient:  in which component of config is orbital p?
-                int r = p % n_bits;                                          // r=remainder: which bit in ^this component is this orbital?
-                if (config[Q] & ((BigInt)1<<r))  {occupied[n_occ++] = p;}    // if bit r is "on" in component Q, it is occupied, ...
-                else                             {   empty[n_emt++] = p;}    // ... otherwise it is empty
-                cum_occ[p] = n_occ;                                          // set after incrementing n_occ (so cumulative occupancy "counting this orb")
-                }
+            for (PyInt i=0; i<n_output; i++)  {output_t[i] = private_out + ((thread-1) * n_output + i) * out_len;}
+            if (mode == OP_ACTION)  {Psi_L_t   = output_t;}
+            else                    {tensors_t = output_t;}
+            }
 
-            BigInt* wisdom_det_idx_n = (BigInt*)NULL;    // if wisdom generated or used, the row of the lookup table for this ket config (NULL otherwise)
-            BigInt  wisdom_op_idx = 0;                   // if wisdom generated or used, the running index for the lookup table (intialized here, passed by reference for incrementing)
-            if (wisdom == GENERATE)
-                {
-                for (int i=0; i<n_occ; i++)  {wisdom_occupied[n][i] = occupied[i];}    // "permanent" record of the occupied orbitals for this ket config (as opposed to the working version being copied)
-                }
-            if ((wisdom == GENERATE) || (wisdom == APPLY))
+        #pragma omp for schedule(dynamic,16)    // divide the outermost loop over the threads
+        for (PyInt n=0; n<n_configs_R; n++)     // loop over configurations in ket basis
+            {
+            Double biggest = biggest_all;    // eventual value of the biggest coefficient for a given ket configuration
+            if (reduction != REDUCE_OWNER)
                 {
-                wisdom_det_idx_n = wisdom_det_idx[n];                                  // assign the correct pointer if used
+                for (int v=0; v<n_Psi_R; v++)    // loop over ket states
+                    {
+                    Double size = fabs(Psi_R[v][n]);          // get the configuration coefficient ...
+                    if (size > biggest)  {biggest = size;}    // ... for each state and compare to others
+                    }
                 }
 
-            // begin the recursive kernel that loops over orbital indices for the operator string, and coefficients for the ket (and perhaps bra) state(s)
-            // dividing thresh/biggest yields a an effective threshold for multiplier of a ket coefficient (like a matrix element or a bra coefficient)
-            if (wisdom == APPLY)    // use the wisdom/lookup tables
+            if ((biggest > thresh) || (wisdom == GENERATE))    // do nothing if the configuration has no significant coefficients, unless we are generating wisdom/lookup tables
                 {
-                resolve_recur_wise(mode, n_create, n_annihil, Psi_L, n_Psi_L, Psi_R, n_Psi_R, n, tensors, n_orbs, phase, occupied, n_occ, empty, n_emt, 0, 1, 1, 0, thresh/biggest, wisdom_det_idx_n, &wisdom_op_idx);
+                BigInt* config = configs_R + (n * n_configint_R);    // config[] is now an array of integers collectively holding the present configuration
+
+                int occupied[n_orbs];   // for indices of orbitals that are occupied in the present configuration (will be appended out of order in recursion)
+                int empty[n_orbs];      // for indices of orbitals that are empty    in the present configuration (will be appended out of order in recursion
+                int cum_occ[n_orbs];    // for the cumulative number of orbitals at or below a given index that are occupied (for phase calculations)
+                int n_occ, n_emt;       // eventual numbers of occupied and empty orbitals
+                unpack_config(config, n_orbs, occupied, &n_occ, empty, &n_emt, cum_occ);
+
+                BigInt* wisdom_det_idx_n = (BigInt*)NULL;    // if wisdom generated or used, the row of the lookup table for this ket config (NULL otherwise)
+                BigInt  wisdom_op_idx = 0;                   // if wisdom generated or used, the running index for the lookup table (intialized here, passed by reference for incrementing)
+                if (wisdom == GENERATE)
+                    {
+                    for (int i=0; i<n_occ; i++)  {wisdom_occupied[n][i] = occupied[i];}    // "permanent" record of the occupied orbitals for this ket config (as opposed to the working version being copied)
+                    }
+                if ((wisdom == GENERATE) || (wisdom == APPLY))
+                    {
+                    wisdom_det_idx_n = wisdom_det_idx[n];                                  // assign the correct pointer if used
+                    }
+
+                // begin the recursive kernel that loops over orbital indices for the operator string, and coefficients for the ket (and perhaps bra) state(s)
+                // dividing thresh/biggest yields a an effective threshold for multiplier of a ket coefficient (like a matrix element or a bra coefficient)
+                if (wisdom == APPLY)    // use the wisdom/lookup tables
+                    {
+                    resolve_recur_wise(mode, n_create, n_annihil, Psi_L_t, n_Psi_L, Psi_R, n_Psi_R, n, tensors_t, n_orbs, phase, reduction, packing, occupied, n_occ, empty, n_emt, 0, 1, 1, 0, thresh/biggest, wisdom_det_idx_n, &wisdom_op_idx);
+                    }
+                else                    // find bra indices by modifying configurations and then searching, perhaps generating wisdom/lookup tables
+                    {
+                    resolve_recur(mode, n_create, n_annihil, Psi_L_t, n_Psi_L, configs_L, n_configs_L, n_configint_L, hash_L, n_hash_L, Psi_R, n_Psi_R, config, n, n_configint_R, tensors_t, n_orbs, phase, reduction, packing, occupied, n_occ, empty, n_emt, cum_occ, 0, 0, 1, 1, 0, thresh/biggest, wisdom, wisdom_det_idx_n, &wisdom_op_idx);
+                    }
                 }
-            else                    // find bra indices by modifying configurations and then searching, perhaps generating wisdom/lookup tables
+            }
+
+        if (private_out != NULL)    // sum the private copies into the output, with each thread handling a contiguous chunk of elements (after implicit barrier above)
+            {
+            #pragma omp for schedule(static)
+            for (BigInt e=0; e<n_output*out_len; e++)
                 {
-                resolve_recur(mode, n_create, n_annihil, Psi_L, n_Psi_L, configs_L, n_configs_L, n_configint_L, Psi_R, n_Psi_R, config, n, n_configint_R, tensors, n_orbs, phase, occupied, n_occ, empty, n_emt, cum_occ, 0, 0, 1, 1, 0, thresh/biggest, wisdom, wisdom_det_idx_n, &wisdom_op_idx);
+                Double sum = 0;
+                for (int t=0; t<n_threads-1; t++)  {sum += private_out[t * n_output * out_len + e];}
+                output[e/out_len][e%out_len] += sum;
                 }
             }
         }
 
+    free(private_out);
     return;
     }
 
@@ -688,14 +973,17 @@ void op_Psi(PyInt    n_elec,             // electron order of the operator
             BigInt*  configs,            // configuration strings representing the basis for the states in Psi and opPsi (see global comments above about format)
             PyInt    n_configs,          // number of configurations in the configs basis (call signature ok if PyInt not longer than BigInt)
             PyInt    n_configint,        // number of BigInts needed to store a single configuration in configs
+            BigInt*  config_hash,        // hash table for configs (see build_config_hash()), unused if n_config_hash is zero
+            PyInt    n_config_hash,      // size of the hash table for configs (zero to use bisection search instead)
             PyFloat  thresh,             // perform no further work if result will be smaller than this
             PyInt    wisdom,             // IGNORE, GENERATE, or APPLY (determines what, if anything, we will do with pointers to the wisdom/lookup tables)
             Int**    wisdom_occupied,    // for each ket config, a list (in ascending order) of the orbitals occupied in that ket
             BigInt** wisdom_det_idx,     // for each ket config, a list of the (possibly negated) index that each respective field-operator string gives projection onto
-            PyInt    n_threads)          // number of threads to spread the work over
+            PyInt    n_threads,          // number of threads to spread the work over
+            PyInt    reduction)          // REDUCE_ATOMIC, REDUCE_PRIVATE, or REDUCE_OWNER (only if op is symmetric) to keep threads from colliding on output
     {
     // call the generic driver in operator-action mode
-    resolve(OP_ACTION, n_elec, n_elec, opPsi, n_Psi, configs, n_configs, n_configint, Psi, n_Psi, configs, n_configs, n_configint, &op, n_orbs, phase, thresh, wisdom, wisdom_occupied, wisdom_det_idx, n_threads);
+    resolve(OP_ACTION, n_elec, n_elec, opPsi, n_Psi, configs, n_configs, n_configint, config_hash, n_config_hash, Psi, n_Psi, configs, n_configs, n_configint, &op, n_orbs, phase, thresh, wisdom, wisdom_occupied, wisdom_det_idx, n_threads, reduction, (BigInt*)NULL);
     return;
     }
 
@@ -722,6 +1010,9 @@ void op_Psi(PyInt    n_elec,             // electron order of the operator
 // from left to right separately for the creation and annihilation substrings.  Due to the fundamental
 // antisymmetry of the operators, the missing elements are redundant with these (to within a phase) and
 // should be populated by a antisymmetrization step. This is more efficient that computing them independently.
+// Alternatively, if packing information is given (see pack_index()), each block of rho holds only the
+// elements with creation and annihilation indices each in ascending order (already antisymmetrized), as
+// a matrix with (n_orbs choose n_create) rows and (n_orbs choose n_annihil) columns.
 //
 // Each bra and ket state vector is contiguous in memory, but they need not be adjacent to each other.
 // The length of these vectors should be the same as the number of their respective configurations.  The
@@ -741,6 +1032,8 @@ void densities(PyInt    n_create,           // number of creation operators
                BigInt*  configs_bra,        // configuration strings representing the basis for the bras (see global comments above about format)
                PyInt    n_configs_bra,      // number of configurations in the basis configs_bra (call signature ok if PyInt not longer than BigInt)
                PyInt    n_configint_bra,    // number of BigInts needed to store a single configuration in configs_bra
+               BigInt*  hash_bra,           // hash table for configs_bra (see build_config_hash()), unused if n_hash_bra is zero
+               PyInt    n_hash_bra,         // size of the hash table for configs_bra (zero to use bisection search instead)
                Double** kets,               // array of row vectors: kets for transition-density tensors
                PyInt    n_kets,             // number of kets
                BigInt*  configs_ket,        // configuration strings representing the basis for the kets (see global comments above about format)
@@ -750,10 +1043,13 @@ void densities(PyInt    n_create,           // number of creation operators
                PyInt    wisdom,             // IGNORE, GENERATE, or APPLY (determines what, if anything, we will do with pointers to the wisdom/lookup tables)
                Int**    wisdom_occupied,    // for each ket config, a list (in ascending order) of the orbitals occupied in that ket
                BigInt** wisdom_det_idx,     // for each ket config, a list of the (possibly negated) index that each respective field-operator string gives projection onto
-               PyInt    n_threads)          // number of threads to spread the work over
+               PyInt    n_threads,          // number of threads to spread the work over
+               PyInt    reduction,          // REDUCE_ATOMIC or REDUCE_PRIVATE to keep threads from colliding on output
+               BigInt*  packing)            // packing information for symmetry-unique storage (see pack_index()), or first element negative for full storage
     {
+    if (packing[0] < 0)  {packing = (BigInt*)NULL;}
     // call the generic driver in compute-densities mode
-    resolve(COMPUTE_D, n_create, n_annihil, bras, n_bras, configs_bra, n_configs_bra, n_configint_bra, kets, n_kets, configs_ket, n_configs_ket, n_configint_ket, rho, n_orbs, phase, thresh, wisdom, wisdom_occupied, wisdom_det_idx, n_threads);
+    resolve(COMPUTE_D, n_create, n_annihil, bras, n_bras, configs_bra, n_configs_bra, n_configint_bra, hash_bra, n_hash_bra, kets, n_kets, configs_ket, n_configs_ket, n_configint_ket, rho, n_orbs, phase, thresh, wisdom, wisdom_occupied, wisdom_det_idx, n_threads, reduction, packing);
     return;
     }
 
@@ -799,6 +1095,8 @@ void generate_wisdom(PyInt    n_create,           // number of creation operator
                      BigInt*  configs_bra,        // configuration strings representing the basis for the bras (see global comments above about format)
                      PyInt    n_configs_bra,      // number of configurations in the basis configs_bra (call signature ok if PyInt not longer than BigInt)
                      PyInt    n_configint_bra,    // number of BigInts needed to store a single configuration in configs_bra
+                     BigInt*  hash_bra,           // hash table for configs_bra (see build_config_hash()), unused if n_hash_bra is zero
+                     PyInt    n_hash_bra,         // size of the hash table for configs_bra (zero to use bisection search instead)
                      BigInt*  configs_ket,        // configuration strings representing the basis for the kets (see global comments above about format)
                      PyInt    n_configs_ket,      // number of configurations in the basis configs_ket (call signature ok if PyInt not longer than BigInt)
                      PyInt    n_configint_ket,    // number of BigInts needed to store a single configuration in configs_ket
@@ -807,7 +1105,123 @@ void generate_wisdom(PyInt    n_create,           // number of creation operator
                      PyInt    n_threads)          // number of threads to spread the work over
     {
     // call the generic driver in compute-densities mode
-    resolve(WISDOM_ONLY, n_create, n_annihil, (Double**)NULL, 0, configs_bra, n_configs_bra, n_configint_bra, (Double**)NULL, 0, configs_ket, n_configs_ket, n_configint_ket, (Double**)NULL, n_orbs, 1, 0., GENERATE, wisdom_occupied, wisdom_det_idx, n_threads);
+    resolve(WISDOM_ONLY, n_create, n_annihil, (Double**)NULL, 0, configs_bra, n_configs_bra, n_configint_bra, hash_bra, n_hash_bra, (Double**)NULL, 0, configs_ket, n_configs_ket, n_configint_ket, (Double**)NULL, n_orbs, 1, 0., GENERATE, wisdom_occupied, wisdom_det_idx, n_threads, REDUCE_PRIVATE, (BigInt*)NULL);
+    return;
+    }
+
+
+// This function takes an n-electron (n_elec) operator, whose matrix elements are given (op) in a basis
+// with a given number of orbitals (n_orb), as for op_Psi() above, and resolves it into its individual
+// matrix elements between the configurations (configs) of a basis, so that it can be stored as a sparse
+// matrix and applied repeatedly without redoing the work of the recursion (see csr_op_Psi() below).
+//
+// The work is done in two passes.  If store is zero, only the number of matrix elements connecting each
+// ket configuration to the bras is written to counts (which has length n_configs), and the remaining
+// arguments may be dummies.  Otherwise, the matrix elements are written to the elem_bra and elem_val
+// arrays, with those of ket configuration n starting at offsets[n], and counts is again populated.  The
+// elements are in order of discovery, and one pair of bra and ket may appear more than once (the caller
+// is responsible for summing these).  Elements whose integral is smaller than thresh are neglected.
+//
+void op_matrix_elems(PyInt    n_elec,         // electron order of the operator
+                     Double*  op,             // tensor of matrix elements (integrals), assumed antisymmetrized
+                     PyInt    n_orbs,         // edge dimension of the integrals tensor
+                     PyInt    phase,          // a global phase to be applied to the operator action
+                     BigInt*  configs,        // configuration strings representing the basis (see global comments above about format)
+                     PyInt    n_configs,      // number of configurations in the configs basis
+                     PyInt    n_configint,    // number of BigInts needed to store a single configuration in configs
+                     BigInt*  config_hash,    // hash table for configs (see build_config_hash()), unused if n_config_hash is zero
+                     PyInt    n_config_hash,  // size of the hash table for configs (zero to use bisection search instead)
+                     PyFloat  thresh,         // neglect integrals smaller than this
+                     PyInt    store,          // whether to store the elements (nonzero) or only count them (zero)
+                     BigInt*  counts,         // output: the number of elements for each ket configuration
+                     BigInt*  offsets,        // where the elements for each ket configuration start in the two arrays below (if storing)
+                     BigInt*  elem_bra,       // output: bra index of each element (if storing)
+                     Double*  elem_val,       // output: value of each element (if storing)
+                     PyInt    n_threads)      // number of threads to spread the work over
+    {
+    omp_set_num_threads(n_threads);    // declare the number of threads to use
+
+    #pragma omp parallel for schedule(dynamic,64)    // each ket writes only to its own segment of storage, so no race conditions
+    for (PyInt n=0; n<n_configs; n++)    // loop over configurations in ket basis
+        {
+        BigInt* config = configs + (n * n_configint);    // config[] is now an array of integers collectively holding the present configuration
+
+        int occupied[n_orbs];   // see comments ...
+        int empty[n_orbs];      // ... with the ...
+        int cum_occ[n_orbs];    // ... analogous ...
+        int n_occ, n_emt;       // ... code in resolve()
+        unpack_config(config, n_orbs, occupied, &n_occ, empty, &n_emt, cum_occ);
+
+        BigInt  n_elems = 0;                                              // running count of elements for this ket (passed by reference for incrementing)
+        Double* val_n   = store ? elem_val + offsets[n] : (Double*)NULL;    // this ket's segment of the storage, ...
+        BigInt* bra_n   = store ? elem_bra + offsets[n] : (BigInt*)NULL;    // ... if storing
+        resolve_recur(MATRIX_ELEM, n_elec, n_elec, &val_n, 1, configs, n_configs, n_configint, config_hash, n_config_hash, (Double**)NULL, 0, config, n, n_configint, &op, n_orbs, phase, REDUCE_PRIVATE, (BigInt*)NULL, occupied, n_occ, empty, n_emt, cum_occ, 0, 0, 1, 1, 0, thresh, IGNORE, bra_n, &n_elems);
+        counts[n] = n_elems;
+        }
+
+    return;
+    }
+
+// This function acts a sparse matrix, stored in compressed-sparse-row (CSR) format, on a set of a
+// certain number (n_Psi) of state vectors (Psi) to produce (technically increment) another set of vectors
+// (opPsi).  Row i of the matrix has its column indices and values stored in col_idx and values, in the
+// positions from row_ptr[i] to row_ptr[i+1]-1.  Since each thread owns the rows it computes, there is no
+// contention for the output.  This version is for 32-bit (Int) column indices; csr_op_Psi_big() below is
+// identical, except for 64-bit (BigInt) column indices.
+//
+void csr_op_Psi(BigInt*  row_ptr,      // start of each row in col_idx and values (length n_rows+1)
+                Int*     col_idx,      // column index of each stored element
+                Double*  values,       // value of each stored element
+                PyInt    n_rows,       // number of rows in the matrix (and length of the vectors)
+                Double** opPsi,        // array of row vectors: incremented by output
+                Double** Psi,          // array of row vectors: input vectors to act on
+                PyInt    n_Psi,        // how many vectors we are acting on and producing simultaneously in Psi and opPsi
+                PyInt    n_threads)    // number of threads to spread the work over
+    {
+    omp_set_num_threads(n_threads);    // declare the number of threads to use
+
+    #pragma omp parallel for schedule(dynamic,256)
+    for (PyInt i=0; i<n_rows; i++)
+        {
+        Double sum[n_Psi];                                 // accumulate each row for all vectors ...
+        for (int v=0; v<n_Psi; v++)  {sum[v] = 0;}         // ... so that the elements are only traversed once
+        for (BigInt k=row_ptr[i]; k<row_ptr[i+1]; k++)
+            {
+            Double val = values[k];
+            Int    j   = col_idx[k];
+            for (int v=0; v<n_Psi; v++)  {sum[v] += val * Psi[v][j];}
+            }
+        for (int v=0; v<n_Psi; v++)  {opPsi[v][i] += sum[v];}
+        }
+
+    return;
+    }
+
+void csr_op_Psi_big(BigInt*  row_ptr,      // see ...
+                    BigInt*  col_idx,      // ... comments ...
+                    Double*  values,       // ... with ...
+                    PyInt    n_rows,       // ... csr_op_Psi() ...
+                    Double** opPsi,        // ... above
+                    Double** Psi,
+                    PyInt    n_Psi,
+                    PyInt    n_threads)
+    {
+    omp_set_num_threads(n_threads);
+
+    #pragma omp parallel for schedule(dynamic,256)
+    for (PyInt i=0; i<n_rows; i++)
+        {
+        Double sum[n_Psi];
+        for (int v=0; v<n_Psi; v++)  {sum[v] = 0;}
+        for (BigInt k=row_ptr[i]; k<row_ptr[i+1]; k++)
+            {
+            Double val = values[k];
+            BigInt j   = col_idx[k];
+            for (int v=0; v<n_Psi; v++)  {sum[v] += val * Psi[v][j];}
+            }
+        for (int v=0; v<n_Psi; v++)  {opPsi[v][i] += sum[v];}
+        }
+
     return;
     }
 
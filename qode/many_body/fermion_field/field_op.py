@@ -16,6 +16,7 @@
 #    along with Qode.  If not, see <http://www.gnu.org/licenses/>.
 #
 import math
+import itertools
 import numpy
 from ...util.PyC import import_C, Int, Double, BigInt
 
@@ -27,6 +28,10 @@ from ...util.PyC import import_C, Int, Double, BigInt
 field_op = import_C("field_op", flags="-O3 -lm -fopenmp")
 field_op.orbs_per_configint.return_type(int)
 field_op.bisect_search.return_type(int)
+field_op.hash_search.return_type(int)
+field_op.op_Psi.arg_types(int, Double, int, int, [Double], [Double], int, BigInt, int, int, BigInt, int, float, int, [Int], [BigInt], int, int)    # called often in iterative solvers
+field_op.csr_op_Psi.arg_types(BigInt, Int, Double, int, [Double], [Double], int, int)
+field_op.csr_op_Psi_big.arg_types(BigInt, BigInt, Double, int, [Double], [Double], int, int)
 
 antisymm = import_C("antisymm", flags="-O3")
 
@@ -36,18 +41,38 @@ antisymm = import_C("antisymm", flags="-O3")
 
 orbs_per_configint = field_op.orbs_per_configint()
 
+# Unless hashed=False, an open-addressing hash table of the configurations is also built (at least twice as many
+# slots as configurations), which the C code uses to look up configurations, instead of a bisection search.
+# Configurations already in packed form (for example, from configurations.all_configs_packed, which avoids
+# building python integers altogether) are taken by the from_packed() constructor.
 class packed_configs(object):
-    def __init__(self, configs):
-        self.length = len(configs)
-        max_orbs  = math.floor(1 + math.log(configs[-1],2))
-        self.size = 1 + int(max_orbs)//orbs_per_configint
-        self.packed = numpy.zeros(self.length * self.size, dtype=BigInt.numpy, order="C")
-        reduction = 2**orbs_per_configint
-        for i,config in enumerate(configs):
-            reduced = config
-            for n in range(self.size):
-                self.packed[i*self.size + n] = reduced % reduction
-                reduced //= reduction
+    def __init__(self, configs, hashed=True):
+        size = 1 + int(configs[-1]).bit_length()//orbs_per_configint    # (exact, unlike a floating-point log)
+        if size==1:
+            packed = numpy.array(configs, dtype=BigInt.numpy)
+        else:
+            reduced = numpy.array(configs, dtype=object)    # python integers, but looping in numpy
+            packed  = numpy.zeros((len(configs), size), dtype=BigInt.numpy, order="C")
+            for n in range(size):
+                packed[:,n] = reduced % 2**orbs_per_configint
+                reduced   //= 2**orbs_per_configint
+        self._initialize(packed.reshape(len(configs), size), hashed)
+    @classmethod
+    def from_packed(cls, packed, hashed=True):
+        """ packed is a 2-D array, with each row being a configuration in the packed layout (see configurations.all_configs_packed) """
+        new = cls.__new__(cls)
+        new._initialize(packed, hashed)
+        return new
+    def _initialize(self, packed, hashed):
+        self.length = packed.shape[0]
+        self.size   = packed.shape[1]
+        self.packed = numpy.ascontiguousarray(packed, dtype=BigInt.numpy).reshape(self.length * self.size)
+        self.hash_size  = 0                                         # zero signals the C code ...
+        self.hash_table = numpy.zeros((1,), dtype=BigInt.numpy)    # ... to ignore this dummy array
+        if hashed:
+            self.hash_size  = 2**(1 + self.length.bit_length())     # a power of 2, between 2x and 4x the number of configs
+            self.hash_table = numpy.zeros(self.hash_size, dtype=BigInt.numpy, order="C")
+            field_op.build_config_hash(self.packed, self.length, self.size, self.hash_table, self.hash_size)
     def __len__(self):
         return self.length
 
@@ -58,7 +83,8 @@ def find_index(config, configs):
     for n in range(configs.size):
         packed_config[n] = reduced % reduction
         reduced //= reduction
-    return field_op.bisect_search(packed_config, configs.packed, configs.size, 0, len(configs)-1)
+    if configs.hash_size>0:  return field_op.hash_search(packed_config, configs.packed, configs.size, configs.hash_table, configs.hash_size)
+    else:                    return field_op.bisect_search(packed_config, configs.packed, configs.size, 0, len(configs)-1)
 
 def find_index_by_occ(occupied, configs):
     config = 0
@@ -66,6 +92,21 @@ def find_index_by_occ(occupied, configs):
         config += 2**p
     return find_index(config, configs)
 
+def occupations(configs, n_orbs):
+    """ occ[I,p] = 1 if spin-orbital p is occupied in configuration I of configs (a packed_configs object), else 0 """
+    packed = configs.packed.reshape(len(configs), configs.size)
+    p = numpy.arange(n_orbs)
+    return (packed[:,p//orbs_per_configint] >> (p%orbs_per_configint)) & 1
+
+def diagonal_elements(h, V, configs):
+    """ <I|H|I> for each configuration I of configs, for H in the convention of opPsi_1e and opPsi_2e (V antisymmetrized) """
+    occ  = occupations(configs, h.shape[0]).astype(Double.numpy)
+    diag = occ @ numpy.ascontiguousarray(numpy.diagonal(h))
+    if V is not None:
+        J = numpy.ascontiguousarray(numpy.einsum("pqpq->pq", V))    # p<q and q<p terms each appear twice in the sum over pqrs
+        diag += 2 * ((occ @ J) * occ).sum(axis=1)
+    return diag
+
 
 
 # The job of this class is to manage the "wisdom" object which (theoretically, and practically on one
@@ -116,7 +157,35 @@ class det_densities(object):
 
 
 
-def opPsi_1e(HPsi, Psi, h, configs, thresh, wisdom, n_threads=1):
+def _as_block(vecs):
+    # the opPsi functions below act on a single vector or on a block (list) of vectors in one traversal of the configurations
+    if isinstance(vecs, numpy.ndarray):  return [vecs]
+    else:                                return list(vecs)
+
+# How the threads are kept from colliding when incrementing output in the C code (see resolve() in field_op.c).  When
+# the choice is "auto", ownership is used for symmetric operators acting on vectors with mostly significant coefficients
+# (since it cannot skip small ones), and otherwise private copies of the output are used if the n_threads-1 extra copies
+# fit in private_max_bytes (which may be reset by the user), with atomic updates as the last resort.
+reductions = {"atomic":0, "private":1, "owner":2}
+private_max_bytes = 2**30
+
+def _reduction(reduction, n_threads, out_bytes, symmetric=False, Psi=None, thresh=0):
+    if reduction=="auto":
+        if n_threads==1:  return reductions["private"]    # no copies made on one thread (see C code)
+        if symmetric and Psi is not None:
+            n_significant = numpy.count_nonzero(numpy.max(numpy.abs(Psi), axis=0) > thresh)
+            if 2*n_significant > Psi[0].size:  return reductions["owner"]
+        if (n_threads-1)*out_bytes <= private_max_bytes:  return reductions["private"]
+        return reductions["atomic"]
+    if reduction not in reductions:  raise ValueError(f"unknown reduction strategy {reduction}")
+    if reduction=="owner" and not symmetric:  raise ValueError("owner reduction only valid for symmetric operators")
+    return reductions[reduction]
+
+def opPsi_1e(HPsi, Psi, h, configs, thresh, wisdom, n_threads=1, reduction="auto", symmetric=False):
+    HPsi, Psi = _as_block(HPsi), _as_block(Psi)
+    if len(HPsi)!=len(Psi):  raise ValueError("input and output blocks of vectors must have the same length")
+    if len(Psi)==0:  return
+    reduction = _reduction(reduction, n_threads, len(HPsi)*len(configs)*8, symmetric, Psi, thresh)    # symmetric=True allows ownership of output by ket
     if wisdom is None:
         wisdom_occupied, wisdom_det_idx = [numpy.zeros((1,), dtype=Int.numpy, order="C")], [numpy.zeros((1,), dtype=BigInt.numpy, order="C")]    # dummy arrays
         wisdom_mode = det_densities.ignore
@@ -127,19 +196,26 @@ def opPsi_1e(HPsi, Psi, h, configs, thresh, wisdom, n_threads=1):
                     h,                  # tensor of matrix elements (integrals), assumed antisymmetrized
                     h.shape[0],         # edge dimension of the integrals tensor
                     1,                  # a global phase to be applied to the operator action
-                    [HPsi],             # array of row vectors: incremented by output
-                    [Psi],              # array of row vectors: input vectors to act on
-                    1,                  # how many vectors we are acting on and producing simultaneously in Psi and opPsi
+                    HPsi,               # array of row vectors: incremented by output
+                    Psi,                # array of row vectors: input vectors to act on
+                    len(Psi),           # how many vectors we are acting on and producing simultaneously in Psi and opPsi
                     configs.packed,     # configuration strings representing the basis for the states in Psi and opPsi (see packed_configs above)
                     len(configs),       # number of configurations in the configs basis (call signature ok if PyInt not longer than BigInt)
                     configs.size,       # number of BigInts needed to store a single configuration in configs
+                    configs.hash_table, # hash table for looking up configurations (dummy if hash_size is zero)
+                    configs.hash_size,  # size of the hash table (zero to use bisection search instead)
                     thresh,             # perform no further work if result will be smaller than this
                     wisdom_mode,        # whether to ignore, generate, or apply wisdom (lookup tables that *should* make things faster - but not always)
                     wisdom_occupied,    # for each ket config, a list (in ascending order) of the orbitals occupied in that ket
                     wisdom_det_idx,     # for each ket config, a list of the (possibly negated) index that each respective field-operator string gives projection onto
-                    n_threads)          # number of threads to spread the work over
+                    n_threads,          # number of threads to spread the work over
+                    reduction)          # how threads are kept from colliding when incrementing output (see _reduction above)
 
-def opPsi_2e(HPsi, Psi, V, configs, thresh, wisdom, n_threads=1):
+def opPsi_2e(HPsi, Psi, V, configs, thresh, wisdom, n_threads=1, reduction="auto", symmetric=False):
+    HPsi, Psi = _as_block(HPsi), _as_block(Psi)
+    if len(HPsi)!=len(Psi):  raise ValueError("input and output blocks of vectors must have the same length")
+    if len(Psi)==0:  return
+    reduction = _reduction(reduction, n_threads, len(HPsi)*len(configs)*8, symmetric, Psi, thresh)    # symmetric=True allows ownership of output by ket
     if wisdom is None:
         wisdom_occupied, wisdom_det_idx = [numpy.zeros((1,), dtype=Int.numpy, order="C")], [numpy.zeros((1,), dtype=BigInt.numpy, order="C")]    # dummy arrays
         wisdom_mode = det_densities.ignore
@@ -150,25 +226,161 @@ def opPsi_2e(HPsi, Psi, V, configs, thresh, wisdom, n_threads=1):
                     V,                  # tensor of matrix elements (integrals), assumed antisymmetrized
                     V.shape[0],         # edge dimension of the integrals tensor
                     -1,                 # a global phase to be applied to the operator action (to associate Vpqrs with pqsr field-op string)
-                    [HPsi],             # array of row vectors: incremented by output
-                    [Psi],              # array of row vectors: input vectors to act on
-                    1,                  # how many vectors we are acting on and producing simultaneously in Psi and opPsi
+                    HPsi,               # array of row vectors: incremented by output
+                    Psi,                # array of row vectors: input vectors to act on
+                    len(Psi),           # how many vectors we are acting on and producing simultaneously in Psi and opPsi
                     configs.packed,     # configuration strings representing the basis for the states in Psi and opPsi (see packed_configs above)
                     len(configs),       # number of configurations in the configs basis (call signature ok if PyInt not longer than BigInt)
                     configs.size,       # number of BigInts needed to store a single configuration in configs
+                    configs.hash_table, # hash table for looking up configurations (dummy if hash_size is zero)
+                    configs.hash_size,  # size of the hash table (zero to use bisection search instead)
                     thresh,             # perform no further work if result will be smaller than this
                     wisdom_mode,        # whether to ignore, generate, or apply wisdom (lookup tables that *should* make things faster - but not always)
                     wisdom_occupied,    # for each ket config, a list (in ascending order) of the orbitals occupied in that ket
                     wisdom_det_idx,     # for each ket config, a list of the (possibly negated) index that each respective field-operator string gives projection onto
-                    n_threads)          # number of threads to spread the work over
+                    n_threads,          # number of threads to spread the work over
+                    reduction)          # how threads are kept from colliding when incrementing output (see _reduction above)
+
+# The job of this class is to hold an operator (perhaps a sum of operators of different electron orders)
+# that has been resolved once and for all into its matrix elements between the configurations of a basis,
+# stored in compressed-sparse-row (CSR) format, so that it can be applied repeatedly (see csr_op_Psi in
+# field_op.c) without repeating the recursion over the field-operator strings.  The memory of the matrix
+# and the peak memory needed to assemble it can be estimated (in bytes) before building it.
+class sparse_op(object):
+    _assembly_bytes = 2*8 + 8 + 8 + 8    # per raw element: bra, ket and value, plus sort key and permutation for summing repeats
+    @staticmethod
+    def _orders(ops):
+        for n_elec,tensor,phase in ops:  yield n_elec, numpy.ascontiguousarray(tensor, dtype=Double.numpy), phase
+    @staticmethod
+    def count_elems(ops, configs, thresh, n_threads=1):
+        """ the number of raw matrix elements generated for each ket config, summed over the (n_elec, tensor, phase) terms in ops """
+        total = numpy.zeros(len(configs), dtype=BigInt.numpy)
+        dummy_bra, dummy_val = numpy.zeros((1,), dtype=BigInt.numpy), numpy.zeros((1,), dtype=Double.numpy)
+        for n_elec,tensor,phase in sparse_op._orders(ops):
+            counts = numpy.zeros(len(configs), dtype=BigInt.numpy)
+            field_op.op_matrix_elems(n_elec, tensor, tensor.shape[0], phase, configs.packed, len(configs), configs.size, configs.hash_table, configs.hash_size, thresh, 0, counts, counts, dummy_bra, dummy_val, n_threads)
+            total += counts
+        return total
+    @staticmethod
+    def estimate_bytes(raw_count, n_configs):
+        """ upper bound on the memory of the assembled matrix and estimate of the peak memory needed to assemble it, given the raw element count """
+        idx_bytes = Int.numpy(0).nbytes if n_configs<2**31 else BigInt.numpy(0).nbytes
+        return raw_count * (idx_bytes + 8) + 8 * (n_configs + 1),  raw_count * sparse_op._assembly_bytes
+    def __init__(self, ops, configs, thresh, n_threads=1):
+        N = len(configs)
+        kets, bras, vals = [], [], []
+        for n_elec,tensor,phase in self._orders(ops):
+            counts = numpy.zeros(N, dtype=BigInt.numpy)
+            dummy_bra, dummy_val = numpy.zeros((1,), dtype=BigInt.numpy), numpy.zeros((1,), dtype=Double.numpy)
+            field_op.op_matrix_elems(n_elec, tensor, tensor.shape[0], phase, configs.packed, N, configs.size, configs.hash_table, configs.hash_size, thresh, 0, counts, counts, dummy_bra, dummy_val, n_threads)
+            offsets  = numpy.zeros(N, dtype=BigInt.numpy)
+            offsets[1:] = numpy.cumsum(counts)[:-1]
+            elem_bra = numpy.zeros(max(1,int(counts.sum())), dtype=BigInt.numpy)
+            elem_val = numpy.zeros(max(1,int(counts.sum())), dtype=Double.numpy)
+            field_op.op_matrix_elems(n_elec, tensor, tensor.shape[0], phase, configs.packed, N, configs.size, configs.hash_table, configs.hash_size, thresh, 1, counts, offsets, elem_bra, elem_val, n_threads)
+            n_raw = int(counts.sum())
+            kets += [numpy.repeat(numpy.arange(N, dtype=BigInt.numpy), counts)]
+            bras += [elem_bra[:n_raw]]
+            vals += [elem_val[:n_raw]]
+        kets, bras, vals = numpy.concatenate(kets), numpy.concatenate(bras), numpy.concatenate(vals)
+        # sum repeated (bra,ket) pairs (the bra is the row) and screen the results
+        keys  = bras * N + kets
+        order = numpy.argsort(keys, kind="stable")
+        keys, vals = keys[order], vals[order]
+        del order, bras, kets
+        if len(keys)>0:
+            starts = numpy.flatnonzero(numpy.concatenate(([True], keys[1:]!=keys[:-1])))
+            vals = numpy.add.reduceat(vals, starts)
+            keys = keys[starts]
+        keep = numpy.abs(vals) > thresh
+        keys, vals = keys[keep], vals[keep]
+        rows = keys // N
+        self.n_configs = N
+        self.row_ptr = numpy.zeros(N+1, dtype=BigInt.numpy)
+        self.row_ptr[1:] = numpy.cumsum(numpy.bincount(rows, minlength=N))
+        self.col_idx = numpy.ascontiguousarray(keys - rows*N, dtype=(Int.numpy if N<2**31 else BigInt.numpy))
+        self.values  = numpy.ascontiguousarray(vals, dtype=Double.numpy)
+    @property
+    def nnz(self):
+        return len(self.values)
+    @property
+    def nbytes(self):
+        return self.row_ptr.nbytes + self.col_idx.nbytes + self.values.nbytes
+    def act(self, opPsi, Psi, n_threads=1):
+        """ increment the vector(s) opPsi by the action of this operator on the vector(s) Psi """
+        opPsi, Psi = _as_block(opPsi), _as_block(Psi)
+        if len(opPsi)!=len(Psi):  raise ValueError("input and output blocks of vectors must have the same length")
+        if len(Psi)==0:  return
+        csr_op_Psi = field_op.csr_op_Psi if self.col_idx.dtype==Int.numpy else field_op.csr_op_Psi_big
+        csr_op_Psi(self.row_ptr, self.col_idx, self.values, self.n_configs, opPsi, Psi, len(Psi), n_threads)
 
-def build_densities(op_string, n_orbs, bras, kets, bra_configs, ket_configs, thresh, wisdom, antisymmetrize, printout=print, n_threads=1):
+# The job of this class is to hold a density tensor (see build_densities) in packed storage, keeping only the elements
+# with creation indices and annihilation indices each in ascending order (the others being redundant by antisymmetry).
+# The packed data is a matrix, with rows for the creation-index combinations and columns for the annihilation-index
+# combinations, each in colexicographic order (as produced by _combinations below).  It unpacks lazily: the full tensor
+# is built upon calling unpack(), or by anything that converts it to a numpy array (so it can be used directly as the
+# raw tensor of a tensornet.np_tensor, for example), and single elements can be read by index without unpacking.
+class packed_density(object):
+    @staticmethod
+    def _combinations(n_orbs, n):
+        """ all ascending n-tuples of orbital indices in colexicographic order (so that the position is the rank used in field_op.c) """
+        return sorted(itertools.combinations(range(n_orbs), n), key=lambda combo: combo[::-1])
+    @staticmethod
+    def _packing(n_orbs, n_create, n_annihil):
+        """ the packing information array for field_op.c (see pack_index() there) """
+        n_max = max(n_create, n_annihil)
+        binom = [[math.comb(m,j) for m in range(n_orbs+1)] for j in range(n_max+1)]
+        return numpy.array([n_create, n_annihil] + [b for row in binom for b in row], dtype=BigInt.numpy)
+    def __init__(self, op_string, n_orbs, packed=None):
+        self.op_string = op_string
+        self.n_orbs    = n_orbs
+        self.n_create  = op_string.count("c")
+        self.n_annihil = op_string.count("a")
+        self.shape     = (n_orbs,) * (self.n_create + self.n_annihil)
+        packed_shape   = (math.comb(n_orbs, self.n_create), math.comb(n_orbs, self.n_annihil))
+        self.packed    = numpy.zeros(packed_shape, dtype=Double.numpy, order="C") if packed is None else packed
+    @staticmethod
+    def _rank(indices):
+        """ colexicographic rank of an ascending tuple of indices """
+        return sum(math.comb(p, j+1) for j,p in enumerate(indices))
+    def __getitem__(self, indices):
+        creators, annihilators = indices[:self.n_create], indices[self.n_create:]
+        if len(set(creators))<len(creators) or len(set(annihilators))<len(annihilators):  return 0.
+        phase = 1
+        for substring in (creators, annihilators):
+            for i in range(len(substring)):
+                for j in range(i+1, len(substring)):
+                    if substring[i]>substring[j]:  phase = -phase
+        return phase * self.packed[self._rank(sorted(creators)), self._rank(sorted(annihilators))]
+    def unpack(self):
+        rho = numpy.zeros(self.shape, dtype=Double.numpy, order="C")
+        creators     = numpy.array(self._combinations(self.n_orbs, self.n_create),  dtype=int).reshape(-1, self.n_create)
+        annihilators = numpy.array(self._combinations(self.n_orbs, self.n_annihil), dtype=int).reshape(-1, self.n_annihil)
+        indices  = [creators[:,j][:,None]     for j in range(self.n_create)]
+        indices += [annihilators[:,j][None,:] for j in range(self.n_annihil)]
+        rho[tuple(indices)] = self.packed
+        antisymm.antisymmetry([rho], 1, self.n_orbs, self.n_create, self.n_annihil, 0)    # fill in the other wedges
+        return rho
+    def __array__(self, dtype=None, copy=None):
+        rho = self.unpack()
+        return rho if dtype is None else rho.astype(dtype)
+
+# If packed is True, the densities are returned as packed_density objects, which hold only the symmetry-unique elements
+# (written there directly by the C code), and which are already antisymmetrized (so the antisymmetrize argument is moot).
+def build_densities(op_string, n_orbs, bras, kets, bra_configs, ket_configs, thresh, wisdom, antisymmetrize, printout=print, n_threads=1, reduction="auto", packed=False):
     n_create  = op_string.count("c")
     n_annihil = op_string.count("a")
     if (op_string != "c"*n_create + "a"*n_annihil):  raise ValueError("density operator string is not vacuum normal ordered")
     shape = [n_orbs] * (n_create + n_annihil)
     printout(f"{op_string}:  dimensions x count = {shape} x {len(bras)*len(kets)}")
-    rho = [numpy.zeros(shape, dtype=Double.numpy, order="C") for _ in range(len(bras)*len(kets))]
+    if packed:
+        packing = packed_density._packing(n_orbs, n_create, n_annihil)
+        densities = [packed_density(op_string, n_orbs) for _ in range(len(bras)*len(kets))]
+        rho = [density.packed for density in densities]
+    else:
+        packing = numpy.array([-1], dtype=BigInt.numpy)    # signals full storage
+        rho = [numpy.zeros(shape, dtype=Double.numpy, order="C") for _ in range(len(bras)*len(kets))]
+    reduction = _reduction(reduction, n_threads, (rho[0].size*len(rho)*8 if rho else 0))
     if wisdom is None:
         wisdom_occupied, wisdom_det_idx = [numpy.zeros((1,), dtype=Int.numpy, order="C")], [numpy.zeros((1,), dtype=BigInt.numpy, order="C")]    # dummy arrays
         wisdom_mode = det_densities.ignore
@@ -185,6 +397,8 @@ def build_densities(op_string, n_orbs, bras, kets, bra_configs, ket_configs, thr
                        bra_configs.packed,    # configuration strings representing the basis for the bras (see packed_configs above)
                        len(bra_configs),      # number of configurations in the bra basis (call signature ok if PyInt not longer than BigInt)
                        bra_configs.size,      # number of BigInts needed to store a single configuration in the bra basis
+                       bra_configs.hash_table, # hash table for looking up bra configurations (dummy if hash_size is zero)
+                       bra_configs.hash_size,  # size of the hash table (zero to use bisection search instead)
                        kets,                  # array of row vectors: kets for transition-density tensors
                        len(kets),             # number of kets
                        ket_configs.packed,    # configuration strings representing the basis for the kets (see packed_configs above)
@@ -194,8 +408,12 @@ def build_densities(op_string, n_orbs, bras, kets, bra_configs, ket_configs, thr
                        wisdom_mode,           # whether to ignore, generate, or apply wisdom (lookup tables that *should* make things faster - but not always)
                        wisdom_occupied,       # for each ket config, a list (in ascending order) of the orbitals occupied in that ket
                        wisdom_det_idx,        # for each ket config, a list of the (possibly negated) index that each respective field-operator string gives projection onto
-                       n_threads)             # number of threads to spread the work over
-    if antisymmetrize:
+                       n_threads,             # number of threads to spread the work over
+                       reduction,             # how threads are kept from colliding when incrementing output (see _reduction above)
+                       packing)               # information for packed storage (see packed_density above), or dummy for full storage
+    if packed:
+        rho = densities
+    elif antisymmetrize:
         printout("antisymmetrizing ... ", end="")
         antisymm.antisymmetry(rho,          # linear array of density tensors to antisymmetrize
                               len(rho),     # number of density tensors to antisymmetrize
@@ -225,6 +443,8 @@ def generate_wisdom(op_string, n_orbs, bra_configs, ket_configs, wisdom, n_threa
                              bra_configs.packed,    # configuration strings representing the basis for the bras (see packed_configs above)
                              len(bra_configs),      # number of configurations in the basis configs_bra (call signature ok if PyInt not longer than BigInt)
                              bra_configs.size,      # number of BigInts needed to store a single configuration in configs_bra
+                             bra_configs.hash_table, # hash table for looking up bra configurations (dummy if hash_size is zero)
+                             bra_configs.hash_size,  # size of the hash table (zero to use bisection search instead)
                              ket_configs.packed,    # configuration strings representing the basis for the kets (see packed_configs above)
                              len(ket_configs),      # number of configurations in the basis configs_ket (call signature ok if PyInt not longer than BigInt)
                              ket_configs.size,      # number of BigInts needed to store a single configuration in configs_ket
@@ -19,22 +19,80 @@ import numpy
 from ...util.PyC import Double
 from . import field_op
 
+# If sparse is True, the first action in a given basis assembles a sparse (CSR) matrix representation that is used for all
+# subsequent actions in that basis.  If sparse is "auto", this is only done if the estimated peak memory needed to assemble it
+# is below sparse_max_bytes (otherwise falling back permanently to the direct algorithm for that basis).
+# The reduction argument is passed through to field_op.opPsi_1e/2e (see field_op._reduction); the integrals are checked for
+# symmetry here, since only then may the threads take ownership of output by ket.
+# If resources (a util.parallel.resources) is given, it supplies n_threads (its cores) and, if it has a memory budget, sparse_max_bytes.
 class Hamiltonian(object):
-    def __init__(self, h, V=None, thresh=1e-10, n_elec=None, n_threads=1):    # n_elec is a requirement to use wisdom, but need not be well-defined in general
+    def __init__(self, h, V=None, thresh=1e-10, n_elec=None, n_threads=1, sparse=False, sparse_max_bytes=2**31, reduction="auto", resources=None):    # n_elec is a requirement to use wisdom, but need not be well-defined in general
         self.h = h
         self.V = V
         self.thresh = thresh
         self.n_threads = n_threads
+        self.reduction = reduction
+        self.h_symmetric = numpy.allclose(h, h.T, rtol=0, atol=thresh)
+        self.V_symmetric = (V is not None) and numpy.allclose(V, V.transpose(2,3,0,1), rtol=0, atol=thresh)
         self.wisdom_1e = None
         self.wisdom_2e = None
         if n_elec is not None:
             self.wisdom_1e = field_op.det_densities(n_elec)
             self.wisdom_2e = field_op.det_densities(n_elec)
+        if sparse not in (True, False, "auto"):  raise ValueError("sparse option must be True, False, or \"auto\"")
+        self.sparse = sparse
+        self.sparse_max_bytes = sparse_max_bytes
+        self._sparse_configs = None    # the basis in which ...
+        self._sparse_matrix  = None    # ... the sparse representation was built (None if declined)
+        if resources is not None:  self.set_resources(resources)
     def set_n_threads(self, n_threads):
         self.n_threads = n_threads
+    def set_resources(self, resources):
+        self.n_threads = resources.n_threads
+        if resources.max_bytes is not None:  self.sparse_max_bytes = resources.max_bytes
+    def diagonal(self, configs):
+        return field_op.diagonal_elements(self.h, self.V, configs)
+    def _sparse_ops(self):
+        ops = [(1, self.h, 1)]
+        if self.V is not None:  ops += [(2, self.V, -1)]    # phase to associate Vpqrs with pqsr field-op string (see opPsi_2e)
+        return ops
+    def sparse_matrix(self, configs):
+        """ the sparse (CSR) representation in the basis configs, building it if necessary and allowed (None if not allowed) """
+        if self.sparse is False:  return None
+        if configs is not self._sparse_configs:
+            self._sparse_configs, self._sparse_matrix = configs, None
+            build = True
+            if self.sparse=="auto":
+                raw_count = int(field_op.sparse_op.count_elems(self._sparse_ops(), configs, self.thresh, self.n_threads).sum())
+                _, peak_bytes = field_op.sparse_op.estimate_bytes(raw_count, len(configs))
+                build = (peak_bytes <= self.sparse_max_bytes)
+            if build:
+                self._sparse_matrix = field_op.sparse_op(self._sparse_ops(), configs, self.thresh, self.n_threads)
+        return self._sparse_matrix
     def __call__(self, Psi, configs):
-        HPsi = numpy.zeros(len(configs), dtype=Double.numpy, order="C")
-        field_op.opPsi_1e(HPsi, Psi, self.h, configs, self.thresh, self.wisdom_1e, self.n_threads)
-        if self.V is not None:
-            field_op.opPsi_2e(HPsi, Psi, self.V, configs, self.thresh, self.wisdom_2e, self.n_threads)
+        # Psi may be a single vector or a list of vectors (a block), in which case a list is returned, and
+        # the (expensive) traversal of the configurations and operator strings is done once for the whole block
+        if isinstance(Psi, numpy.ndarray):
+            return self._act_on_block([Psi], configs)[0]
+        else:
+            return self._act_on_block(list(Psi), configs)
+    def _act_on_block(self, Psi, configs):
+        HPsi = [numpy.zeros(len(configs), dtype=Double.numpy, order="C") for _ in Psi]
+        self.accumulate(HPsi, Psi, configs)
         return HPsi
+    def accumulate(self, HPsi, Psi, configs, coeff=1):
+        """ increments each vector in the list HPsi by coeff times the action on the respective vector in the list Psi """
+        matrix = self.sparse_matrix(configs)
+        if matrix is not None:
+            if coeff==1:
+                matrix.act(HPsi, Psi, self.n_threads)
+            else:
+                temp = [numpy.zeros(len(configs), dtype=Double.numpy, order="C") for _ in Psi]
+                matrix.act(temp, Psi, self.n_threads)
+                for HPsi_i,temp_i in zip(HPsi,temp):  HPsi_i += coeff * temp_i
+        elif len(Psi)>0:
+            h = self.h if coeff==1 else coeff * self.h    # the integrals are small, so scale them rather than the output (wisdom is independent of them)
+            field_op.opPsi_1e(HPsi, Psi, h, configs, self.thresh, self.wisdom_1e, self.n_threads, self.reduction, self.h_symmetric)
+            if self.V is not None:
+                V = self.V if coeff==1 else coeff * self.V
+                field_op.opPsi_2e(HPsi, Psi, V, configs, self.thresh, self.wisdom_2e, self.n_threads, self.reduction, self.V_symmetric)
@@ -0,0 +1,199 @@
+#    (C) Copyright 2025 Anthony D. Dutoi
+#
+#    This file is part of Qode.
+#
+#    Qode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Qode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Qode.  If not, see <http://www.gnu.org/licenses/>.
+#
+import numpy
+from ...util.PyC import Double
+from .field_op import orbs_per_configint, diagonal_elements
+
+# A drop-in alternative to field_op_ham.Hamiltonian for CI spaces that are the full tensor product of a list of spin-down
+# strings and a list of spin-up strings (as generated by configurations.Sz_configs).  Rather than resolving the action of
+# field-operator strings on each determinant, the coefficients are held as a matrix C[I_up,I_dn], and the Hamiltonian is
+# applied in the string-driven manner of Knowles-Handy and Olsen, using precomputed lists of single replacements E_kl|J>
+# for each spin separately and matrix-matrix products (BLAS-3) for the contractions with the two-electron integrals.
+#
+# In terms of the integrals (in the same convention as field_op_ham.Hamiltonian, so with V antisymmetrized)
+#     H  =  sum_pq h_pq c_p a^q  +  sum_pqrs V_pqrs c_p c_q a^s a^r
+# is rewritten with E^s_ik = c_is a^ks (s=dn,up, and i,k spatial) as
+#     H  =  sum_s [ sum_ik h'^s_ik E^s_ik  +  sum_ijkl V^ssss_ijkl E^s_ik E^s_jl ]  +  4 sum_ijkl V^dudu_ijkl E^dn_ik E^up_jl
+# where h'^s_il = h^ss_il - sum_j V^ssss_ijjl.  Spin-flip blocks of the integrals cannot connect configurations of the same Sz
+# and are ignored.
+#
+# The spin-orbital indices of the spin-down and spin-up partners of each spatial orbital are given by dn_orbs and up_orbs
+# (by default, the first and second halves of the orbitals, as for a monomer).  For other layouts (for example dimers, where
+# each fragment has its own block of spin-down and spin-up orbitals) the determinants are reordered, with the appropriate
+# phase, into the string basis upon each application.  Only the set of configurations needs to be a tensor product of strings,
+# not their ordering.  The strings are held as native integers, so there may be no more than 62 spatial orbitals.
+
+
+
+def _occupations(packed, orbs):
+    """ occ[I,i] = 1 if spin-orbital orbs[i] is occupied in configuration I, for packed configurations packed[I,word] """
+    return numpy.array([(packed[:,p//orbs_per_configint] >> (p%orbs_per_configint)) & 1 for p in orbs], dtype=numpy.int64).reshape(len(orbs),len(packed)).T
+
+def _substrings(packed, orbs):
+    """ the bits of each configuration for the spin-orbitals in orbs, packed into a string with bit i for orbs[i] """
+    return _occupations(packed, orbs) @ (numpy.int64(1) << numpy.arange(len(orbs), dtype=numpy.int64))
+
+def _reorder_phases(packed, keys):
+    """ the phase of each configuration for reordering its occupied orbitals from ascending index to ascending key """
+    occ = _occupations(packed, range(len(keys)))
+    keys = numpy.array(keys)
+    inverted = numpy.triu(keys[:,None]>keys[None,:], 1).astype(numpy.int64)    # inverted[p,q] = 1 if p<q but keys[p]>keys[q]
+    n_inversions = ((occ @ inverted) * occ).sum(axis=1)
+    return numpy.where(n_inversions%2, -1., 1.)
+
+class _replacements(object):
+    """ for each pair of spatial orbitals kl, the source string indices J, target string indices I and phases of E_kl|J> = phase|I> """
+    def __init__(self, strings, n_orbs):
+        strings = numpy.array(strings, dtype=numpy.int64)
+        occ = numpy.array([(strings >> p) & 1 for p in range(n_orbs)], dtype=numpy.int64).T    # occ[J,p] = 1 if orbital p occupied in string J
+        above = numpy.cumsum(occ[:,::-1], axis=1)[:,::-1] - occ                                 # above[J,p] = number occupied with index > p
+        self.src, self.dst, self.phase = [], [], []
+        for k in range(n_orbs):
+            for l in range(n_orbs):
+                if k==l:  J = numpy.flatnonzero(occ[:,l])
+                else:     J = numpy.flatnonzero(occ[:,l] & (1 - occ[:,k]))
+                new = (strings[J] ^ (1 << l)) | (1 << k)
+                I = numpy.searchsorted(strings, new)
+                inside = I < len(strings)
+                inside[inside] = (strings[I[inside]] == new[inside])    # the target might not be in the list (e.g., frozen or restricted orbitals)
+                J, I = J[inside], I[inside]
+                n_permute = above[J,l] + above[J,k] - (1 if l>k else 0)    # a^l, then c_k on the intermediate (one fewer above k if l>k)
+                self.src   += [J]
+                self.dst   += [I]
+                self.phase += [numpy.where(n_permute%2, -1., 1.)]
+    def apply(self, C, axis):
+        """ returns D[kl] = E_kl C for all kl, where E_kl acts on the given axis (1 for up, 2 for dn) of the stack C[v,I_up,I_dn] """
+        out = numpy.zeros((len(self.src),) + C.shape, dtype=Double.numpy)
+        for kl,(J,I,phase) in enumerate(zip(self.src, self.dst, self.phase)):
+            if axis==1:  out[kl][:,I,:] = C[:,J,:] * phase[None,:,None]
+            else:        out[kl][:,:,I] = C[:,:,J] * phase[None,None,:]
+        return out
+    def apply_sum(self, G, axis, sigma, sources=None):
+        """\
+        increments sigma by sum_ik E_ik G[ik], where E_ik acts on the given axis (1 for up, 2 for dn) of each G[ik][v,I_up,I_dn].  If
+        sources (a slice) is given, then G holds only those source strings along axis, so only the replacements from them are done.
+        """
+        for ik,(J,I,phase) in enumerate(zip(self.src, self.dst, self.phase)):
+            if sources is not None:
+                inside = (J>=sources.start) & (J<sources.stop)
+                J, I, phase = J[inside] - sources.start, I[inside], phase[inside]
+            if axis==1:  sigma[:,I,:] += G[ik][:,J,:] * phase[None,:,None]
+            else:        sigma[:,:,I] += G[ik][:,:,J] * phase[None,None,:]
+
+# The intermediates D[kl] = E_kl C and G[ik] hold n^2 copies of (a part of) the CI block, so the action is done in slabs of the
+# strings on which the replacements do not act (for the opposite-spin term, slabs of the spin-down strings that the spin-up
+# replacements leave alone), sized so that these intermediates take no more than about max_bytes.
+
+class StringHamiltonian(object):
+    def __init__(self, h, V=None, dn_orbs=None, up_orbs=None, max_bytes=2**28):
+        n_spin_orbs = h.shape[0]
+        if dn_orbs is None:  dn_orbs = list(range(n_spin_orbs//2))
+        if up_orbs is None:  up_orbs = list(range(n_spin_orbs//2, n_spin_orbs))
+        if len(dn_orbs)!=len(up_orbs) or sorted(list(dn_orbs)+list(up_orbs))!=list(range(n_spin_orbs)):
+            raise ValueError("spin-down and spin-up orbitals must partition the spin orbitals into equal halves")
+        if len(dn_orbs)>62:  raise ValueError("string-driven Hamiltonian limited to 62 spatial orbitals")
+        self.h, self.V = h, V
+        self.max_bytes = max_bytes
+        self.dn_orbs, self.up_orbs = list(dn_orbs), list(up_orbs)
+        n = len(dn_orbs)
+        dn, up = numpy.ix_(dn_orbs,dn_orbs), numpy.ix_(up_orbs,up_orbs)
+        self.h_dn, self.h_up = numpy.array(h[dn]), numpy.array(h[up])
+        self.W_dn = self.W_up = self.W_dnup = None
+        if V is not None:
+            V_dn   = V[numpy.ix_(dn_orbs, dn_orbs, dn_orbs, dn_orbs)]
+            V_up   = V[numpy.ix_(up_orbs, up_orbs, up_orbs, up_orbs)]
+            V_dnup = V[numpy.ix_(dn_orbs, up_orbs, dn_orbs, up_orbs)]
+            self.h_dn = self.h_dn - numpy.einsum("ijjl->il", V_dn)
+            self.h_up = self.h_up - numpy.einsum("ijjl->il", V_up)
+            self.W_dn   =     numpy.ascontiguousarray(V_dn.transpose(0,2,1,3).reshape(n*n,n*n))      # W[ik,jl] = V_ijkl
+            self.W_up   =     numpy.ascontiguousarray(V_up.transpose(0,2,1,3).reshape(n*n,n*n))
+            self.W_dnup = 4 * numpy.ascontiguousarray(V_dnup.transpose(0,2,1,3).reshape(n*n,n*n))
+        self._configs = None    # the basis for which the quantities below were set up
+    def _setup(self, configs):
+        n = len(self.dn_orbs)
+        packed = configs.packed.reshape(len(configs), configs.size)
+        dn_part = _substrings(packed, self.dn_orbs)
+        up_part = _substrings(packed, self.up_orbs)
+        dn_strings, up_strings = numpy.unique(dn_part), numpy.unique(up_part)
+        if len(dn_strings)*len(up_strings)!=len(packed):
+            raise ValueError("configurations do not form a tensor product of spin-down and spin-up strings")
+        self._shape = (len(up_strings), len(dn_strings))
+        self._order = numpy.searchsorted(up_strings, up_part)*len(dn_strings) + numpy.searchsorted(dn_strings, dn_part)    # position of each determinant in the string basis
+        if self.dn_orbs==list(range(n)) and self.up_orbs==list(range(n,2*n)):
+            self._phase = None    # no reordering of orbitals, and Sz_configs ordering gives _order as the identity
+        else:
+            keys = [0] * (2*n)
+            for i,p in enumerate(self.dn_orbs):  keys[p] = i
+            for i,p in enumerate(self.up_orbs):  keys[p] = n + i
+            self._phase = _reorder_phases(packed, keys).astype(Double.numpy)
+        if numpy.array_equal(self._order, numpy.arange(len(packed))) and self._phase is None:
+            self._order = None
+        self._dn = _replacements(dn_strings, n)
+        self._up = _replacements(up_strings, n)
+        self._configs = configs
+    def diagonal(self, configs):
+        return diagonal_elements(self.h, self.V, configs)
+    def __call__(self, Psi, configs):
+        # Psi may be a single vector or a list of vectors (a block), in which case a list is returned
+        if isinstance(Psi, numpy.ndarray):
+            return self._act_on_block([Psi], configs)[0]
+        else:
+            return self._act_on_block(list(Psi), configs)
+    def _act_on_block(self, Psi, configs):
+        if len(Psi)==0:  return []
+        if configs is not self._configs:  self._setup(configs)
+        n_up, n_dn = self._shape
+        C = numpy.zeros((len(Psi), n_up*n_dn), dtype=Double.numpy)
+        for v,Psi_v in enumerate(Psi):
+            if self._order is None:     C[v]              = Psi_v
+            elif self._phase is None:   C[v][self._order] = Psi_v
+            else:                       C[v][self._order] = Psi_v * self._phase
+        C = C.reshape(len(Psi), n_up, n_dn)
+        sigma = numpy.zeros(C.shape, dtype=Double.numpy)
+        n2 = len(self.dn_orbs)**2
+        def slabs(axis):    # slices of the other string axis, for which D and G (and their temporaries) fit in max_bytes
+            other = 3 - axis
+            width = max(1, self.max_bytes // (2 * n2 * len(Psi) * C.shape[axis] * C.itemsize))
+            return [slice(beg, min(beg+width, C.shape[other])) for beg in range(0, C.shape[other], width)]
+        # same-spin terms, acting on the spin-down (axis 2) and spin-up (axis 1) strings, including the one-electron part
+        for rep,axis,h,W in ((self._dn, 2, self.h_dn, self.W_dn), (self._up, 1, self.h_up, self.W_up)):
+            for strings in slabs(axis):
+                slab = (slice(None), strings) if axis==2 else (slice(None), slice(None), strings)
+                D = rep.apply(C[slab], axis)                                  # D[jl] = E_jl C
+                sigma[slab] += numpy.tensordot(h.ravel(), D, axes=1)         # one-electron action needs no further replacement
+                if W is not None:
+                    G = (W @ D.reshape(len(D),-1)).reshape(D.shape)          # G[ik] = sum_jl V_ijkl D[jl]
+                    del D
+                    rep.apply_sum(G, axis, sigma[slab])                      # sigma += sum_ik E_ik G[ik]
+                    del G
+        # opposite-spin term, in slabs of the spin-down strings acted on by the spin-down replacements
+        if self.W_dnup is not None:
+            for slab in slabs(1):
+                D = self._up.apply(C[:,:,slab], 1)                                 # D[jl] = E^up_jl C
+                G = (self.W_dnup @ D.reshape(len(D),-1)).reshape(D.shape)          # G[ik] = 4 sum_jl V^dudu_ijkl D[jl]
+                del D
+                self._dn.apply_sum(G, 2, sigma, sources=slab)                      # sigma += sum_ik E^dn_ik G[ik]
+                del G
+        sigma = sigma.reshape(len(Psi), n_up*n_dn)
+        HPsi = []
+        for v in range(len(Psi)):
+            if self._order is None:     HPsi_v = numpy.array(sigma[v], order="C")
+            elif self._phase is None:   HPsi_v = sigma[v][self._order]
+            else:                       HPsi_v = sigma[v][self._order] * self._phase
+            HPsi += [numpy.ascontiguousarray(HPsi_v, dtype=Double.numpy)]
+        return HPsi
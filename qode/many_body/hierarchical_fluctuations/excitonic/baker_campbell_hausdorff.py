@@ -16,9 +16,10 @@
 #    along with Qode.  If not, see <http://www.gnu.org/licenses/>.
 #
 import numpy
-from ....util.PyC import import_C, BigInt
+from ....util.PyC import import_C, Double, BigInt
 from .operator    import RSD_operator
 BCH = import_C("bch", include=["partition_storage.h"], flags="-O3")
+BCH.execute.arg_types(int, int, BigInt, *[Double]*20)    # Nthreads, Nfrag, Nvrt, 15 blocks of H, 2 of T and 3 of Omega
 
 
 
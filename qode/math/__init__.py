@@ -28,6 +28,7 @@ from .compress_tensor import svd_decomposition
 from . import field_traits
 from . import numpy_space
 from . import lanczos
+from . import davidson
 
 from .gram_schmidt import gram_schmidt
 
@@ -37,5 +38,6 @@ __all__ = [
     "vector_set",
     "field_traits",
     "numpy_space",
-    "lanczos"
+    "lanczos",
+    "davidson"
 ]
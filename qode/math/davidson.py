@@ -0,0 +1,143 @@
+#    (C) Copyright 2025 Anthony D. Dutoi
+#
+#    This file is part of Qode.
+#
+#    Qode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Qode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Qode.  If not, see <http://www.gnu.org/licenses/>.
+#
+import time
+import numpy
+from .space        import sqrt, _operator_base, _lin_comb
+from .vector_set   import vector_set
+from .field_traits import machine_epsilon
+from .lanczos      import _act
+
+# Block Davidson-Liu solver for the lowest eigenpairs of a Hermitian linear operator, written (like lanczos.py) purely in terms of the
+# linear_inner_product_space abstraction.  In each iteration, the residuals |r> = (H-x)|x> of the unconverged Ritz pairs (x,|x>) in the
+# current subspace are preconditioned into correction vectors, which are orthonormalized and added to the subspace (and H is acted on
+# them as a block).  The preconditioner is one of
+#     None        :  the diagonal of H, as given by H.diagonal() (so the traits of its space must implement diagonal and function_on_diags),
+#                    used as (D-x)^-1|r> (regularized where D-x is close to zero)
+#     an operator :  of the same space, simply acted on the residual, P|r> (for example, wrapping excitonic.operator.inv_diagE)
+#     a function  :  called as preconditioner(r, x), returning a new vector
+# When the subspace would exceed max_dim vectors, it is collapsed onto the lowest keep Ritz vectors.  Converged roots are locked,
+# meaning that they are removed from the subspace and all subsequent corrections are orthogonalized against them.  The resident
+# full-length vectors are therefore the subspace vectors and the action of H on them, plus the locked roots.
+
+
+
+def _precondition(preconditioner, D, r, theta):
+    if preconditioner is None:
+        delta = 1e-8    # regularization of (D-x)^-1 (written without branches so that it can be applied to whole arrays at once)
+        return D.generic_fn(lambda d: (d-theta) / ((d-theta)**2 + delta**2)) | r
+    elif isinstance(preconditioner, _operator_base):
+        return preconditioner | r
+    else:
+        return preconditioner(r, theta)
+
+def _orthonormal_additions(vecs, against, tol):
+    """ orthogonalizes each of vecs (in place) twice against the vectors in against and those already kept, and normalizes it, dropping those with norm below tol """
+    kept = []
+    for w in vecs:
+        norm0 = sqrt(w|w)
+        for _ in range(2):
+            for u in against + kept:  w -= u * (u|w)
+        norm = sqrt(w|w)
+        if norm>tol*norm0:
+            w /= norm
+            kept += [w]
+    return kept
+
+def _deproject(basis, coeffs):
+    """ the vector sum_j coeffs[j] basis[j], evaluated now, so that it does not keep the vectors of basis alive """
+    x = basis.deproject(coeffs)
+    if isinstance(x, _lin_comb):  x._evaluate()
+    return x
+
+def lowest_eigen(H, v, thresh, num=None, preconditioner=None, max_dim=None, keep=None, block_action=None, max_iterations=None, printout=print):
+    """\
+    This function uses the block Davidson-Liu method (see comments above) to extract the lowest num eigenpairs from a Hermitian linear
+    operator H, given initial guess vectors supplied in a list v (actually any iterable sequence), which are orthonormalized in place
+    (numerically dependent guesses are dropped).  num defaults to the number of guesses and cannot be greater than it.
+
+    The subspace is collapsed onto the lowest keep (default 2*num) Ritz vectors whenever it would otherwise exceed max_dim (default
+    the larger of 20 and 8*num).  If block_action is set to an integer, then H is acted simultaneously on that number of vectors at a time.
+
+    A root is converged and locked when the norm of its residual (H-x)|x> is below thresh.  max_iterations (if not None) limits the
+    number of iterations, after which a RuntimeError is raised.  The return value is a list of eigenpair tuples sorted low to high,
+    as for lanczos.lowest_eigen.
+    """
+    eps   = machine_epsilon[H.field]
+    dtype = numpy.dtype(H.field)
+    V = _orthonormal_additions(list(v), [], 100*eps)
+    if num     is None:  num     = len(V)
+    if keep    is None:  keep    = 2 * num
+    if max_dim is None:  max_dim = max(20, 8*num)
+    if num>len(V):            raise ValueError("at least num linearly independent guess vectors are required")
+    if keep<num:              raise ValueError("keep must be at least num")
+    if max_dim<keep+num:      raise ValueError("max_dim must be at least keep+num")
+    D = H.diagonal() if preconditioner is None else None
+    #
+    AV = _act(H, V, block_action)
+    G  = numpy.array([[ (Vi|AVj) for AVj in AV ] for Vi in V ], dtype=dtype)
+    locked_vals, locked_vecs = [], []
+    n_actions, iteration = 1, 0
+    t0 = time.time()
+    while True:
+        G = (G + G.conj().T) / 2
+        theta, S = numpy.linalg.eigh(G)
+        basis, Abasis = vector_set(H.space, V), vector_set(H.space, AV)
+        ritz = {}
+        def ritz_pair(i):
+            if i not in ritz:  ritz[i] = (_deproject(basis, S[:,i].tolist()), _deproject(Abasis, S[:,i].tolist()))
+            return ritz[i]
+        # residuals of the lowest roots not yet locked
+        k = num - len(locked_vals)
+        residuals = []
+        for i in range(k):
+            x, Ax = ritz_pair(i)
+            residuals += [Ax - x * theta[i]]
+        norms = [ sqrt(r|r) for r in residuals ]
+        t1 = time.time()
+        printout("Davidson iteration {}:  Eigenvalues = {}\nresiduals = {}".format(iteration, theta[:k].tolist(), norms))
+        printout("subspace dimension = {}, locked = {}, block actions = {}, cycle time = {}".format(len(V), len(locked_vals), n_actions, t1-t0))
+        t0 = t1
+        # lock converged roots (removing them from the subspace) and collapse the subspace if it would become too large
+        lock = [ i for i in range(k) if norms[i]<thresh ]
+        for i in lock:
+            locked_vals += [theta[i]]
+            locked_vecs += [ritz_pair(i)[0]]
+        if len(locked_vals)==num:
+            return sorted(zip(locked_vals,locked_vecs), key=lambda p: p[0])
+        active = [ i for i in range(k) if i not in lock ]
+        if lock or len(V)+len(active)>max_dim:
+            cols = [ i for i in range(min(len(V), keep+len(lock))) if i not in lock ]
+            V, AV = [ ritz_pair(i)[0] for i in cols ], [ ritz_pair(i)[1] for i in cols ]
+            G = numpy.diag(theta[cols]).astype(dtype)
+        del basis, Abasis, ritz
+        if (max_iterations is not None) and iteration+1>=max_iterations:
+            raise RuntimeError("Davidson not converged after {} iterations".format(iteration+1))
+        # add the preconditioned residuals to the subspace
+        new = [ _precondition(preconditioner, D, residuals[i], theta[i]) for i in active ]
+        del residuals
+        new = _orthonormal_additions(new, locked_vecs + V, 100*eps)
+        if len(new)==0:  raise RuntimeError("Davidson corrections are linearly dependent on the subspace; cannot make progress")
+        Anew = _act(H, new, block_action)
+        n_actions += 1
+        n, b = len(V), len(new)
+        G = numpy.pad(G, ((0,b),(0,b)))
+        for j,Anew_j in enumerate(Anew):
+            for i,Vi in enumerate(V + new):  G[i,n+j] = Vi|Anew_j
+            G[n+j,:n] = G[:n,n+j].conj()
+        V, AV = V + new, AV + Anew
+        iteration += 1
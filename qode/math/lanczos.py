@@ -19,7 +19,8 @@ import time
 import numpy
 from ..util      import indented
 from .space      import conjugate, sqrt, linear_inner_product_space
-from .vector_set import vector_set
+from .vector_set import vector_set, vector_set_for
+from .field_traits import machine_epsilon
 
 # Warning, this has only been dubugged for the real-symmetric case.
 
@@ -87,7 +88,7 @@ def _process_new_vec(v,vX,b,reorthonormalize, printout=print):
     vX /= b_nX[0]
     # optional Gram-Schmidt
     if reorthonormalize:
-        for vI in v:  vX -= vI * (vI|vX)
+        v.project_out(vX)                      # a pair of matrix-vector products if v is stored contiguously (see vector_set_for)
         vX /= sqrt(vX|vX)
     # update lists
     for n in range(B+1):  b[n] += [b_nX[n]]
@@ -140,7 +141,7 @@ def _block_iteration(H,v,b,n,reorthonormalize, printout=print):
 
 
 
-def projection(H,v,n,block_action=None,save=True,autocomplete=False,reorthonormalize=True, printout=print):
+def projection(H,v,n,block_action=None,save=True,autocomplete=False,reorthonormalize=True, max_bytes=None, scratch=None, printout=print):
     """\
     This function builds and returns a square matrix projection of the linear operator H
     as a numpy matrix of dimension n x n, given a starting block of B orthonormal vectors v.
@@ -159,6 +160,10 @@ def projection(H,v,n,block_action=None,save=True,autocomplete=False,reorthonorma
     (and renormalized) at creation time; this is redundant, in principle, but it is useful if any of
     the vectors in v is nearly an eigenvector, which can occur near convergence of some algorithms.
     that use this.
+
+    If max_bytes is given (and the vectors are 1-D numpy arrays), then only about that many bytes of Lanczos vectors
+    are held in memory, and the older ones are spilled to memory-mapped files in the directory scratch (see
+    vector_set.spilling_vector_set), through which reorthonormalization and deprojection then stream.
     """
     debug = False		# Set to true to turn on verbose printing
     v = list(v)			# might come in as any iterable ... also do not want to touch original list (though contents may change due to initial Gram-Schmidt)
@@ -175,7 +180,7 @@ def projection(H,v,n,block_action=None,save=True,autocomplete=False,reorthonorma
     for _ in range(B):
         zeros += [0]
         b = [list(zeros)] + b		# "Extra" elements here are expected to exist in a "dumb" iteration (and need to copy list) ...
-    v = vector_set(H.space, zeros+v)	#  ... does not know difference between beginning and middle. (zeros interpreted here as vectors)
+    v = vector_set_for(H.space, zeros+v, max_bytes=max_bytes, scratch=scratch)	#  ... does not know difference between beginning and middle. (zeros interpreted here as vectors)
     if debug:  printout("Subdiagonals (first array is lowest band, last array is diagonal band):\n",b)
     # execute fixed number of recursions to populate b and (possibly) v
     if block_action is None:
@@ -214,7 +219,7 @@ def projection(H,v,n,block_action=None,save=True,autocomplete=False,reorthonorma
     else:     value =  pHp
     return value
 
-def projection_eval_decomp(H, vecs, dim=10, block_action=None, autocomplete=False, printout=print):
+def projection_eval_decomp(H, vecs, dim=10, block_action=None, autocomplete=False, max_bytes=None, scratch=None, printout=print):
     """\
     Given a list (iterable type) of B orthonormal starting vectors in vecs, this function builds a
     square matrix projection of the linear operator H with dimension B*dim x B*dim, and it returns
@@ -236,13 +241,13 @@ def projection_eval_decomp(H, vecs, dim=10, block_action=None, autocomplete=Fals
     if debug:  printout("Entering lanczos.projection_eval_decomp with B={}, dim={}, block_action={}, and autocomplete={}.".format(B,dim,block_action,autocomplete))
     # Lanczos projection of H with fixed dimension dim*B, and the vector set spanning the space of the projection
     # Use reorthonormalize=True because we explicitly want vectors and so need to be able to trust them.
-    pHp,lanczos_vecs = projection(H, vecs, dim*B, block_action=block_action, save=True, autocomplete=autocomplete, reorthonormalize=True)	# "fixes" non-ON vecs or too large block_action
+    pHp,lanczos_vecs = projection(H, vecs, dim*B, block_action=block_action, save=True, autocomplete=autocomplete, reorthonormalize=True, max_bytes=max_bytes, scratch=scratch)	# "fixes" non-ON vecs or too large block_action
     # Diagonalize the projection and sort the eigenpairs
     eigen_vals,eigen_vecs = numpy.linalg.eigh(pHp)
     eigen_vals,eigen_vecs = zip(*sorted(zip( eigen_vals, eigen_vecs.T.tolist() ),key=lambda p: p[0]))
     return eigen_vals,eigen_vecs,lanczos_vecs
 
-def projection_lowest_eigen(H, vecs, dim=10, block_action=None, autocomplete=False, printout=print):
+def projection_lowest_eigen(H, vecs, dim=10, block_action=None, autocomplete=False, max_bytes=None, scratch=None, printout=print):
     """\
     Given a list (iterable type) of B orthonormal starting vectors in vecs, this function builds a
     square matrix projection of the linear operator H with dimension B*dim x B*dim, and it returns
@@ -263,14 +268,14 @@ def projection_lowest_eigen(H, vecs, dim=10, block_action=None, autocomplete=Fal
     B = len(vecs)	# block size
     if debug:  printout("Entering lanczos.projection_lowest_eigen with B={}, dim={}, block_action={}, and autocomplete={}.".format(B,dim,block_action,autocomplete))
     # Get the eigenvalue decomposition of the projection and the lanczos basis vectors
-    eigen_vals, eigen_vecs, lanczos_vecs = projection_eval_decomp(H, vecs, dim, block_action=block_action, autocomplete=autocomplete)		# "fixes" non-ON vecs or too large block_action
+    eigen_vals, eigen_vecs, lanczos_vecs = projection_eval_decomp(H, vecs, dim, block_action=block_action, autocomplete=autocomplete, max_bytes=max_bytes, scratch=scratch)		# "fixes" non-ON vecs or too large block_action
     # Build the lowest B eigenvectors in the orginal full space
     augment = [] if autocomplete else [0]*B
-    new_vecs = [ lanczos_vecs.deproject(eigen_vec+augment) for eigen_vec in eigen_vecs[:B] ]
+    new_vecs = lanczos_vecs.deproject_block([ eigen_vec+augment for eigen_vec in eigen_vecs[:B] ])
     new_vals = eigen_vals[:B]
     return new_vals, new_vecs
 
-def _lowest_eigen(H, vals, vecs, dim, block_action, autocomplete, converge_vectors, thresh, printout=print):
+def _lowest_eigen(H, vals, vecs, dim, block_action, autocomplete, converge_vectors, thresh, max_bytes=None, scratch=None, printout=print):
     """\
     This is a helper function that extracts one (or more, read on) eigenpairs from the linear operator H,
     given B orthonormal starting vectors in vecs, which is a vector_set.  Orthonormality of the input vecs
@@ -306,7 +311,7 @@ def _lowest_eigen(H, vals, vecs, dim, block_action, autocomplete, converge_vecto
     iteration = 0
     while min(errors)>thresh:
         # Build the lowest B eigenvectors of the dim*B(+B?) projection of H
-        new_vals, new_vecs = projection_lowest_eigen(H, vecs, dim, block_action=block_action, autocomplete=autocomplete)	# "fixes" non-ON vecs (drift with iterations) or too large block_action
+        new_vals, new_vecs = projection_lowest_eigen(H, vecs, dim, block_action=block_action, autocomplete=autocomplete, max_bytes=max_bytes, scratch=scratch)	# "fixes" non-ON vecs (drift with iterations) or too large block_action
         # Compute the convergence tests depending on whether we are testing vectors or values
         if converge_vectors:		# compute the projection of each outside the space spanned by the previous set
             P = 1 - vecs.projection_opr()
@@ -326,7 +331,7 @@ def _lowest_eigen(H, vals, vecs, dim, block_action, autocomplete, converge_vecto
     # Give the resulting eigensolutions and their distances from convergence
     return vals,vecs,errors
 
-def lowest_eigen(H, v, thresh, dim=10, num=None, block_action=None, autocomplete=False, converge_vectors=False, printout=print):
+def lowest_eigen(H, v, thresh, dim=10, num=None, block_action=None, autocomplete=False, converge_vectors=False, max_bytes=None, scratch=None, resources=None, printout=print):
     """\
     This function uses the iterative Lanczos method to extract the lowest num eigenpairs from a linear operator H,
     given B orthonormal initial guess vectors supplied in a list v (actually any iterable sequence).  Orthonormality
@@ -359,7 +364,11 @@ def lowest_eigen(H, v, thresh, dim=10, num=None, block_action=None, autocomplete
     differences.  However, in cases where only a subset of a degenerate set are to be returned, then these
     are ill-defined and the algorithm never converges.  On the other hand, with the energy criterion,
     these ill-defined vectors are quietly returned, since this is a difficult condition to be sure of.
+
+    max_bytes and scratch bound the memory used by the Lanczos vectors of each projection (see projection).  If max_bytes is
+    not given, it is taken from the memory budget of resources (a util.parallel.resources), if that is given.
     """
+    if max_bytes is None and resources is not None:  max_bytes = resources.max_bytes
     debug = False
     Bo = len(v)					# the initial block size (will shrink as vectors converge)
     if (num is None) or (num>Bo):  num = Bo	# if not specified, assume we want one eigenvector per starting vector
@@ -372,7 +381,7 @@ def lowest_eigen(H, v, thresh, dim=10, num=None, block_action=None, autocomplete
     while B>Bo-num or min(vals or [float("inf")])<max(frozen_vals or [-float("inf")]):				# vecs will constantly be replaced, when desired converged vectors are removed, we stop
         P = 1 - frozen_vecs.projection_opr()			# P projects out frozen vectors
         vecs = vector_set(H.space, [ P|Vi for Vi in vecs ])	# If we make sure they are projected out here ... (will be nicer when P|vecs works, also _lowest_eigen enforces ON)
-        vals,vecs,errors = _lowest_eigen(P|H, vals, vecs, dim, block_action, autocomplete, converge_vectors, thresh, printout=printout) # ... then we only need P|H here and not P|H|P (b/c projectors are idempotnent, also block_action "fixed" at lower level)
+        vals,vecs,errors = _lowest_eigen(P|H, vals, vecs, dim, block_action, autocomplete, converge_vectors, thresh, max_bytes, scratch, printout=printout) # ... then we only need P|H here and not P|H|P (b/c projectors are idempotnent, also block_action "fixed" at lower level)
         for n,error in reversed(list(enumerate(errors))):	# loop backwards so that deletions do not change indexes looped over later in time (enumerate is not itself reversible)
            if error<thresh:					# MOVE any converged vectors from vecs to frozen_vecs
                 frozen_vals += [vals[n]]
@@ -382,12 +391,13 @@ def lowest_eigen(H, v, thresh, dim=10, num=None, block_action=None, autocomplete
         B = len(vecs)
     return sorted(zip(frozen_vals,frozen_vecs), key=lambda p: p[0])	# return as list of eigenpair tuples sorted low to high
 
-def lowest_eigen_one_by_one(H, v_list, thresh, dim=10, num=None, block_action=None, autocomplete=False, converge_vectors=False, printout=print):
+def lowest_eigen_one_by_one(H, v_list, thresh, dim=10, num=None, block_action=None, autocomplete=False, converge_vectors=False, max_bytes=None, scratch=None, resources=None, printout=print):
     """
     This function handles a single eigenpair evaluation exactly the same as lowest_eigen, but for multiple eigenpairs
     this function solves each eigenpair separately and then projects it out, as opposed to solving them all as one
     as done in lowest_eigen, which highly increases the robustness of the solver.
     """
+    if max_bytes is None and resources is not None:  max_bytes = resources.max_bytes
     debug = False
     Bo = 1  #len(v)					# the initial block size (will shrink as vectors converge)
     if (num is None) or (num>Bo):  num = Bo	# if not specified, assume we want one eigenvector per starting vector
@@ -401,7 +411,7 @@ def lowest_eigen_one_by_one(H, v_list, thresh, dim=10, num=None, block_action=No
         while B>Bo-num or min(vals or [float("inf")])<max(frozen_vals or [-float("inf")]):				# vecs will constantly be replaced, when desired converged vectors are removed, we stop
             P = 1 - frozen_vecs.projection_opr()			# P projects out frozen vectors
             vecs = vector_set(H.space, [ P|Vi for Vi in vecs ])	# If we make sure they are projected out here ... (will be nicer when P|vecs works, also _lowest_eigen enforces ON)
-            vals,vecs,errors = _lowest_eigen(P|H, vals, vecs, dim, block_action, autocomplete, converge_vectors, thresh, printout=printout) # ... then we only need P|H here and not P|H|P (b/c projectors are idempotnent, also block_action "fixed" at lower level)
+            vals,vecs,errors = _lowest_eigen(P|H, vals, vecs, dim, block_action, autocomplete, converge_vectors, thresh, max_bytes, scratch, printout=printout) # ... then we only need P|H here and not P|H|P (b/c projectors are idempotnent, also block_action "fixed" at lower level)
             for n,error in reversed(list(enumerate(errors))):	# loop backwards so that deletions do not change indexes looped over later in time (enumerate is not itself reversible)
                 if error<thresh:					# MOVE any converged vectors from vecs to frozen_vecs
                     frozen_vals += [vals[n]]
@@ -410,3 +420,162 @@ def lowest_eigen_one_by_one(H, v_list, thresh, dim=10, num=None, block_action=No
                     del vecs[n]
             B = len(vecs)
     return sorted(zip(frozen_vals,frozen_vecs), key=lambda p: p[0])	# return as list of eigenpair tuples sorted low to high
+
+
+
+# Thick-restart block Lanczos.  In contrast to _lowest_eigen above, which rebuilds a fresh Krylov space from only the B best Ritz
+# vectors in each cycle, here the lowest keep Ritz vectors are retained across restarts, along with the most recent block of Lanczos
+# vectors, to which they are coupled by known matrix elements (giving an "arrowhead" block in the projection), and the recursion
+# simply continues from there.  Converged information is thus never discarded, and the number of resident full-length vectors is
+# strictly bounded by max_vecs (counting the new vectors while they are being created by the action of H, and the Ritz vectors while
+# they are being formed at a restart).
+#
+# Each new block is explicitly orthogonalized only against those vectors to which the recursion couples it (the current block, and the
+# previous block or the retained Ritz vectors).  Loss of orthogonality to the rest of the resident vectors is then controlled according
+# to the reorthogonalize option:
+#     "partial" :  the overlaps of the new vectors with the resident ones are estimated in the manner of Simon (using only the small projected
+#                  matrix), and the new block (and the one after it) is orthogonalized to all resident vectors only when these exceed sqrt(eps)
+#     "full"    :  every new block is orthogonalized to all resident vectors (the costly behavior of reorthonormalize=True above)
+# Since the residual norms of all Ritz pairs come for free from the projection, these are what is tested against thresh for convergence.
+# (There is deliberately no option to skip reorthogonalization altogether, since those residual norms cannot be trusted once
+# orthogonality is lost, and a spurious convergence would be reported.)
+
+def _orthonormalize_block(vecs, tol, dtype):
+    """ in-place modified Gram-Schmidt of vecs, dropping those with norm below tol after projection; returns kept vectors and R such that vecs = kept R """
+    kept = []
+    R = numpy.zeros((len(vecs),len(vecs)), dtype=dtype)
+    for j,w in enumerate(vecs):
+        for r,q in enumerate(kept):
+            c = q|w
+            w -= q * c
+            R[r,j] = c
+        norm = sqrt(w|w)
+        if norm>tol:
+            w /= norm
+            R[len(kept),j] = norm
+            kept += [w]
+    return kept, R[:len(kept)]
+
+def _act(H, vecs, block_action):
+    if block_action is None:  return [ H|v for v in vecs ]
+    new = []
+    for i in range(0, len(vecs), block_action):  new += H.act_on_vec_block(vecs[i:i+block_action])
+    return new
+
+def thick_restart_lowest_eigen(H, v, thresh, num=None, max_vecs=None, keep=None, block_action=None, reorthogonalize="partial", max_iterations=None, printout=print):
+    """\
+    This function uses thick-restart block Lanczos (see comments above) to extract the lowest num eigenpairs from a Hermitian linear
+    operator H, given B initial guess vectors in a list v (actually any iterable sequence).  Orthonormality of the input v is enforced
+    by an in place Gram-Schmidt of the vectors therein at the beginning of the algorithm (numerically dependent guesses are dropped).
+
+    num defaults to B, and must not exceed keep, the number of Ritz vectors retained at each restart, which defaults to a quarter of the
+    space left over by max_vecs (which defaults to 20*B) after reserving room for two blocks.  Since the Ritz vectors are formed while the
+    old Lanczos vectors are still resident, max_vecs must be at least 2*(keep+B).  If block_action is set to an integer, then the operator
+    H is acted simultaneously on that number of vectors at a time.
+
+    Convergence is met when the residual norms |H|x>-x|x>| of each of the lowest num Ritz pairs are below thresh.  max_iterations
+    (if not None) limits the number of block actions of H, after which a RuntimeError is raised.  The return value is a list of
+    eigenpair tuples sorted low to high, as for lowest_eigen.
+    """
+    if reorthogonalize not in ("partial", "full"):  raise ValueError("reorthogonalize must be \"partial\" or \"full\"")
+    eps   = machine_epsilon[H.field]
+    dtype = numpy.dtype(H.field)
+    v = list(v)
+    Q, _ = _orthonormalize_block(v, 100*eps*max([sqrt(vi|vi) for vi in v] or [0]), dtype)
+    B = len(Q)
+    if B==0:  raise ValueError("initial guess vectors are all zero or linearly dependent")
+    if num      is None:  num      = B
+    if max_vecs is None:  max_vecs = 20 * B
+    if keep     is None:  keep     = max(num, (max_vecs - 2*B) // 4)
+    if num>keep:                 raise ValueError("cannot converge more eigenpairs than the number of Ritz vectors kept across restarts")
+    if max_vecs < 2*(keep + B):  raise ValueError("max_vecs must be at least 2*(keep + number of guess vectors)")
+    #
+    V       = list(Q)                               # resident (orthonormal) vectors ...
+    T       = numpy.zeros((B,B), dtype=dtype)       # ... and projection of H onto them (known, except for block cur with itself)
+    G       = numpy.eye(B, dtype=dtype)             # estimated overlaps of resident vectors (used for partial reorthogonalization)
+    cur     = list(range(B))                        # indices of the most recent block, which is acted on next
+    coupled = []                                    # indices of vectors coupled to cur by the recursion
+    force   = False                                 # force reorthogonalization of the next block (partial)
+    t0 = time.time()
+    n_actions, n_reorth, cycle = 0, 0, 0
+    while True:
+        # new block:  H|cur> = |V>T[:,cur] + |new>Bmat, with the local orthogonalization giving the unknown parts of T
+        W = _act(H, [V[i] for i in cur], block_action)
+        n_actions += 1
+        for i in coupled + cur:
+            for j,w in zip(cur,W):
+                c = V[i]|w
+                w -= V[i] * c
+                if i in cur:  T[i,j] = c
+        T[numpy.ix_(cur,cur)] = (T[numpy.ix_(cur,cur)] + T[numpy.ix_(cur,cur)].conj().T) / 2
+        normT = numpy.linalg.norm(T)
+        n = len(V)
+        if reorthogonalize=="full" or force:
+            for w in W:
+                for Vi in V:  w -= Vi * (Vi|w)
+        new, Bmat = _orthonormalize_block(W, 100*eps*max(normT,1), dtype)
+        del W
+        # estimate overlaps of the new vectors with the resident ones, reorthogonalizing if needed
+        if reorthogonalize=="full" or force:
+            X = numpy.full((len(new),n), eps, dtype=dtype)
+            force = False
+            n_reorth += 1
+        elif len(new)>0:
+            R = (T.conj().T @ G - G @ T)[:,cur]                       # X^+ Bmat = R, to the extent that local orthogonality holds
+            Binv = numpy.linalg.pinv(Bmat)
+            X = (R @ Binv).conj().T
+            X += numpy.where(X.real<0, -1, 1) * eps * normT * numpy.linalg.norm(Binv)    # round-off (worst-case sign)
+            X[:,coupled+cur] = eps                                     # explicitly orthogonalized against these
+            if reorthogonalize=="partial" and numpy.abs(X).max()>sqrt(eps):
+                for q in new:
+                    for Vi in V:  q -= Vi * (Vi|q)
+                new, _ = _orthonormalize_block(new, 0, dtype)          # renormalize (Bmat retained, as is usual)
+                X = numpy.full((len(new),n), eps, dtype=dtype)
+                force = True
+                n_reorth += 1
+        else:
+            X = numpy.zeros((0,n), dtype=dtype)
+        # Ritz pairs and their residual norms |new>Bmat S[cur,i]
+        theta, S = numpy.linalg.eigh(T)
+        residuals = numpy.linalg.norm(Bmat @ S[cur,:], axis=0) if len(new)>0 else numpy.zeros(n)
+        converged = len(theta)>=num and (residuals[:num]<thresh).all()
+        if converged or len(new)==0:
+            if len(theta)<num:  raise RuntimeError("Krylov space exhausted before requested number of eigenpairs found")
+            del new
+            basis = vector_set(H.space, V)
+            vecs  = [ basis.deproject(S[:,i].tolist()) for i in range(num) ]
+            return sorted(zip(theta[:num].tolist(),vecs), key=lambda p: p[0])
+        if (max_iterations is not None) and n_actions>=max_iterations:
+            raise RuntimeError("thick-restart Lanczos not converged after {} block actions".format(n_actions))
+        b = len(new)
+        if n + b + b + keep <= max_vecs:
+            # continue the recursion
+            T = numpy.pad(T, ((0,b),(0,b)))
+            T[n:,cur] = Bmat
+            T[cur,n:] = Bmat.conj().T
+            G = numpy.pad(G, ((0,b),(0,b)))
+            G[n:,:n], G[:n,n:], G[n:,n:] = X, X.conj().T, numpy.eye(b)
+            V += new
+            coupled, cur = cur, list(range(n,n+b))
+        else:
+            # thick restart:  keep lowest Ritz vectors and the new block, which couples to them through Bmat S[cur,:keep]
+            k = min(keep, n)
+            basis = vector_set(H.space, V)
+            Y = [ basis.deproject(S[:,i].tolist()) for i in range(k) ]
+            del basis, V
+            C = Bmat @ S[cur,:k]
+            T = numpy.zeros((k+b,k+b), dtype=dtype)
+            T[:k,:k] = numpy.diag(theta[:k])
+            T[k:,:k], T[:k,k:] = C, C.conj().T
+            Gk = G
+            G = numpy.eye(k+b, dtype=dtype)
+            G[:k,:k] = S[:,:k].conj().T @ Gk @ S[:,:k]
+            G[k:,:k] = X @ S[:,:k]
+            G[:k,k:] = G[k:,:k].conj().T
+            V = Y + new
+            coupled, cur = list(range(k)), list(range(k,k+b))
+            t1 = time.time()
+            printout("Thick-restart Lanczos cycle {}:  Eigenvalues = {}\nresiduals = {}".format(cycle, theta[:num].tolist(), residuals[:num].tolist()))
+            printout("block actions = {}, reorthogonalizations = {}, cycle time = {}".format(n_actions, n_reorth, t1-t0))
+            t0 = t1
+            cycle += 1
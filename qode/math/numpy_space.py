@@ -22,6 +22,28 @@ import numpy
 # the use of explicit 0 (and be done at a higher level)?
 
 
+def linear_combination(coeffs, vecs, out=None, chunk=2**15):
+    """\
+    Returns a new array sum_i coeffs[i]*vecs[i] or, if out is given, accumulates this into out.  This is done in one pass over
+    memory, chunk by chunk, so that the only temporary is a chunk-sized buffer (which stays in cache), rather than a full-length
+    temporary per term.  (out may also be one of the vecs.)
+    """
+    accumulate = out is not None
+    if not accumulate:  out = numpy.empty(vecs[0].shape, dtype=numpy.result_type(*vecs, *coeffs))
+    dim = len(out)
+    total = numpy.empty(min(chunk,dim), dtype=out.dtype)    # chunk-sized buffers ...
+    term  = numpy.empty(min(chunk,dim), dtype=out.dtype)    # ... reused throughout
+    for beg in range(0, dim, chunk):
+        end = min(beg+chunk, dim)
+        tot, tmp = total[:end-beg], term[:end-beg]
+        numpy.multiply(vecs[0][beg:end], coeffs[0], out=tot)
+        for c,v in zip(coeffs[1:],vecs[1:]):
+            numpy.multiply(v[beg:end], c, out=tmp)
+            tot += tmp
+        if accumulate:  out[beg:end] += tot
+        else:           out[beg:end]  = tot
+    return out
+
 class _generic(object):
     """ Since numpy mostly treats complex and real on the same footing, this code is general; for example .conj() just make a copy of real arrays """
     def __init__(self,dim):
@@ -59,6 +81,9 @@ class _generic(object):
     def copy(v):
         return v.copy()
     @staticmethod
+    def linear_combination(coeffs, vecs, out=None):
+        return linear_combination(coeffs, vecs, out)
+    @staticmethod
     def function_on_diags(func,op):
         func = numpy.vectorize(func)
         return func(op)
@@ -67,23 +92,29 @@ class _generic(object):
         if len(op.shape)==2:  return numpy.dot(op,v)
         else:                 return numpy.multiply(op,v)
     @staticmethod
-    def act_on_vec_block(op,v_block):		# Part of an incomplete progression towards also allowing blocks of vectors (no efficiency gains here, but other traits classes might be smarter)
-        if len(op.shape)==2:  return [ numpy.dot(op,v)      for v in v_block ]
-        else:                 return [ numpy.multiply(op,v) for v in v_block ]
+    def act_on_vec_block(op,v_block):		# the block is stacked as the rows of one array, so that a dense operator acts as a single matrix-matrix product
+        if len(v_block)==0:   return []
+        V = numpy.stack(v_block)
+        if len(op.shape)==2:  return list(V @ op.T)
+        else:                 return list(V * op)
     @staticmethod
     def back_act_on_vec(v,op):
         if   len(op.shape)==2:  return numpy.dot(v.conj(),op).conj()
         else:                   return numpy.multiply(op.conj(),v)
     @staticmethod
-    def dot_vec_blocks(v_block, w_block):
-        return [[numpy.dot(v.conj(),w) for w in w_block] for v in v_block]
+    def back_act_on_vec_block(v_block,op):
+        if len(v_block)==0:   return []
+        V = numpy.stack(v_block)
+        if len(op.shape)==2:  return list((V.conj() @ op).conj())
+        else:                 return list(V * op.conj())
+    @staticmethod
+    def dot_vec_blocks(v_block, w_block):		# matrix of <v|w>, as one matrix-matrix product
+        if len(v_block)==0 or len(w_block)==0:  return numpy.zeros((len(v_block),len(w_block)))
+        return numpy.stack(v_block).conj() @ numpy.stack(w_block).T
     @staticmethod
     def diagonal(op):
-        if   len(op.shape)==2:
-            diags = numpy.array([self.field(0)]*self.dim)
-            for i in range(self.dim):  diags[i] = op[i,i]
-            return diags
-        else: return self	# am I being lazy, or is it really ok not to make a copy, since any function on diags makes a copy
+        if   len(op.shape)==2:  return numpy.diag(op).copy()
+        else:                   return op	# am I being lazy, or is it really ok not to make a copy, since any function on diags makes a copy
 
 class real_traits(_generic):
     def __init__(self,dim):
@@ -17,6 +17,7 @@
 #
 import  math
 import cmath
+import weakref
 from . import field_traits
 
 # Biggest hole at present, if two functionable operators are added, should they not be functionable if in the same basis ... how to let the user implement
@@ -25,10 +26,11 @@ from . import field_traits
 # Also what about making vectors that are tensor products of vectors in different spaces ... how does that interact with dyadic notation
 
 # How to make v+=A|w is all one operation? ... of course, the functions already defined below retain their behavior.
-# Had thought about a thin wrapper vector class that stores a multiplier separately, for things like v+=c*w, but the problem is if something then changes the 
-# underlying data in w ... about the only think I can think of is to make yet a deeper wrapper to the actual data that
-# stores a list of vectors which have a lock on that data.  If that data should need to change in a way that is more fundamental than a scaling,
-# then it forces a copy, then it forces that guy to copy the data ... still how to know when c*v falls out of scope (esp. if temporary).
+# Linear combinations, like c*v or v-c*w, are now deferred (see _lin_comb below), so v+=c*w and v-=a*x+b*y are single (fused) operations
+# and something like u=a*x+b*y+c*z allocates only u.  The problem of the underlying data in x changing before u is evaluated is handled
+# by having each vector keep (weak) track of the unevaluated combinations that refer to it, which are evaluated before any in-place change
+# made through the space (+=, -=, *=, /=).  Changing the raw data of a vector directly (through its .v member) bypasses this, so code that
+# does that should not be holding unevaluated combinations of that vector.
 
 def is_int_zero(vec):
     # This replaces the expression 'vec is 0' in if statements, which, as of python 3.8 began resulting in the following warning
@@ -100,27 +102,25 @@ class _member(object):
     def __rmatmul__(self,other):
         return other|self
     def __iadd__(self,other):
-        """ Handles v+=w, where w is another vector (perhaps 0). """
-        if not is_int_zero(other):  self.space.traits.add_to(self,other)		# checks that both are _member class
+        """ Handles v+=w, where w is another vector (perhaps 0, or an unevaluated linear combination). """
+        if not is_int_zero(other):  self.space.traits.add_terms(self,_terms(other))		# checks that all are _member class of the same space
         return self
     def __add__(self,other):
         """ Handles v+w, where w is another vector (perhaps 0). """
-        value = self.space.traits.copy(self)
-        value += other		# calls __iadd__ above (handles "0" case)
-        return value
+        if is_int_zero(other):  return _lin_comb(_terms(self),self.space)
+        else:                   return _lin_comb(_terms(self)+_terms(other),self.space)
     def __radd__(self,other):
         """ Handles 0+v.  If the left-hand vector would be of vector class, then __add__ above would take precedence. """
-        if is_int_zero(other):  return self.space.traits.copy(self)
+        if is_int_zero(other):  return _lin_comb(_terms(self),self.space)
         else:                   raise Exception('Illegal linear combination with unknown object')
     def __isub__(self,other):
-        """ Handles v-=w, where w is another vector (perhaps 0). """
-        if not is_int_zero(other):  self.space.traits.add_to(self,other,-1)		# checks that both are _member class
+        """ Handles v-=w, where w is another vector (perhaps 0, or an unevaluated linear combination). """
+        if not is_int_zero(other):  self.space.traits.add_terms(self,_terms(other),-1)	# checks that all are _member class of the same space
         return self
     def __sub__(self,other):
         """ Handles v-w, where w is another vector (perhaps 0). """
-        value = self.space.traits.copy(self)
-        value -= other		# calls __isub__ above (handles "0" case)
-        return value
+        if is_int_zero(other):  return _lin_comb(_terms(self),self.space)
+        else:                   return _lin_comb(_terms(self)+_terms(other,-1),self.space)
     def __rsub__(self,other):
         """ Handles 0-v.  If the left-hand vector would be of vector class, then __sub__ above would take precedence. """
         if is_int_zero(other):  return -self		# calls __neg__ below (handles "0" case)
@@ -134,9 +134,7 @@ class _member(object):
         if is_int_zero(other):
             return 0
         elif isinstance(other,(float,int,complex)):
-            value = self.space.traits.copy(self)
-            self.space.traits.scale(other,value)
-            return value
+            return _lin_comb(_terms(self,other),self.space)
         else:
             return _dyadic_op(self,other)			# checks that both are _member class
     def __rmul__(self,n):
@@ -152,9 +150,72 @@ class _member(object):
         return self
     def __neg__(self):
         """ Handles -v. """
-        value = self.space.traits.copy(self)
-        self.space.traits.scale(-1,value)
-        return value
+        return _lin_comb(_terms(self,-1),self.space)
+    def _dependent(self,lin_comb):
+        """ Records (weakly) that the unevaluated lin_comb refers to this vector (see _space_traits.release). """
+        if "_dependents" not in self.__dict__:  self._dependents = weakref.WeakSet()
+        self._dependents.add(lin_comb)
+
+_max_pending_terms = 32	# an unevaluated linear combination longer than this is evaluated (in place) before it is used further
+
+def _terms(vec,n=1):
+    """ (coefficient,vector) pairs for n*vec, with (short) unevaluated linear combinations flattened so that all vectors are evaluated ones """
+    if isinstance(vec,_lin_comb) and vec._terms is not None:
+        if len(vec._terms)<=_max_pending_terms:  return [ (n*c,w) for c,w in vec._terms ]
+        vec._evaluate()    # rather than copying its terms into yet another combination (whose terms would compound with each use)
+        return [ (n,vec) ]
+    elif isinstance(vec,_member):                             return [ (n,vec) ]
+    else:  raise Exception('Illegal linear combination with unknown object')
+
+class _lin_comb(_member):
+    """    + A deferred linear combination sum_i c_i|w_i>, returned by the arithmetic of the _member class above.  The vector data is computed
+        (in one pass, by way of _space_traits.linear_combination) only when first needed, for example when the combination is acted on
+        by an operator or appears in an inner product.  Until then, further linear algebra (including in-place) only manipulates the terms.
+    + As an argument of v+=... or v-=..., the terms are accumulated directly into v, so that no temporary vector is ever made.
+    + The number of terms held is bounded (see _max_pending_terms), so that the deferral never keeps an unbounded history of vectors alive.
+    """
+    def __init__(self,terms,space):
+        for _,w in terms:
+            if w.space is not space:  raise Exception('Illegal linear combination of members from different spaces')
+        self.space  = space
+        self.field  = self.space.field
+        self._terms = terms
+        self._v     = None
+        for _,w in terms:  w._dependent(self)
+    @property
+    def v(self):
+        self._evaluate()
+        return self._v
+    @v.setter
+    def v(self,value):
+        self._terms = None
+        self._v     = value
+    def _evaluate(self):
+        if self._terms is not None:
+            terms, self._terms = self._terms, None
+            self._v = self.space.traits.linear_combination([c for c,_ in terms],[w for _,w in terms])
+    def __iadd__(self,other):
+        if self._terms is None or is_int_zero(other):  return _member.__iadd__(self,other)
+        terms = _terms(other)
+        if len(self._terms)+len(terms)>_max_pending_terms:
+            self._evaluate()
+            return _member.__iadd__(self,other)
+        self._terms += terms
+        for _,w in terms:  w._dependent(self)
+        return self
+    def __isub__(self,other):
+        if self._terms is None or is_int_zero(other):  return _member.__isub__(self,other)
+        terms = _terms(other,-1)
+        if len(self._terms)+len(terms)>_max_pending_terms:
+            self._evaluate()
+            return _member.__isub__(self,other)
+        self._terms += terms
+        for _,w in terms:  w._dependent(self)
+        return self
+    def __imul__(self,n):
+        if self._terms is None:  return _member.__imul__(self,n)
+        self._terms = [ (n*c,w) for c,w in self._terms ]
+        return self
 
 
 
@@ -232,6 +293,39 @@ class _composite_op(_operator_base):
         self.A       = A
         self.B       = B
         self.algebra = algebra
+        self._flat   = None
+    def terms(self):
+        """ This operator as a flat list of (coefficient,factors) terms (see _flatten), computed once. """
+        if self._flat is None:  self._flat = _merge(_flatten(self))
+        return self._flat
+
+def _flatten(X):
+    """\
+    Returns X as a list of (coefficient,factors) terms, the sum of which is X, where factors is a tuple of operators whose product
+    (applied right to left) is the term.  Numbers are absorbed into the coefficients (an empty tuple being the identity), and the
+    factors are otherwise non-composite operators, except that a sum appearing inside a product is kept as a nested list of terms
+    (distributing it would multiply the number of operator actions).
+    """
+    if isinstance(X,(float,int,complex)):  return [(X,())]
+    elif isinstance(X,_composite_op):
+        if X.algebra=='+':  return _flatten(X.A) + _flatten(X.B)
+        (cA,fA),(cB,fB) = _product_factor(_flatten(X.A)), _product_factor(_flatten(X.B))
+        return [(cA*cB, fA+fB)]
+    else:  return [(1,(X,))]
+
+def _product_factor(terms):
+    if len(terms)==1:  return terms[0]
+    else:              return (1, (_merge(terms),))
+
+def _merge(terms):
+    """ combines the coefficients of terms with identical factors (for example, from A + c*A) """
+    merged = {}
+    for c,factors in terms:
+        key = tuple(id(f) for f in factors)
+        if key in merged:  merged[key] = (merged[key][0]+c, factors)
+        else:              merged[key] = (c, factors)
+    nonzero = [ (c,factors) for c,factors in merged.values() if c!=0 ]
+    return nonzero or list(merged.values())[:1]    # keep one term if all vanish, so that the action still gives a (null) vector
 
 class _dyadic_op(_operator_base):
     """\
@@ -337,18 +431,47 @@ class _space_traits(object):
     # Hmmm, a lot of these functions use raw constructors which avoid check functions ... move check function calls into constructors (presently inside generator functions of space class)
     def add_to(self,a,b,n=1):
         if a.space is not b.space:  raise Exception('Illegal linear combination of members from different spaces')
+        self.release(a)
         self.traits.add_to(a.v,b.v,n)
     def scale(self,n,a):
+        self.release(a)
         self.traits.scale(n,a.v)
+    def release(self,a):
+        """ evaluates any unevaluated linear combinations referring to a, which is about to be changed in place """
+        dependents = a.__dict__.get("_dependents")
+        if dependents:
+            for lin_comb in list(dependents):  lin_comb._evaluate()
+            dependents.clear()
+    def add_terms(self,a,terms,n=1):
+        """ in-place a += n sum_i c_i b_i, for the (c_i,b_i) in terms, as a single operation """
+        for _,b in terms:
+            if a.space is not b.space:  raise Exception('Illegal linear combination of members from different spaces')
+        self.release(a)
+        if len(terms)==1:
+            c,b = terms[0]
+            self.traits.add_to(a.v,b.v,n*c)
+        else:
+            self.linear_combination([n*c for c,_ in terms],[b for _,b in terms],a.v)
+    def linear_combination(self,coeffs,vecs,out=None):
+        """ returns new raw vector data sum_i coeffs[i] vecs[i] (for members vecs), or accumulates it into raw vector data out """
+        vecs = [ b.v for b in vecs ]
+        fused = getattr(self.traits,"linear_combination",None)    # optional
+        if fused is not None:  return fused(coeffs,vecs,out)
+        if out is None:
+            out = self.traits.copy(vecs[0])
+            if coeffs[0]!=1:  self.traits.scale(coeffs[0],out)
+            coeffs, vecs = coeffs[1:], vecs[1:]
+        elif any(b is out for b in vecs):    # out += c*out is done first as a scaling, so that the other terms do not see it changed
+            self.traits.scale(1+sum(c for c,b in zip(coeffs,vecs) if b is out),out)
+            coeffs, vecs = [c for c,b in zip(coeffs,vecs) if b is not out], [b for b in vecs if b is not out]
+        for c,b in zip(coeffs,vecs):  self.traits.add_to(out,b,c)
+        return out
     def copy(self,a):
         return _member(self.traits.copy(a.v),a.space)
     def act_on_vec(self,X,a):
         if X.space is not a.space:  raise Exception('Illegal operator on member of different space')
         if isinstance(X,_composite_op):
-            A = X.A
-            B = X.B
-            if   X.algebra=='+':  return (A|a) + (B|a)
-            elif X.algebra=='|':  return (A|(B|a))
+            return _member(self._act_terms(X.terms(),[a],False)[0],a.space)
         elif isinstance(X,_dyadic_op):
             return (X.v)*(X.w|a)
         else:  return _member(self.traits.act_on_vec(X.op,a.v),a.space)
@@ -385,16 +508,54 @@ class _space_traits(object):
         for a in a_block:
             if a.space is not the_space:  raise Exception('Illegal operator on member of different space')
         if isinstance(X,_composite_op):
-            A = X.A
-            B = X.B
-            if   X.algebra=='+':
-                Aa_block = self.act_on_vec_block(A,a_block)
-                Ba_block = self.act_on_vec_block(B,a_block)
-                return [ Aa+Ba for Aa,Ba in zip(Aa_block,Ba_block) ]
-            elif X.algebra=='|':
-                return self.act_on_vec_block(A, self.act_on_vec_block(B,a_block))
+            if len(a_block)==0:  return []
+            return [ _member(v,the_space) for v in self._act_terms(X.terms(),list(a_block),True) ]
         elif isinstance(X,_dyadic_op):  return [ X|a for a in a_block ]
         else:                           return [ _member(v,the_space) for v in self.traits.act_on_vec_block(X.op,[a.v for a in a_block]) ]
+    #
+    # Composite operators are acted as the flat sum of terms given by _composite_op.terms(), with every term accumulated into a single output per
+    # vector.  The traits may implement either or both of the following optional functions, by which a primitive operator increments the output
+    # directly (otherwise its action is added to the output with add_to):
+    #   - act_on_vec_accumulate(op,v,out,coeff):  . . . . . . . . . . . .  out += coeff * op v
+    #   - act_on_vec_block_accumulate(op,v_block,out_block,coeff):  . . .  the same, for lists of vectors
+    # The block argument below says whether the block functions (act_on_vec_block) or the single-vector functions (act_on_vec) are to be used.
+    #
+    def _act_terms(self,terms,a_block,block):
+        """ raw data of sum_t c_t F_t|a for each a in a_block, where F_t is the product of the factors of term t """
+        out = None
+        for c,factors in terms:
+            vecs = a_block
+            for factor in reversed(factors[1:]):  vecs = self._act_factor(factor,vecs,block)    # intermediates of products are unavoidable
+            out = self._accumulate(factors[0] if factors else None, vecs, out, c, block)
+        return out
+    def _act_factor(self,factor,a_block,block):
+        the_space = a_block[0].space
+        if   isinstance(factor,list):  return [ _member(v,the_space) for v in self._act_terms(factor,a_block,block) ]
+        elif block:                    return self.act_on_vec_block(factor,a_block)
+        else:                          return [ self.act_on_vec(factor,a) for a in a_block ]
+    def _accumulate(self,op,a_block,out,c,block):
+        """ out += c op|a for each a in a_block (op is None for the identity), where out is a list of raw data, or None if not yet created """
+        if out is None:    # first term creates the output (rather than starting from zero)
+            if op is None:  return [ self.linear_combination([c],[a]) for a in a_block ]
+            out = [ b.v for b in self._act_factor(op,a_block,block) ]    # always new vectors, so safe to scale in place
+            if c!=1:
+                for o in out:  self.traits.scale(c,o)
+        elif op is None:
+            for o,a in zip(out,a_block):  self.linear_combination([c],[a],o)
+        elif isinstance(op,_dyadic_op):
+            for o,a in zip(out,a_block):  self.traits.add_to(o,op.v.v,c*(op.w|a))
+        elif isinstance(op,list):
+            for o,b in zip(out,self._act_terms(op,a_block,block)):  self.traits.add_to(o,b,c)
+        else:
+            single_fn = getattr(self.traits,"act_on_vec_accumulate",None)
+            block_fn  = getattr(self.traits,"act_on_vec_block_accumulate",None)
+            if block and block_fn is not None:
+                block_fn(op.op,[a.v for a in a_block],out,c)
+            elif single_fn is not None:
+                for o,a in zip(out,a_block):  single_fn(op.op,a.v,o,c)
+            else:
+                for o,b in zip(out,self._act_factor(op,a_block,block)):  self.traits.add_to(o,b.v,c)
+        return out
     def back_act_on_vec_block(self,a_block,X):
         if isinstance(X,(float,int,complex)):  return [ a|X for a in a_block ]		# This only needs to be here since act_on_vec_block called directly since not finished yet
         # Note return above . . . the remainder does not appy to scalar operators
@@ -465,16 +626,17 @@ def _default_check_member(v):             raise NotImplementedError
 def _default_check_lin_op(op):            raise NotImplementedError
 
 class traits(object):
-    def __init__(self, field, dot=_default_dot, add_to=_default_add_to, scale=_default_scale, copy=_default_copy, act_on_vec=_default_act_on_vec, back_act_on_vec=_default_back_act_on_vec, function_on_diags=_default_function_on_diags, diagonal=_default_diagonal, check_member=_default_check_member, check_lin_op=_default_check_lin_op, aux=None):
-        self.field             = field
-        self.dot               = dot
-        self.add_to            = add_to
-        self.scale             = scale
-        self.copy              = copy
-        self.act_on_vec        = act_on_vec
-        self.back_act_on_vec   = back_act_on_vec
-        self.function_on_diags = function_on_diags
-        self.diagonal          = diagonal
-        self.check_member      = check_member
-        self.check_lin_op      = check_lin_op
-        self.aux               = aux
+    def __init__(self, field, dot=_default_dot, add_to=_default_add_to, scale=_default_scale, copy=_default_copy, act_on_vec=_default_act_on_vec, back_act_on_vec=_default_back_act_on_vec, function_on_diags=_default_function_on_diags, diagonal=_default_diagonal, check_member=_default_check_member, check_lin_op=_default_check_lin_op, aux=None, linear_combination=None):
+        self.field              = field
+        self.dot                = dot
+        self.add_to             = add_to
+        self.scale              = scale
+        self.copy               = copy
+        self.act_on_vec         = act_on_vec
+        self.back_act_on_vec    = back_act_on_vec
+        self.function_on_diags  = function_on_diags
+        self.diagonal           = diagonal
+        self.check_member       = check_member
+        self.check_lin_op       = check_lin_op
+        self.aux                = aux
+        self.linear_combination = linear_combination    # optional (None is a signal to fall back on add_to and scale)
@@ -20,8 +20,8 @@ from .base           import evaluate, increment, raw, scalar_value, initialize_t
 from .tensors        import tensor_sum    # tensor_sum() can initialize an empty accumulator for += use
 from .tensors        import primitive_tensor as _primitive_tensor
 from .contract       import contract      # the only way to build a tensor_network
-from .backends       import dummy_backend, numpy_backend, tensorly_backend
-from .tensor_network import backend_contract_path
+from .backends       import dummy_backend, numpy_backend, tensorly_backend, block_sparse_backend
+from .tensor_network import backend_contract_path, contraction_path, plan_cache
 
 def primitive_tensor_wrapper(backend, copy_data=False):
     def wrapper(raw_tensor):
@@ -31,3 +31,4 @@ def primitive_tensor_wrapper(backend, copy_data=False):
 dummy_tensor = primitive_tensor_wrapper(dummy_backend,    copy_data=False)
 np_tensor    = primitive_tensor_wrapper(numpy_backend.functions,    copy_data=False)
 tl_tensor    = primitive_tensor_wrapper(tensorly_backend.functions, copy_data=False)
+bs_tensor    = primitive_tensor_wrapper(block_sparse_backend.functions, copy_data=False)
@@ -18,3 +18,4 @@
 
 from . import dummy_backend
 from . import numpy_backend
+from . import block_sparse_backend
@@ -0,0 +1,64 @@
+#    (C) Copyright 2023 Anthony D. Dutoi
+#
+#    This file is part of Qode.
+#
+#    Qode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Qode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Qode.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# The raw tensors of this backend are block_tensor objects (see block_tensor.py), dictionaries of dense numpy blocks, so that
+# block-structured data that is largely zero (fragment-blocked integrals, symmetry-blocked densities, ...) can be used in
+# tensornet expressions without storing or contracting the zeros.
+
+import numpy
+from . import block_tensor as _block_tensor
+from .block_tensor import block_tensor, from_dense
+
+def copy_data(tensor):
+    return tensor.copy()
+
+def scalar_value(tensor):
+    return tensor.item()
+
+def scalar_tensor(scalar):
+    return block_tensor({():numpy.array(scalar)}, ())
+
+def shape(tensor):
+    return tensor.shape
+
+def zeros(shape):
+    return block_tensor({}, [{0:length} for length in shape])    # a single (absent) block per axis; adopts the partition of whatever is added to it
+
+def contract(*tensor_factors):
+    return _block_tensor.contract(*tensor_factors)
+
+
+
+# See numpy_backend.py for why this is here.
+class _functions(object):
+    def ID(self):
+        return id(_functions)
+    def copy_data(self, tensor):
+        return copy_data(tensor)
+    def scalar_value(self, tensor):
+        return scalar_value(tensor)
+    def scalar_tensor(self, scalar):
+        return scalar_tensor(scalar)
+    def shape(self, tensor):
+        return shape(tensor)
+    def zeros(self, shape):
+        return zeros(shape)
+    def contract(self, *tensor_factors):
+        return contract(*tensor_factors)
+
+functions = _functions()
@@ -0,0 +1,175 @@
+#    (C) Copyright 2023 Anthony D. Dutoi
+#
+#    This file is part of Qode.
+#
+#    Qode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Qode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Qode.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import numpy
+from . import numpy_backend    # the dense kernels for the individual blocks
+
+
+
+# A block_tensor is a dictionary of dense numpy arrays (the blocks), keyed by tuples of block labels, one per axis, where any
+# block that is absent is zero.  The partition gives, for each axis, a dictionary from its block labels (any hashable objects,
+# like the fragment labels used as keys by atoms.integrals.fragments.block_2) to the lengths of those blocks, in the order that
+# they are laid out along that axis.  Contractions only ever touch combinations of blocks that are present.
+
+class block_tensor(object):
+    def __init__(self, blocks, partition=None):
+        self.blocks = {tuple(key):numpy.asarray(block) for key,block in dict(blocks).items()}
+        if partition is None:    # read off of the blocks (in order of first appearance), so every block label must appear somewhere
+            if not self.blocks:  raise ValueError("the partition of a block_tensor with no blocks must be given")
+            n_axes = len(next(iter(self.blocks)))
+            partition = [{} for _ in range(n_axes)]
+            for key,block in self.blocks.items():
+                for axis,(label,length) in enumerate(zip(key,block.shape)):
+                    partition[axis].setdefault(label, length)
+        self.partition = tuple(dict(part) for part in partition)
+        self.shape     = tuple(sum(part.values()) for part in self.partition)
+        for key,block in self.blocks.items():
+            if len(key)!=len(self.partition) or block.shape!=tuple(part.get(label) for label,part in zip(key,self.partition)):
+                raise ValueError("block {} of block_tensor is not consistent with the partition of the axes".format(key))
+    def copy(self):
+        return block_tensor({key:block.copy() for key,block in self.blocks.items()}, self.partition)
+    def item(self):
+        if len(self.shape)!=0:
+            raise ValueError("can only convert a block_tensor with no indices to a scalar")
+        return self.blocks[()].item() if () in self.blocks else 0.
+    def to_dense(self):
+        offsets = [_offsets(part) for part in self.partition]
+        dtype = numpy.result_type(*self.blocks.values()) if self.blocks else numpy.float64
+        dense = numpy.zeros(self.shape, dtype=dtype)
+        for key,block in self.blocks.items():
+            dense[tuple(slice(offset[label], offset[label]+block.shape[axis]) for axis,(label,offset) in enumerate(zip(key,offsets)))] = block
+        return dense
+    def __iadd__(self, other):
+        if not self.blocks and self.shape==other.shape:  self.partition = other.partition    # eg, from zeros(), which knows nothing of the blocking
+        if _layout(self.partition)!=_layout(other.partition):
+            raise ValueError("cannot add block_tensors with different block partitions")
+        for key,block in other.blocks.items():
+            if key in self.blocks:  self.blocks[key] = _iadd(self.blocks[key], block)
+            else:                   self.blocks[key] = numpy.array(block)
+        return self
+    def __mul__(self, scalar):
+        return block_tensor({key:scalar*block for key,block in self.blocks.items()}, self.partition)
+    def __rmul__(self, scalar):
+        return self.__mul__(scalar)
+    def __getitem__(self, indices):    # integer indices and full slices only (as many as there are axes, see base.resolve_ellipsis)
+        if not isinstance(indices, tuple):  indices = (indices,)
+        partition, selection = [], []    # for the kept axes, and the block label and position within the block for the others
+        for index,part in zip(indices, self.partition):
+            if isinstance(index, slice):
+                if index!=slice(None):  raise ValueError("block_tensor can only be indexed with integers and full slices")
+                partition += [part]
+                selection += [None]
+            else:
+                if index<0:  index += sum(part.values())
+                for label,length in part.items():
+                    if index<length:  break
+                    index -= length
+                else:
+                    raise IndexError("index out of range for block_tensor")
+                selection += [(label,index)]
+        blocks = {}
+        for key,block in self.blocks.items():
+            if all(chosen is None or chosen[0]==label for label,chosen in zip(key,selection)):
+                new_key = tuple(label for label,chosen in zip(key,selection) if chosen is None)
+                blocks[new_key] = block[tuple(slice(None) if chosen is None else chosen[1] for chosen in selection)]
+        if not partition:  return blocks[()].item() if () in blocks else 0.
+        return block_tensor(blocks, partition)
+    def __str__(self):
+        return "\n".join("{}:\n{}".format(key, block) for key,block in self.blocks.items()) or "(all blocks zero) shape {}".format(self.shape)
+
+def _layout(partition):
+    return tuple(tuple(part.items()) for part in partition)    # since the order of the blocks matters, unlike for dictionary equality
+
+def _offsets(part):
+    offsets, offset = {}, 0
+    for label,length in part.items():
+        offsets[label] = offset
+        offset += length
+    return offsets
+
+def _iadd(block, other):
+    block += other    # in place for arrays, but also works for the numpy scalars that the dense kernel returns for 0-dim results
+    return block
+
+def from_dense(array, partition, threshold=0):
+    """ the block_tensor holding the blocks of array (for the given partition) that have an element greater than threshold in magnitude """
+    array = numpy.asarray(array)
+    offsets = [_offsets(part) for part in partition]
+    keys = [()]
+    for part in partition:  keys = [key+(label,) for key in keys for label in part]
+    blocks = {}
+    for key in keys:
+        block = array[tuple(slice(offset[label], offset[label]+part[label]) for label,offset,part in zip(key,offsets,partition))]
+        if block.size and numpy.abs(block).max()>threshold:  blocks[key] = numpy.array(block)
+    return block_tensor(blocks, partition)
+
+
+
+# Same signature as numpy_backend.contract.  Each combination of blocks present in the factors, for which the block labels
+# agree for all axes sharing an index label, is handed to the dense kernel, and the results are accumulated into the output
+# block given by the block labels of the free indices.  All axes sharing an index label must have the same partition.
+def contract(*tensor_factors):
+    scalar, tensors, index_lists = 1, [], []
+    for factor in tensor_factors:
+        try:
+            tens, *indices = factor
+        except:
+            scalar *= factor
+        else:
+            if len(indices)!=len(tens.shape):
+                raise ValueError("argument {} to block_tensor.contract has wrong number of indices specified".format(len(tensors)))
+            tensors     += [tens]
+            index_lists += [indices]
+    partition = {}    # the partition of the axes carrying each index label
+    for tens,indices in zip(tensors, index_lists):
+        for label,part in zip(indices, tens.partition):
+            if _layout([partition.setdefault(label, part)])!=_layout([part]):
+                raise ValueError("axes with index label \"{}\" in block_tensor.contract have different block partitions".format(label))
+    n_free = len([label for label in partition if isinstance(label,int)])
+    if any(i not in partition for i in range(n_free)):
+        raise ValueError("specification of free indices in arguments to block_tensor.contract has a gap")
+    #
+    # To find the compatible combinations quickly, the blocks of each tensor are grouped by the block labels that they have for
+    # the index labels that also appear in the tensors before it.
+    groups, seen = [], set()
+    for tens,indices in zip(tensors, index_lists):
+        shared = tuple(dict.fromkeys(label for label in indices if label in seen))
+        positions = [indices.index(label) for label in shared]
+        group = {}
+        for key,block in tens.blocks.items():
+            group.setdefault(tuple(key[pos] for pos in positions), []).append((key,block))
+        groups += [(shared, group)]
+        seen |= set(indices)
+    #
+    result = block_tensor({}, [partition[i] for i in range(n_free)])
+    def combine(k, assigned, blocks):
+        if k==len(tensors):
+            key = tuple(assigned[i] for i in range(n_free))
+            value = numpy_backend.contract(*[(block, *indices) for block,indices in zip(blocks,index_lists)])
+            if key in result.blocks:  result.blocks[key] = _iadd(result.blocks[key], value)
+            else:                     result.blocks[key] = value
+            return
+        shared, group = groups[k]
+        for key,block in group.get(tuple(assigned[label] for label in shared), []):
+            new = dict(assigned)
+            if all(new.setdefault(label, block_label)==block_label for label,block_label in zip(index_lists[k],key)):    # repeated labels within a tensor
+                combine(k+1, new, blocks+[block])
+    combine(0, {}, [])
+    if scalar!=1:
+        for key in result.blocks:  result.blocks[key] = scalar * result.blocks[key]
+    return result
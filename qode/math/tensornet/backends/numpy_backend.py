@@ -16,7 +16,24 @@
 #    along with Qode.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import math
+import tempfile
 import numpy
+from ....util import parallel
+
+# How contract (below) uses the machine:  contractions that are not matrix multiplications (which get their threads from BLAS) are
+# tiled over a free axis on a thread pool of resources.n_threads (or as many as the core budget allows if no resources are set),
+# and outputs larger than resources.max_bytes are written tile by tile to a memory-mapped file in the directory scratch (see
+# set_resources).  Contractions with fewer than _min_tiled_work multiply-adds are never tiled, and those with fewer than
+# _min_gemm_work are left to einsum, which has less overhead.
+_resources, _scratch = None, None
+_min_tiled_work = 2**22
+_min_gemm_work  = 2**12
+
+def set_resources(resources=None, scratch=None):
+    """ resources is a parallel.resources (or None for the default behavior), and scratch a directory (None for that of tempfile) """
+    global _resources, _scratch
+    _resources, _scratch = resources, scratch
 
 def copy_data(tensor):
     return numpy.array(tensor)
@@ -33,7 +50,8 @@ def shape(tensor):
 def zeros(shape):
     return numpy.zeros(shape)
 
-def contract(*tensor_factors):
+def contract(*tensor_factors, out=None):
+    """ if out is given, the result is written into it (overwriting it) and it is returned """
     ####
     # args = []
     # for factor in tensor_factors:
@@ -84,13 +102,77 @@ def contract(*tensor_factors):
             if isinstance(indices[i],int):
                 indices[i] = free_indices[indices[i]]
         instructions += ["".join(indices)]
-    instructions = ",".join(instructions)
-    instructions += "->"
-    instructions += "".join(free_indices)
-    # print("einsum called with", instructions)
-    value = scalar * numpy.einsum(instructions, *tensors)
-    # print("value id", id(value))
-    return value
+    output = "".join(free_indices)
+    #
+    lengths = {}
+    for tens,indices in zip(tensors, instructions):  lengths.update(zip(indices, tens.shape))
+    work = math.prod(lengths.values())
+    kernel = _gemm if work>=_min_gemm_work and _gemmable(instructions, output) else _einsum
+    max_bytes = None if _resources is None else _resources.max_bytes
+    if out is None and max_bytes is None and (kernel is _gemm or work<_min_tiled_work):    # the usual case, settled quickly
+        return kernel(tensors, instructions, output, scalar)
+    shape = tuple(lengths[letter] for letter in output)
+    dtype = numpy.result_type(*tensors, scalar)
+    too_big = max_bytes is not None and math.prod(shape)*dtype.itemsize>max_bytes
+    n_threads = 1
+    if kernel is _einsum and work>=_min_tiled_work:
+        n_threads = parallel.core_budget.n_cores if _resources is None else _resources.n_threads
+    if 0 in shape or len(shape)==0 or (out is None and not too_big and n_threads==1):
+        # print("einsum called with", instructions, output)
+        value = kernel(tensors, instructions, output, scalar)
+        if out is None:  return value
+        out[...] = value
+        return out
+    #
+    # Tiled over the longest free axis, with each tile small enough (if needed) and enough tiles to keep the threads busy
+    if out is None:  out = _memmap(shape, dtype) if too_big else numpy.empty(shape, dtype=dtype)
+    axis = max(range(len(shape)), key=lambda i: shape[i])
+    n_tiles = n_threads
+    if too_big:  n_tiles = max(n_tiles, -(-math.prod(shape)*dtype.itemsize*n_threads // max_bytes))
+    tile = -(-shape[axis] // min(n_tiles, shape[axis]))
+    def compute(beg, end):
+        cut = [tens[tuple(slice(beg,end) if letter==output[axis] else slice(None) for letter in indices)] for tens,indices in zip(tensors,instructions)]
+        out[(slice(None),)*axis + (slice(beg,end),)] = kernel(cut, instructions, output, scalar)
+    tiles = [(beg, min(beg+tile, shape[axis])) for beg in range(0, shape[axis], tile)]
+    with (parallel.thread_pool(n_threads) if _resources is None else _resources.thread_pool(n_threads)) as pool:
+        pool.map(compute, tiles)    # numpy releases the GIL in einsum and matmul
+    return out
+
+def _einsum(tensors, instructions, output, scalar):
+    return scalar * numpy.einsum(",".join(instructions) + "->" + output, *tensors)
+
+def _gemmable(instructions, output):
+    """ contractions of two tensors that sum over at least one shared index, with no index repeated within either, go to matmul """
+    if len(instructions)!=2:  return False
+    a, b = instructions
+    return len(set(a))==len(a) and len(set(b))==len(b) and bool(set(a) & set(b) - set(output))
+
+def _gemm(tensors, instructions, output, scalar):
+    """ the same result as _einsum, as one (possibly batched) matrix multiplication, after transposing and reshaping the inputs """
+    (A,a), (B,b) = [_sum_unique(tensors[i], instructions[i], instructions[1-i]+output) for i in (0,1)]
+    lengths = dict(zip(a, A.shape))
+    lengths.update(zip(b, B.shape))
+    batch  = [letter for letter in output if letter in a and letter in b]
+    left   = [letter for letter in output if letter in a and letter not in b]
+    right  = [letter for letter in output if letter in b and letter not in a]
+    summed = [letter for letter in a if letter in b and letter not in output]
+    size = lambda letters: math.prod(lengths[letter] for letter in letters)
+    A = A.transpose([a.index(letter) for letter in batch+left+summed]).reshape(size(batch), size(left), size(summed))
+    B = B.transpose([b.index(letter) for letter in batch+summed+right]).reshape(size(batch), size(summed), size(right))
+    order = batch + left + right
+    C = numpy.matmul(A, B).reshape([lengths[letter] for letter in order]).transpose([order.index(letter) for letter in output])
+    return C if scalar==1 else scalar*C
+
+def _sum_unique(tens, indices, others):
+    """ tens and its indices, after summing over those of its axes whose index is not among others """
+    unique = [i for i,letter in enumerate(indices) if letter not in others]
+    if unique:  tens, indices = tens.sum(axis=tuple(unique)), "".join(letter for letter in indices if letter in others)
+    return tens, indices
+
+def _memmap(shape, dtype):
+    """ an uninitialized array in a file in the directory _scratch that is removed from the file system when closed """
+    with tempfile.TemporaryFile(dir=_scratch) as file:    # the map holds its own reference to the file
+        return numpy.memmap(file, dtype=dtype, mode="w+", shape=shape)
 
 
 
@@ -114,7 +196,7 @@ class _functions(object):
         return shape(tensor)
     def zeros(self, shape):
         return zeros(shape)
-    def contract(self, *tensor_factors):
-        return contract(*tensor_factors)
+    def contract(self, *tensor_factors, out=None):
+        return contract(*tensor_factors, out=out)
 
 functions = _functions()
@@ -0,0 +1,175 @@
+#    (C) Copyright 2023 Anthony D. Dutoi
+#
+#    This file is part of Qode.
+#
+#    Qode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Qode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Qode.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import math
+import random
+
+
+
+# Like heuristic.py, this lives above the backends and knows nothing about the hardware, only the lengths of the axes.
+#
+# A network is described by inputs, a list with the index labels of each tensor (one per axis, possibly repeated within a tensor),
+# output, the ordered labels of the result, and sizes, a dictionary giving the axis length for each label.  A label that is in more
+# than two tensors (or in one or more tensors and also the output) is summed (or kept) only once all of them have been combined.
+# A path is a list of pairs (i,j), i<j, of positions in the current list of tensors, which are removed and replaced by their
+# contraction, appended to the end of the list (the convention of opt_einsum).  Any network (connected or not) is reduced to a
+# single tensor by len(inputs)-1 pairs.
+#
+# The cost of a pairwise contraction is the number of multiply-adds (the product of the lengths of all the labels of both tensors)
+# plus the size of the result that must be written.  If max_size is given, paths are chosen among those whose intermediates (not
+# counting the final result) have no more than that many elements, if any exist.
+
+def _prod(labels, sizes):
+    return math.prod(sizes[label] for label in labels)
+
+def _result(labels_a, labels_b, needed):
+    """ the labels of the contraction of two tensors, those among their labels (in order of appearance) that are still needed """
+    return tuple(label for label in dict.fromkeys(labels_a + labels_b) if label in needed)
+
+def _needed(tensors, output, excluding):
+    """ the labels that are in the output or in any of tensors, apart from those at the positions given in excluding """
+    needed = set(output)
+    for k,labels in enumerate(tensors):
+        if k not in excluding:  needed |= set(labels)
+    return needed
+
+def path_cost(inputs, output, sizes, path):
+    """ the total cost of path (see above) and the size of its largest intermediate """
+    tensors, total, largest = [tuple(labels) for labels in inputs], 0, 0
+    for step,(i,j) in enumerate(path):
+        last = (step==len(path)-1)
+        new = tuple(output) if last else _result(tensors[i], tensors[j], _needed(tensors, output, (i,j)))
+        total += _prod(set(tensors[i]) | set(tensors[j]), sizes) + _prod(new, sizes)
+        if not last:  largest = max(largest, _prod(new, sizes))
+        del tensors[j], tensors[i]
+        tensors += [new]
+    return total, largest
+
+
+
+def dynamic_programming(inputs, output, sizes, max_size=None):
+    """ the optimal path (see above), by building up the best contraction of every subset of the tensors (exponential in their number) """
+    n = len(inputs)
+    if n<2:  return []
+    everything = (1<<n) - 1
+    in_tensors = {}    # for each label, the bitmask of the tensors it appears in
+    for k,labels in enumerate(inputs):
+        for label in labels:  in_tensors[label] = in_tensors.get(label,0) | (1<<k)
+    def open_labels(subset):
+        """ the labels of the contraction of the tensors in subset, those that appear also outside it (or in the output) """
+        if subset==everything:  return tuple(output)
+        labels = set()
+        for k in range(n):
+            if subset & (1<<k):  labels |= set(inputs[k])
+        return tuple(label for label in labels if (in_tensors[label] & ~subset) or (label in output))
+    best = {1<<k:(0,None) for k in range(n)}    # for each subset, the lowest cost and the split of it that gives that
+    labels_of = {1<<k:tuple(set(inputs[k])) for k in range(n)}
+    for subset in sorted(range(1,everything+1), key=lambda s: bin(s).count("1")):
+        if subset in best:  continue
+        labels = open_labels(subset)
+        size = _prod(labels, sizes)
+        if max_size is not None and size>max_size and subset!=everything:  continue
+        lowest = subset & -subset
+        part = (subset-1) & subset
+        while part:
+            if (part & lowest) and (part in best) and (subset^part in best):    # each split counted once (lowest tensor always in first part)
+                a, b = part, subset^part
+                cost = best[a][0] + best[b][0] + _prod(set(labels_of[a]) | set(labels_of[b]), sizes) + size
+                if subset not in best or cost<best[subset][0]:  best[subset] = (cost, (a,b))
+            part = (part-1) & subset
+        if subset in best:  labels_of[subset] = labels
+    if everything not in best:  return dynamic_programming(inputs, output, sizes)    # no path respects max_size
+    path, positions = [], [1<<k for k in range(n)]    # positions holds the subset that each current tensor represents
+    def unroll(subset):
+        a_b = best[subset][1]
+        if a_b is None:  return
+        a, b = a_b
+        unroll(a)
+        unroll(b)
+        i, j = sorted((positions.index(a), positions.index(b)))
+        path.append((i,j))
+        del positions[j], positions[i]
+        positions.append(subset)
+    unroll(everything)
+    return path
+
+
+
+def greedy(inputs, output, sizes, max_size=None, rng=None, temperature=1.):
+    """\
+    a path (see above) built by repeatedly contracting the pair of tensors that share a label and for which the size of the result,
+    less the sizes of the pair, is smallest (breaking ties by the number of multiply-adds).  Pairs whose result would exceed max_size
+    are avoided if any other is possible, and unconnected tensors are combined smallest first only when nothing else is left.  If rng (a
+    random.Random) is given, the choice at each step is instead random, with candidates weighted by exp(-dscore/temperature), where
+    dscore is the excess of their scores over the best, relative to the magnitude of the best.
+    """
+    tensors, path = [tuple(labels) for labels in inputs], []
+    while len(tensors)>1:
+        last = (len(tensors)==2)
+        candidates = []
+        for j in range(len(tensors)):
+            for i in range(j):
+                if not (set(tensors[i]) & set(tensors[j])):  continue
+                new = tuple(output) if last else _result(tensors[i], tensors[j], _needed(tensors, output, (i,j)))
+                size = _prod(new, sizes)
+                score = size - _prod(tensors[i], sizes) - _prod(tensors[j], sizes)
+                candidates += [((score, _prod(set(tensors[i]) | set(tensors[j]), sizes)), (i,j), new, size)]
+        if max_size is not None and not last:
+            fitting = [candidate for candidate in candidates if candidate[3]<=max_size]
+            if fitting:  candidates = fitting
+        if candidates:
+            candidates.sort()
+            if rng is None or len(candidates)==1:
+                _, (i,j), new, _ = candidates[0]
+            else:
+                best = candidates[0][0][0]
+                weights = [math.exp(-min(700., (score-best) / (temperature*max(1,abs(best))))) for (score,_),_,_,_ in candidates]
+                _, (i,j), new, _ = rng.choices(candidates, weights)[0]
+        else:    # no connected pair is left
+            i, j = sorted(sorted(range(len(tensors)), key=lambda k: _prod(tensors[k], sizes))[:2])
+            new = tuple(output) if last else _result(tensors[i], tensors[j], _needed(tensors, output, (i,j)))
+        path.append((i,j))
+        del tensors[j], tensors[i]
+        tensors += [new]
+    return path
+
+def random_greedy(inputs, output, sizes, max_size=None, n_trials=32, seed=0, temperature=1.):
+    """ the best (by path_cost) of the deterministic greedy path and n_trials randomized ones, preferring those respecting max_size """
+    rng = random.Random(seed)
+    best_path, best_key = None, None
+    for trial in range(n_trials+1):
+        path = greedy(inputs, output, sizes, max_size, rng=(rng if trial>0 else None), temperature=temperature)
+        total, largest = path_cost(inputs, output, sizes, path)
+        key = (max_size is not None and largest>max_size, total)
+        if best_key is None or key<best_key:  best_path, best_key = path, key
+    return best_path
+
+
+
+planners = {"dp":dynamic_programming, "greedy":greedy, "random-greedy":random_greedy}
+
+def optimal_path(inputs, output, sizes, method="auto", max_size=None, dp_max=8):
+    """\
+    a path (see above) found by method, which is one of the keys of planners, or "auto" (dynamic programming for networks of at
+    most dp_max tensors, randomized greedy for larger ones), or any function with the same signature as those in planners
+    """
+    if method=="auto":  method = "dp" if len(inputs)<=dp_max else "random-greedy"
+    if not callable(method):
+        if method not in planners:  raise ValueError("unknown contraction path method \"{}\"".format(method))
+        method = planners[method]
+    return method(inputs, output, sizes, max_size)
@@ -16,17 +16,113 @@
 #    along with Qode.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import math
+import threading
+import collections
 from .base      import evaluate, raw, scalar_value, resolve_ellipsis, timings_start, timings_record
 from .tensors   import summable_tensor, tensor_sum, primitive_tensor
-from .heuristic import heuristic    # how to order contraction executions in a network
+from .heuristic import heuristic    # how to order contraction executions in a network (the older way, see contraction_path below)
+from .path_planner import optimal_path
 
 _backend_contract_path = False    # if True, let backend handle finding the optimal contraction path upon evaluate() call
+_path_method = "auto"             # how tensornet finds the contraction path otherwise (see contraction_path below)
+_max_intermediate_size = None     # if not None, the most elements an intermediate of that path may have (where possible)
 _warned = False                   # have we warned the user yet against asking for individual tensor elements?
 
 def backend_contract_path(TrueFalse):
     global _backend_contract_path
     _backend_contract_path = TrueFalse
 
+def contraction_path(method="auto", max_size=None):
+    """\
+    Chooses how tensornet finds the contraction path of a network (when the backend is not asked to).  method is any of those
+    understood by path_planner.optimal_path ("auto", "dp", "greedy", "random-greedy", or a planner function), in which case the
+    path for the whole network is found once when it is evaluated, or "heuristic", for the older heuristic, which chooses only the
+    next reduction and is re-run on the network that remains after each.  max_size is a ceiling on the number of elements in any
+    intermediate (respected by the path planners if possible, and ignored by the heuristic).
+    """
+    global _path_method, _max_intermediate_size
+    _path_method, _max_intermediate_size = method, max_size
+
+
+
+# The structure of a network is a tuple with the shape of each primitive tensor and the labels of its axes (free index i is labeled
+# i, and contractions are labeled after those), which is all that is needed to plan its evaluation (see contraction_path).  Iterative
+# methods evaluate networks of the same structure many times over with new data, so the plans are kept in plan_cache, keyed by the
+# structure along with the backend and the path-finding options.  It holds the most recently used plans, up to its capacity, and
+# its stats() tell how often a plan was reused (hits) or had to be made (misses).
+
+def _contraction_sequence(structure, n_free):
+    """\
+    The backend.contract calls that evaluate a network of the given structure along a path found for the whole of it.  Each is given
+    as (positions, index_lists, with_scalar), meaning that the tensors at positions in a running list (which starts as the primitive
+    tensors, in the order of structure) are contracted with the given index arguments (multiplied by the overall scalar of the
+    network if with_scalar), and replaced by the result at the end of the list.  The scalar goes to the call with the smallest result.
+    """
+    tensors, sizes = [labels for _,labels in structure], {}
+    for shape,labels in structure:
+        for length,label in zip(shape,labels):  sizes[label] = length
+    output = tuple(range(n_free))
+    if len(tensors)==1:  path = [(0,)]    # only a trace, transposition, and/or scaling
+    else:                path = optimal_path(tensors, output, sizes, _path_method, _max_intermediate_size)
+    sequence, result_sizes = [], []
+    for step,positions in enumerate(path):
+        operands = [tensors[p] for p in positions]
+        if step==len(path)-1:
+            new = output
+        else:
+            needed = set(output)
+            for k,other in enumerate(tensors):
+                if k not in positions:  needed |= set(other)
+            new = tuple(label for label in dict.fromkeys(sum(operands, ())) if label in needed)
+        position_in_new = {label:i for i,label in enumerate(new)}
+        letters = {}
+        def _index(label):
+            if label in position_in_new:  return position_in_new[label]
+            if label not in letters:
+                i = len(letters)
+                letters[label] = "abcdefghijklmnopqrstuvwxyz"[i] if i<26 else str(i)    # obfuscated if ever printed for >26 indices (?!)
+            return letters[label]
+        sequence += [[tuple(positions), [tuple(_index(label) for label in operand) for operand in operands], False]]
+        result_sizes += [math.prod(sizes[label] for label in new)]
+        for p in sorted(positions, reverse=True):  del tensors[p]
+        tensors += [new]
+    if sequence:  sequence[result_sizes.index(min(result_sizes))][2] = True
+    return tuple(tuple(step) for step in sequence)
+
+class _plan_cache(object):
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.hits, self.misses = 0, 0
+        self._plans = collections.OrderedDict()
+        self._lock  = threading.Lock()
+    def get(self, key):
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._plans.move_to_end(key)
+            return plan
+    def put(self, key, plan):
+        with self._lock:
+            self._plans[key] = plan
+            while len(self._plans)>self.capacity:  self._plans.popitem(last=False)
+    def resize(self, capacity):
+        """ a capacity of 0 turns off the caching of plans """
+        with self._lock:
+            self.capacity = capacity
+            while len(self._plans)>self.capacity:  self._plans.popitem(last=False)
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+            self.hits, self.misses = 0, 0
+    def stats(self):
+        return {"hits":self.hits, "misses":self.misses, "size":len(self._plans), "capacity":self.capacity}
+
+plan_cache = _plan_cache(256)
+
 
 
 # Barebones theory (written much later after a forensic debug battle).  A tensor_network object contains
@@ -87,6 +183,9 @@ class tensor_network(summable_tensor):
         # Also, the individual primitives have all been forced to have unit scalar by adjusting the overall scalar.
         by_id, contractions, free_indices = self._hashable
         #
+        if not _backend_contract_path and _path_method!="heuristic":
+            timings_record("tensor_network._evaluate")
+            return self._replay(self._plan())
         if _backend_contract_path:    # All the tensors in one big group
             do_scalar_mult = False if self._scalar==1 else True
             do_reduction   = True
@@ -199,6 +298,78 @@ class tensor_network(summable_tensor):
                 return Z
             else:    # there is nothing left but the scalar
                 return primitive_tensor(self._backend.scalar_tensor(self._scalar), self._backend, self._contract)
+    def _structure(self):
+        """\
+        The ids of the primitive tensors in order of first appearance in the free indices and then the contractions (which depends only
+        on how the network was built, not on the ids), and the structure of the network (see _contraction_sequence) in that order.
+        """
+        by_id, contractions, free_indices = self._hashable
+        tensor_order, labels = [], {}
+        for label,prim_list in enumerate(free_indices + contractions):    # free index i is labeled i, so the output is (0,1,...)
+            for tens,pos in prim_list:
+                if tens not in labels:
+                    tensor_order += [tens]
+                    labels[tens] = [None]*len(by_id[tens].shape)
+                labels[tens][pos] = label
+        return tensor_order, tuple((tuple(by_id[tens].shape), tuple(labels[tens])) for tens in tensor_order)
+    def _identity(self):
+        """ if equal for two networks, they are certainly the same apart from their scalars (the converse need not hold) """
+        by_id = self._hashable[0]
+        tensor_order, structure = self._structure()
+        return ("network", tuple((id(by_id[tens]._raw_tensor), labels) for tens,(_,labels) in zip(tensor_order,structure)), len(self.shape))
+    def _plan(self):
+        """ the ids of the primitive tensors and the sequence of backend.contract calls that evaluate the network, from plan_cache if possible (None if not evaluated this way) """
+        if _backend_contract_path or _path_method=="heuristic":  return None
+        timings_start()
+        tensor_order, structure = self._structure()
+        key = (self._backend.ID(), _path_method, _max_intermediate_size, len(self.shape), structure)
+        sequence = plan_cache.get(key)
+        timings_record("tensor_network._evaluate")
+        if sequence is None:
+            timings_start()
+            sequence = _contraction_sequence(structure, len(self.shape))
+            plan_cache.put(key, sequence)
+            timings_record("path_planner")
+        return tensor_order, sequence
+    def _step_keys(self, plan):
+        """\
+        For all but the last of the calls in plan, keys that are equal only if the results are (as for _identity), since they are built
+        from the raw tensors and index arguments that go into them.  These are used to find intermediates shared among the terms of a
+        tensor_sum, which is why _replay applies the scalar only in the last call when these are in use.
+        """
+        by_id = self._hashable[0]
+        tensor_order, sequence = plan
+        keys, step_keys = [id(by_id[tens]._raw_tensor) for tens in tensor_order], []
+        for positions,index_lists,_ in sequence[:-1]:
+            key = tuple((keys[p], indices) for p,indices in zip(positions,index_lists))
+            for p in sorted(positions, reverse=True):  del keys[p]
+            keys += [key]
+            step_keys += [key]
+        return step_keys
+    def _replay(self, plan, shared=None):
+        """ evaluates the network according to plan (see _plan), reusing or keeping intermediates in shared (see tensors._intermediates) """
+        by_id = self._hashable[0]
+        tensor_order, sequence = plan
+        if not sequence:    # there is nothing but the scalar
+            return primitive_tensor(self._backend.scalar_tensor(self._scalar), self._backend, self._contract)
+        step_keys = self._step_keys(plan) if shared is not None else []
+        timings_start()
+        raw_tensors = [by_id[tens]._raw_tensor for tens in tensor_order]
+        for step,(positions,index_lists,with_scalar) in enumerate(sequence):
+            key = step_keys[step] if step<len(step_keys) else None
+            value = shared.fetch(key) if key is not None else None
+            if value is None:
+                if shared is not None:  with_scalar = (step==len(sequence)-1)
+                args = [(raw_tensors[p], *indices) for p,indices in zip(positions,index_lists)]
+                if with_scalar and self._scalar!=1:  args += [self._scalar]
+                value = self._backend.contract(*args)
+                if key is not None:  shared.store(key, value)
+            for p in sorted(positions, reverse=True):  del raw_tensors[p]
+            raw_tensors += [value]
+        result = raw_tensors[0]
+        if len(self.shape)==0:  result = self._backend.scalar_tensor(self._backend.scalar_value(result))    # as a backend tensor, which can be incremented
+        timings_record("backend.contract")
+        return primitive_tensor(result, self._backend, self._contract)
     def __getitem__(self, indices):
         indices = resolve_ellipsis(indices, self.shape)
         full = slice(None)    # the slice produced by [:] with no limits
@@ -58,13 +58,15 @@ class tensor_sum(summable_tensor):
         result += raw(self)
         return
     def _evaluate(self):
+        terms = _merged_terms(self._tensor_terms)    # those that are the same apart from their scalars are evaluated once
+        shared = _intermediates(terms)               # as are intermediates shared by the contractions of different terms
         result = None
-        for term in self._tensor_terms:
+        for term in terms:
             if term._scalar!=0:
-                if result is None:  result = raw(term)
-                else:               increment(result, term)    # move actual math out of here and let child classes decided how to add
+                if result is None:  result = shared.raw(term)
+                else:               shared.increment(result, term)    # move actual math out of here and let child classes decided how to add
         if result is None:
-            result = raw(self._tensor_terms[0])                # will produce zero tensor of correct dimensions
+            result = raw(terms[0])                             # will produce zero tensor of correct dimensions
         return primitive_tensor(result, self._backend, self._contract)
     def __copy__(self):
         return tensor_sum(self._tensor_terms)    # makes a copy of list with copies of terms (bc both modified by += and *=)
@@ -111,6 +113,48 @@ class tensor_sum(summable_tensor):
 
 
 
+def _merged_terms(terms):
+    """ copies of terms, where those with the same _identity() are merged into one by adding their scalars """
+    merged = {}
+    for term in terms:
+        key = term._identity()
+        if key in merged:  merged[key]._scalar += term._scalar
+        else:              merged[key] = copy(term)
+    return list(merged.values())
+
+class _intermediates(object):
+    """\
+    Intermediate results in the evaluation of the tensor_network terms of a sum that occur in more than one place (as identified by
+    tensor_network._step_keys).  Each is computed once and kept only until its last use.  Other terms are evaluated as usual.
+    """
+    def __init__(self, terms):
+        self._plans, self._uses, self._values = {}, {}, {}
+        for term in terms:
+            try:
+                plan = term._plan()
+            except AttributeError:
+                plan = None    # a primitive_tensor
+            if plan is not None and term._scalar!=0:
+                self._plans[id(term)] = plan
+                for key in term._step_keys(plan):  self._uses[key] = self._uses.get(key, 0) + 1
+    def fetch(self, key):
+        value = self._values.get(key)
+        if value is not None:
+            self._uses[key] -= 1
+            if self._uses[key]==0:  del self._values[key]    # last use
+        return value
+    def store(self, key, value):
+        self._uses[key] -= 1
+        if self._uses[key]>0:  self._values[key] = value
+    def raw(self, term):
+        if id(term) in self._plans:  return term._replay(self._plans[id(term)], self)._raw_tensor
+        else:                        return raw(term)
+    def increment(self, result, term):
+        if id(term) in self._plans:  result += self.raw(term)
+        else:                        increment(result, term)
+
+
+
 # The tensornet type for the primitive tensors that the user sees and uses and builds networks from.
 # The tensor importantly knows its backend, via a provided module (implemented by the user if not
 # already provided for that backend type).
@@ -146,6 +190,8 @@ class primitive_tensor(summable_tensor):
     def __imul__(self, x):    # enables __mul__, __rmul__, __neg__, and therefore also __sub__
         self._scalar *= x
         return self
+    def _identity(self):
+        return ("primitive", id(self._raw_tensor))
     # extra functionality just for primitive_tensor
     def __str__(self):
         return "tensornet.primitive_tensor(\n{}\n)".format(indent(str(self._raw_tensor), "    "))
@@ -16,6 +16,8 @@
 #    along with Qode.  If not, see <http://www.gnu.org/licenses/>.
 #
 from collections.abc import MutableSequence
+import tempfile
+import weakref
 import numpy
 from . import field_traits
 from .space import abs, conjugate, is_int_zero
@@ -140,3 +142,321 @@ class vector_set(MutableSequence):
         # Right now, this does not work for linearly dependent set, but the outcome is well-defined . . . fix that?
         # There is some danger here in that this makes an operator whose provenance might be forgotten.  Then if you modify this set, that operator is implicitly changed.
         return self.deproject(self.project(1))
+    def deproject_block(self,projections):
+        # For a list of coefficient lists, the list of respective deprojections.
+        return [ self.deproject(projection) for projection in projections ]
+    def project_out(self,vec):
+        # Assuming this set is orthonormal, removes from vec (in place) its projection onto the space spanned by this set.
+        for v in self:
+            if not is_int_zero(v):  vec -= v * (v|vec)
+        return vec
+
+
+
+def _detach(refs):
+    """ gives members no longer held by an array_vector_set (weakly referenced by refs) their own copies of their data, if still in use elsewhere """
+    for ref in refs:
+        member = ref()
+        if member is not None:  member.v = member.v.copy()
+
+def _assign_slice(vecs, index, values):
+    """ list-like assignment of values to vecs[index], element by element (changing the length only for simple slices) """
+    indices = range(len(vecs))[index]
+    values = [ value if is_int_zero(value) else vecs.space.traits.copy(value) for value in values ]    # values may be views of the rows being overwritten
+    if len(values)!=len(indices):
+        if index.step not in (None,1):  raise ValueError("attempt to assign sequence of size {} to extended slice of size {}".format(len(values),len(indices)))
+        del vecs[index]
+        for k,value in enumerate(values):  vecs.insert(indices.start+k, value)
+    else:
+        for i,value in zip(indices,values):  vecs[i] = value
+    return values
+
+class array_vector_set(vector_set):
+    """\
+    A vector_set for spaces whose raw vectors are 1-D numpy arrays (of common length and type), which stores them as the rows of a single
+    contiguous 2-D array, so that overlaps, projections, deprojections and orthonormalization are single (BLAS-2/3) numpy calls.  Vectors
+    placed in the set are copied into the storage, and the members of the set are (zero-copy) row views.  The set takes care of those
+    views when rows are moved or the storage grows; members that are deleted or replaced are given a copy of their data if still in use.
+    As for vector_set, the integer 0 may be stored as a null vector (a row of zeros).
+    """
+    def __init__(self,space,vector_list=None,orthonormal=False,capacity=0):
+        self.space        = space
+        self.field        = self.space.field
+        self.orthonormal  = orthonormal
+        self._S_cache     = (None, None)
+        self._vector_list = []       # members (row views) or integer zeros
+        self._rows        = None     # storage, allocated upon the first non-zero vector (until then, leading zeros are only counted)
+        self._start       = 0        # the rows in use are _rows[_start:_start+len(self)], so that deleting the first vector moves nothing
+        self._capacity    = capacity
+        for vector in (vector_list or []):  self.append(vector)
+    def _block(self):
+        """ the (n_vectors x dim) array view of the rows in use """
+        return self._rows[self._start:self._start+len(self)]
+    def _rebind(self,begin=0):
+        for i in range(begin,len(self)):
+            if not is_int_zero(self._vector_list[i]):  self._vector_list[i].v = self._rows[self._start+i]
+    def _new_rows(self,n_rows,dim,dtype):
+        """ zeroed storage for n_rows vectors (overridden for storage on disk) """
+        return numpy.zeros((n_rows,dim), dtype=dtype)
+    def _grown(self,n_rows):
+        """ storage for n_rows vectors, containing the rows currently in use (which start at 0) """
+        rows = self._new_rows(n_rows, self._rows.shape[1], self._rows.dtype)
+        rows[:len(self)] = self._rows[:len(self)]
+        return rows
+    def _allocate(self,data):
+        self._rows  = self._new_rows(max(self._capacity, 2*len(self)+1, 8), data.shape[0], data.dtype)
+        self._start = 0
+    def _make_room(self):
+        # ensures a free row after the rows in use, by moving the rows to the beginning or else by growing the storage
+        n = len(self)
+        if self._start+n < self._rows.shape[0]:  return
+        if self._start>0:
+            for i in range(n):  self._rows[i] = self._rows[self._start+i]
+            self._start = 0
+        else:
+            self._rows = self._grown(2*self._rows.shape[0])
+        self._rebind()
+    def _pop_front(self):
+        # removes and returns the first vector, without giving it a copy of its data (which remains valid until the next change to the set)
+        self._S_cache = (None, None)
+        member = self._vector_list.pop(0)
+        if self._rows is not None:  self._start += 1
+        return member
+    def _adopt(self,member):
+        # appends member itself (not a new member), copying its data into the storage and rebinding it to its row
+        if is_int_zero(member):  return self.append(0)
+        if self._rows is None:  self._allocate(member.v)
+        self._make_room()
+        self._S_cache = (None, None)
+        row = self._start + len(self)
+        self._rows[row] = member.v
+        member.v = self._rows[row]
+        self._vector_list.append(member)
+    def _store(self,row,value):
+        # copies value into the given absolute row and returns the member that refers to it
+        if is_int_zero(value):
+            self._rows[row] = 0
+            return 0
+        if value.space is not self.space:  raise Exception('Vectors in a set are expected to be from the same space.')
+        self._rows[row] = value.v
+        return _member(self._rows[row], self.space)
+    # These are the functions needed to emulate a list
+    def __setitem__(self,index,value):
+        if isinstance(index,slice):  return _assign_slice(self, index, value)
+        if index<0:  index += len(self)
+        self._S_cache = (None, None)
+        if self._rows is None:
+            if is_int_zero(value):
+                self._vector_list[index] = 0
+                return value
+            self._allocate(value.v)
+        refs = [ weakref.ref(old) for old in self._vector_list[index:index+1] if not is_int_zero(old) ]
+        self._vector_list[index] = None
+        _detach(refs)    # before the row is overwritten
+        self._vector_list[index] = self._store(self._start+index, value)
+        return value
+    def __delitem__(self,index):
+        deleted = range(len(self))[index]
+        deleted = {deleted} if isinstance(deleted,int) else set(deleted)
+        kept    = [ i for i in range(len(self)) if i not in deleted ]
+        refs    = [ weakref.ref(self._vector_list[i]) for i in deleted if not is_int_zero(self._vector_list[i]) ]
+        self._S_cache = (None, None)
+        self._vector_list = [ self._vector_list[i] for i in kept ]
+        _detach(refs)    # before any rows are overwritten
+        if self._rows is not None:
+            if kept==list(range(len(deleted),len(deleted)+len(kept))):    # only leading vectors deleted:  just move the start
+                self._start += len(deleted)
+            else:
+                for new,old in enumerate(kept):
+                    if new!=old:  self._rows[self._start+new] = self._rows[self._start+old]
+                self._rebind()
+    def insert(self,index,value):
+        n = len(self)
+        if index<0:  index = max(0, index+n)
+        index = min(index, n)
+        self._S_cache = (None, None)
+        if self._rows is None:
+            if is_int_zero(value):
+                self._vector_list.insert(index, 0)
+                return
+            self._allocate(value.v)
+        self._make_room()
+        for i in reversed(range(index,n)):  self._rows[self._start+i+1] = self._rows[self._start+i]
+        self._vector_list.insert(index, None)
+        self._rebind(index+1)
+        self._vector_list[index] = self._store(self._start+index, value)
+    # These are the "extra" functions, done on the whole block
+    def overlaps(self):
+        if self.orthonormal:  raise ValueError("Set was explicitly asserted to be orthonormal.")
+        S, Sinv = self._S_cache
+        if S is None:
+            if self._rows is None:  S = numpy.zeros((len(self),len(self)))
+            else:
+                M = self._block()
+                S = M.conj() @ M.T
+            for i in range(len(self)):  S[i,i] = field_traits.metric[self.field](S[i,i])
+            self._S_cache = (S, None)
+        return S
+    def projections(self,obj):
+        if isinstance(obj,_member) and self._rows is not None:  return (self._block().conj() @ obj.v).tolist()
+        else:                                                  return vector_set.projections(self,obj)
+    def deproject(self,projection):
+        if len(projection)!=len(self):  raise ValueError("projection must have same length as vector set for deprojection")
+        if self._rows is None or any(isinstance(p,(_member,_operator_base)) for p in projection):  return vector_set.deproject(self,projection)
+        return _member(numpy.asarray(projection) @ self._block(), self.space)
+    def deproject_block(self,projections):
+        if self._rows is None:  return vector_set.deproject_block(self,projections)
+        return [ _member(row, self.space) for row in numpy.asarray(projections) @ self._block() ]
+    def project_out(self,vec):
+        if self._rows is None:  return vec
+        M = self._block()
+        self.space.traits.release(vec)
+        vec.v -= (M.conj() @ vec.v) @ M
+        return vec
+    def gram_schmidt(self,n_times=2):
+        # Orthonormalizes the vectors in place by Cholesky QR (repeated, for stability); rows that are null are left alone.
+        if self._rows is None:  return
+        rows = [ i for i,v in enumerate(self._vector_list) if not is_int_zero(v) ]
+        self._S_cache = (None, None)
+        for i in rows:  self.space.traits.release(self._vector_list[i])
+        M = self._block()
+        for _ in range(n_times):
+            L = numpy.linalg.cholesky(M[rows] @ M[rows].conj().T)    # complex conjugate of the overlap matrix, as L L^H
+            M[rows] = numpy.linalg.solve(L, M[rows])
+
+class _memmap_vector_set(array_vector_set):
+    """ an array_vector_set whose storage is a memory map of an (unnamed) file in the directory scratch """
+    def __init__(self,space,scratch=None):
+        self._file = tempfile.TemporaryFile(dir=scratch)    # removed from the file system when closed (when this set and its members are gone)
+        array_vector_set.__init__(self,space)
+    def _new_rows(self,n_rows,dim,dtype):
+        self._file.truncate(n_rows * dim * numpy.dtype(dtype).itemsize)    # extends with zeros, keeping what is there
+        return numpy.memmap(self._file, dtype=dtype, mode="r+", shape=(n_rows,dim))
+    def _grown(self,n_rows):
+        return self._new_rows(n_rows, self._rows.shape[1], self._rows.dtype)    # rows in use are already in the file
+
+class spilling_vector_set(vector_set):
+    """\
+    A vector_set for the same spaces as array_vector_set, which keeps at most about max_bytes of vector data in memory.  The newest vectors
+    are resident (in an array_vector_set of at most max_bytes/2), and, when more are added, the oldest are moved to a memory-mapped
+    file in the directory scratch (defaulting to that of the tempfile module), to which members of the set then refer.  Overlaps,
+    projections and deprojections stream through the vectors on disk in contiguous chunks of at most max_bytes/2, so that a pass over the
+    set reads each vector once.  Pages of the memory map are backed by the file, so the operating system can always drop them rather
+    than swapping.  Vectors can be inserted or deleted anywhere, though only appending and deleting from the front are cheap on disk.
+    """
+    def __init__(self,space,vector_list=None,orthonormal=False,max_bytes=2**30,scratch=None):
+        self.space       = space
+        self.field       = self.space.field
+        self.orthonormal = orthonormal
+        self.max_bytes   = max_bytes
+        self._S_cache    = (None, None)
+        self._disk       = _memmap_vector_set(space, scratch)    # oldest vectors
+        self._resident   = array_vector_set(space)               # newest vectors
+        for vector in (vector_list or []):  self.append(vector)
+    def _row_bytes(self):
+        rows = self._resident._rows if self._resident._rows is not None else self._disk._rows
+        return 0 if rows is None else rows.shape[1] * rows.dtype.itemsize
+    def _spill(self):
+        row_bytes = self._row_bytes()
+        while len(self._resident)>1 and len(self._resident)*row_bytes>self.max_bytes//2:  self._disk._adopt(self._resident._pop_front())
+    def _chunks(self):
+        """ yields (begin, end, block) for contiguous blocks of rows covering the set (any of which may be None if no rows are allocated) """
+        row_bytes = self._row_bytes()
+        n_disk = len(self._disk)
+        step = max(1, (self.max_bytes//2) // max(1,row_bytes))
+        for begin in range(0, n_disk, step):
+            end = min(begin+step, n_disk)
+            yield begin, end, (None if self._disk._rows is None else self._disk._block()[begin:end])
+        if len(self._resident)>0:  yield n_disk, len(self), (None if self._resident._rows is None else self._resident._block())
+    def _tier(self,index):
+        n_disk = len(self._disk)
+        return (self._disk, index) if index<n_disk else (self._resident, index-n_disk)
+    # These are the functions needed to emulate a list
+    def __getitem__(self,index):
+        if isinstance(index,slice):  return vector_set(self.space, [ self[i] for i in range(len(self))[index] ])
+        if index<0:  index += len(self)
+        tier, i = self._tier(index)
+        return tier[i]
+    def __setitem__(self,index,value):
+        if isinstance(index,slice):  return _assign_slice(self, index, value)
+        if index<0:  index += len(self)
+        self._S_cache = (None, None)
+        tier, i = self._tier(index)
+        tier[i] = value
+        return value
+    def __delitem__(self,index):
+        deleted = range(len(self))[index]
+        deleted = [deleted] if isinstance(deleted,int) else sorted(deleted)
+        n_disk = len(self._disk)
+        self._S_cache = (None, None)
+        resident = [ i-n_disk for i in deleted if i>=n_disk ]
+        disk     = [ i        for i in deleted if i< n_disk ]
+        for i in reversed(resident):  del self._resident[i]
+        if disk==list(range(len(disk))):  del self._disk[:len(disk)]
+        else:
+            for i in reversed(disk):  del self._disk[i]
+    def __len__(self):
+        return len(self._disk) + len(self._resident)
+    def insert(self,index,value):
+        n = len(self)
+        if index<0:  index = max(0, index+n)
+        index = min(index, n)
+        self._S_cache = (None, None)
+        if index<len(self._disk):  self._disk.insert(index, value)
+        else:                      self._resident.insert(index-len(self._disk), value)
+        self._spill()
+    # These are the "extra" functions, done chunk by chunk
+    def overlaps(self):
+        if self.orthonormal:  raise ValueError("Set was explicitly asserted to be orthonormal.")
+        S, Sinv = self._S_cache
+        if S is None:
+            S = numpy.zeros((len(self),len(self)), dtype=numpy.result_type(self.field,numpy.float64))
+            for i0,i1,Mi in self._chunks():
+                for j0,j1,Mj in self._chunks():
+                    if j0>=i0 and Mi is not None and Mj is not None:
+                        S[i0:i1,j0:j1] = Mi.conj() @ Mj.T
+                        S[j0:j1,i0:i1] = S[i0:i1,j0:j1].conj().T
+            for i in range(len(self)):  S[i,i] = field_traits.metric[self.field](S[i,i])
+            self._S_cache = (S, None)
+        return S
+    def projections(self,obj):
+        if not isinstance(obj,_member):  return vector_set.projections(self,obj)
+        projections = numpy.zeros(len(self), dtype=numpy.result_type(self.field,obj.v.dtype))
+        for begin,end,M in self._chunks():
+            if M is not None:  projections[begin:end] = M.conj() @ obj.v
+        return projections.tolist()
+    def deproject_block(self,projections):
+        projections = numpy.asarray(projections)
+        if len(projections)==0:  return []
+        if projections.shape[1]!=len(self):  raise ValueError("projection must have same length as vector set for deprojection")
+        result = None
+        for begin,end,M in self._chunks():
+            if M is not None:
+                contribution = projections[:,begin:end] @ M
+                if result is None:  result  = contribution
+                else:               result += contribution
+        if result is None:  return vector_set.deproject_block(self,projections.tolist())
+        return [ _member(row, self.space) for row in result ]
+    def deproject(self,projection):
+        if len(projection)!=len(self):  raise ValueError("projection must have same length as vector set for deprojection")
+        if any(isinstance(p,(_member,_operator_base)) for p in projection):  return vector_set.deproject(self,projection)
+        return self.deproject_block([projection])[0]
+    def project_out(self,vec):
+        self.space.traits.release(vec)
+        coeffs = numpy.array(self.projections(vec))
+        for begin,end,M in self._chunks():
+            if M is not None:  vec.v -= coeffs[begin:end] @ M
+        return vec
+
+def vector_set_for(space,vector_list=None,orthonormal=False,max_bytes=None,scratch=None):
+    """\
+    an array_vector_set if the raw vectors given are all 1-D numpy arrays of the same shape (ignoring integer zeros), or, if max_bytes is
+    given, a spilling_vector_set that keeps about that much vector data in memory (spilling the rest to files in scratch), otherwise a vector_set
+    """
+    vector_list = list(vector_list or [])
+    data = [ v.v for v in vector_list if not is_int_zero(v) ]
+    if data and all(isinstance(d,numpy.ndarray) and d.ndim==1 and d.shape==data[0].shape and d.dtype==data[0].dtype for d in data):
+        if max_bytes is None:  return array_vector_set(space,vector_list,orthonormal)
+        else:                  return spilling_vector_set(space,vector_list,orthonormal,max_bytes,scratch)
+    else:
+        return vector_set(space,vector_list,orthonormal)
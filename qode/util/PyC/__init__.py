@@ -18,7 +18,7 @@
 import os
 
 from .PyC_types import Int, BigInt, Double
-from .loader    import load_C, QodeHome
+from .loader    import load_C, build_all, QodeHome
 from .args      import C_arg, C_args, pythonize
 
 from .importer import import_C
@@ -18,23 +18,25 @@
 
 import numpy
 import ctypes
-from .PyC_types import PyCtypes, py_types
+import threading
+from .PyC_types import PyC_type, PyCtypes, py_types
 
 
 
+_PyCtype_of_dtype = { numpy.dtype(PyCtype.numpy):PyCtype for PyCtype in PyCtypes }
+
 def native2PyCtype(obj):
     """ Associates native python types with PyCtypes, according to PyC_types.py_types """
-    for pytype,PyCtype in py_types.items():
+    PyCtype = py_types.get(obj if isinstance(obj,type) else type(obj))    # exact types first, by lookup ...
+    if PyCtype is not None:  return PyCtype
+    for pytype,PyCtype in py_types.items():                                # ... then subclasses
         if obj is pytype or isinstance(obj,pytype):  return PyCtype
     return None    # returned if obj is not (and not instance of) one of the supported native types
 
 def dtype2PyCtype(array):
     """ Associates numpy data types with PyCtypes, according to PyC_types.PyCtypes """
-    PyCtype = None
-    for test in PyCtypes:
-        if array.dtype==test.numpy:  PyCtype = test
-    if PyCtype is None:  raise AssertionError
-    return PyCtype
+    try:              return _PyCtype_of_dtype[array.dtype]
+    except KeyError:  raise AssertionError
 
 def numpy_Cptr(array, PyCtype):
     """ Returns a ctypes pointer of the specified type for the data in the given numpy array """
@@ -83,11 +85,67 @@ def C_args(*py_args):
 
 
 
-def pythonize(C_function, return_pytype=None):
+# The arguments of a function can optionally be declared (see importer.py), so that the conversion of each is decided once, rather
+# than upon every call.  The declarations follow the same rules as C_arg above.  Each is one of
+#     int or float        :  a native python number (passed as BigInt or Double)
+#     Int, BigInt, Double :  a numpy array of that type (passed as a pointer to its data)
+#     [int] or [float]    :  a list of native numbers (passed as a pointer to an array of them)
+#     [Int], ... [Double] :  a list of numpy arrays of that type (passed as a pointer to an array of pointers)
+# For the last, the array of pointers is remembered (for a few different lists), and reused as long as the same buffers are passed.
+
+class _pointer_arrays(object):
+    """ converts lists of numpy arrays to ctypes arrays of pointers to their data, reusing these for buffers seen recently """
+    def __init__(self, PyCtype, size=8):
+        self.PyCtype = PyCtype
+        self.size    = size
+        self.cache   = {}    # tuple of data addresses -> ctypes array
+        self.lock    = threading.Lock()    # functions may be called concurrently from the threads of a parallel.thread_pool
+    def __call__(self, arrays):
+        addresses = tuple(array.ctypes.data for array in arrays)
+        with self.lock:
+            pointers = self.cache.get(addresses)
+        if pointers is None:
+            for array in arrays:
+                if not isinstance(array, numpy.ndarray) or array.dtype!=self.PyCtype.numpy:  raise AssertionError
+            pointers = (ctypes.c_void_p * len(addresses))(*addresses)
+            with self.lock:
+                if addresses not in self.cache:
+                    if len(self.cache)>=self.size:  del self.cache[next(iter(self.cache))]    # forget the oldest
+                    self.cache[addresses] = pointers
+        return pointers
+
+def _declared_arg(declared):
+    """ the ctypes argtype for a declared argument and a function converting a python argument to it (None if ctypes can do that itself) """
+    if not isinstance(declared, (list,tuple)):
+        if declared in py_types:  return py_types[declared].ctypes, None
+        if isinstance(declared, PyC_type):
+            def convert(array):
+                if array.dtype!=declared.numpy:  raise AssertionError
+                return array.ctypes.data
+            return ctypes.c_void_p, convert
+    elif len(declared)==1:
+        element, = declared
+        if element in py_types:
+            element_ctype = py_types[element].ctypes
+            return ctypes.c_void_p, lambda values: (element_ctype * len(values))(*values)
+        if isinstance(element, PyC_type):  return ctypes.c_void_p, _pointer_arrays(element)
+    raise ValueError("unsupported declaration of argument type: {}".format(declared))
+
+def pythonize(C_function, return_pytype=None, arg_types=None):
     """ Given a function in a library loaded with ctypes.cdll.LoadLibrary, wrap and hide the python/numpy<->ctypes conversions of arguments and the return value """
     # The signature of the C function must use the types conversion specified PyC_types.py/.h and in the py_types dictionary above
     PyCtype = native2PyCtype(return_pytype)
     if PyCtype:  C_function.restype = PyCtype.ctypes
-    def py_function(*py_args):
-        return C_function(*C_args(*py_args))
+    if arg_types is None:
+        def py_function(*py_args):
+            return C_function(*C_args(*py_args))
+    else:
+        argtypes, converters = zip(*[_declared_arg(declared) for declared in arg_types]) if arg_types else ((),())
+        C_function.argtypes = list(argtypes)
+        converted = [ i for i,convert in enumerate(converters) if convert is not None ]
+        def py_function(*py_args):
+            if len(py_args)!=len(converters):  raise TypeError("C function expects {} arguments ({} given)".format(len(converters), len(py_args)))
+            C_args = list(py_args)
+            for i in converted:  C_args[i] = converters[i](C_args[i])
+            return C_function(*C_args)
     return py_function
@@ -38,6 +38,9 @@ from   .args   import pythonize
 # fast = fast_module.func.return_type(int)
 # result1 = fast( ... arguments1 ...)
 # result2 = fast( ... arguments2 ...)
+#
+# # The argument types may also be declared (see args.py), so that their conversions are worked out once, for example
+# fast_module.func.arg_types(int, Double, [Double])
 
 # The biggest weakness here is that this does not handle connections between multiple C-source files ...
 # ... until I think out the best way to do that, we will just #include and recompile code we want to reuse.
@@ -46,8 +49,8 @@ from   .args   import pythonize
 # into real tools for this job.  For a good discussion of Cython, SWIG, etc, see:
 # https://docs.scipy.org/doc/numpy/user/c-info.python-as-glue.html 
 
-# Also, as of now there is no recompile if the arguments to the import (such as compilation) change.
-# This can be fixed by hashing the arguments to a string that gets stored in a file and checked.
+# Compiled code is cached under a hash of the source, headers, commands, flags and compiler version (see loader.py), so changing
+# any of the arguments to the import does trigger a recompile.
 
 
 
@@ -56,9 +59,18 @@ class _function_wrapper(object):
         self.C_function    = C_function
         self.function      = None
         self.return_pytype = None
+        self.arg_pytypes   = None
     def __call__(self, *args):
-        if self.function is None:  self.function = pythonize(self.C_function, self.return_pytype)
+        if self.function is None:  self.function = pythonize(self.C_function, self.return_pytype, self.arg_pytypes)
         return self.function(*args)
+    def arg_types(self, *pytypes):
+        if self.function is None:		# as for return_type, can be declared up until the first call (see args.py for what the declarations mean)
+            self.arg_pytypes = pytypes
+            return self
+        elif pytypes==self.arg_pytypes:
+            return self
+        else:
+            raise RuntimeError("Cannot change argument types of C function after function has been called")
     def return_type(self, pytype):
         if self.function is None:		# Can "change our mind" up until the time it is first called ... after that, it *really* makes no sense
             self.return_pytype = pytype
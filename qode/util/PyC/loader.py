@@ -18,8 +18,11 @@
 
 import os
 import ctypes
+import hashlib
 import tempfile
 import inspect
+import importlib
+import subprocess
 
 _local_path = os.path.dirname(__file__)
 
@@ -32,10 +35,53 @@ for _ in ("..", "..", ".."):  QodeHome = os.path.dirname(QodeHome)
 
 
 
-class _empty(object): pass
+# Compiled libraries are cached under a name that is a hash of everything that goes into them:  the source, the headers it depends on,
+# the compile and link commands (including flags) and the version of the compiler.  So a change to any of these gives a new build, and
+# an existing build is never stale.  The cache lives in a __Ccache__ directory next to the source, unless the environment variable
+# QODE_CCACHE names a directory to use instead (for example, user or node-local scratch, when the package is on read-only storage).
+# If the default location is not writable, a qode/Ccache directory in the user's cache (~/.cache) is used.  Builds go to temporary
+# files first and are atomically renamed into place, so concurrent jobs can only ever load complete libraries (at worst, a few
+# compile the same thing at once).  A failed compilation raises a RuntimeError that includes the compiler output.
+
+_compiler_versions = {}
+_loaded = {}    # (directory, C_filestem) -> path of library, for everything loaded in this process
+
+def _compiler_version(command):
+    """ the first line of the --version output of the executable in the given command template """
+    compiler = command.split()[0]
+    if compiler not in _compiler_versions:
+        try:     version = subprocess.run([compiler, "--version"], capture_output=True, text=True).stdout.split("\n")[0]
+        except:  version = "unknown"    # missing compiler will be reported when compiling
+        _compiler_versions[compiler] = version
+    return _compiler_versions[compiler]
+
+def _build_key(sources, cc, ld, flags):
+    """ hex digest of the contents of the source files, the commands, the flags and the compiler versions """
+    key = hashlib.sha256()
+    for source in sources:
+        with open(source, "rb") as f:  key.update(f.read())
+        key.update(b"\0")
+    for item in (cc, ld, flags, _compiler_version(cc), _compiler_version(ld)):  key.update(item.encode() + b"\0")
+    return key.hexdigest()[:32]
+
+def _cache_dir(directory, C_filestem):
+    if "QODE_CCACHE" in os.environ:  candidates = [os.environ["QODE_CCACHE"]]
+    else:                            candidates = [directory+"/__Ccache__", os.path.join(os.path.expanduser("~"), ".cache", "qode", "Ccache")]
+    for root in candidates:
+        cache = os.path.join(root, C_filestem)
+        try:
+            os.makedirs(cache, exist_ok=True)
+            if os.access(cache, os.W_OK):  return cache
+        except OSError:
+            pass
+    raise RuntimeError("no writable cache directory for compiled C code among {} (set QODE_CCACHE)".format(candidates))
+
+def _run(command):
+    result = subprocess.run(command, shell=True, capture_output=True, text=True)
+    if result.returncode!=0:  raise RuntimeError("C compilation failed:\n{}\n{}{}".format(command, result.stdout, result.stderr))
 
 def load_C(C_filestem, flags="", include=None, directory=None, cc=None, ld=None):
-    """ Loads C code found C_filestem.c, compiling if necessary into a local __Ccache__ directory """
+    """ Loads C code found C_filestem.c, compiling if necessary into the cache (see above) """
     if directory is None:  directory = os.path.dirname(os.path.abspath(inspect.stack()[1][1]))   # assume .c code is in the same directory as the calling .py module.  See:  https://stackoverflow.com/questions/13699283/how-to-get-the-callers-filename-method-name-in-python
     if cc        is None:  cc = "gcc -std=c99 -c -fPIC {} {} -o {}"
     if ld        is None:  ld = "gcc -std=c99 -shared  {} {} -o {}"
@@ -49,39 +95,49 @@ def load_C(C_filestem, flags="", include=None, directory=None, cc=None, ld=None)
     include_dirs = {os.path.dirname(item):None for item in include}	# A cheap way to remove redundancy
     for item in include_dirs:  flags += " -I"+item
 
-    # Where to put byte code
-    cache = directory+"/__Ccache__/"+C_filestem
-    try:     os.makedirs(cache)
-    except:  pass     # A little dirty, but probably it just already exists
-
-    # A container for associated filenames
-    code = _empty()
-    code.c  = directory+"/"+C_filestem+".c"
-    code.h  = include	# They don't literally need to end with .h
-    code.so = None
-
-    # Look to see if there are any .so files compiled since the last source modification
-    last_mod = max([os.path.getmtime(file) for file in [code.c]+code.h])
-    version = 0
-    for file in os.listdir(cache):
-        if file.endswith("-finished.so"):
-            if os.path.getmtime(cache+"/"+file) > last_mod:
-                code.so = cache+"/"+file
-                break	# The first one we find is good enough
-            else:
-                version = max(1+int(file.split("-")[0]), version)	# incrementing this when source is changed is only to aid human beings who might be cleaning up old files using shell glob syntax while newer versions are loaded and running
-
-    # If there is no .so available, compile it, keeping in mind that other threads might be doing the same (worst case is a few extra copies)
-    if code.so is None:
-        version = str(version) + "-"
-        tmp = tempfile.NamedTemporaryFile(dir=cache, prefix=version, delete=False)    # A thread-safe way of getting a reserved filestem
-        code.o      = tmp.name+".o"
-        code.tmp_so = tmp.name+".so"
-        code.so     = tmp.name+"-finished.so"
-        tmp.close()    # do not delete or else filestem could theoretically be reused
-        os.system(cc.format(flags, code.c, code.o))
-        os.system(ld.format(flags, code.o, code.tmp_so))
-        os.rename(code.tmp_so, code.so)    # so that incomplete compilations from other threads will not be loaded above
+    # The library for this exact build, if it exists
+    source = directory+"/"+C_filestem+".c"
+    cache  = _cache_dir(directory, C_filestem)
+    so     = cache+"/"+_build_key([source]+include, cc, ld, flags)+".so"
+
+    # If it is not available, compile it, keeping in mind that other processes might be doing the same
+    if not os.path.exists(so):
+        fd, tmp = tempfile.mkstemp(dir=cache, prefix="tmp-")    # a reserved filestem
+        os.close(fd)
+        try:
+            _run(cc.format(flags, source, tmp+".o"))
+            _run(ld.format(flags, tmp+".o", tmp+".so"))
+            os.replace(tmp+".so", so)    # atomic, so that incomplete compilations are never loaded
+        finally:
+            for leftover in (tmp, tmp+".o", tmp+".so"):
+                if os.path.exists(leftover):  os.remove(leftover)
 
     # Finally, load and return the module
-    return ctypes.cdll.LoadLibrary(code.so)
+    _loaded[directory, C_filestem] = so
+    return ctypes.cdll.LoadLibrary(so)
+
+
+
+# The modules of Qode that compile C code when imported
+_C_modules = [
+    "qode.many_body.fermion_field.field_op",                                           # field_op, antisymm
+    "qode.many_body.hierarchical_fluctuations.excitonic.operator",                     # hamiltonian, preconditioner
+    "qode.many_body.hierarchical_fluctuations.excitonic.baker_campbell_hausdorff",     # bch
+    "qode.coupled_oscillators.c_mat_vec_prod_routine.mat_vec_prod_wrapper",            # mat_vec_prod_engine
+]
+
+def build_all(printout=None):
+    """\
+    Compiles (or finds in the cache) every C library used by Qode, by importing the modules that load them, so that this can be done
+    once as a separate step (for example, before launching many jobs).  If anything fails, a RuntimeError is raised after trying all
+    of them, listing the failures.  Otherwise, a dictionary is returned, mapping (directory, filestem) for each library to its path.
+    """
+    failures = []
+    for module in _C_modules:
+        try:
+            importlib.import_module(module)
+            if printout is not None:  printout("built C code for", module)
+        except Exception as error:
+            failures += ["{}: {}".format(module, error)]
+    if failures:  raise RuntimeError("failed to build C code for\n" + "\n".join(failures))
+    return dict(_loaded)
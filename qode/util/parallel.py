@@ -15,17 +15,235 @@
 #    You should have received a copy of the GNU General Public License
 #    along with Qode.  If not, see <http://www.gnu.org/licenses/>.
 #
-import queue
+import os
+import sys
+import atexit
+import pickle
+import threading
+import collections
 import multiprocessing
+import concurrent.futures
+from multiprocessing import shared_memory, resource_tracker
 
-# This source file is a "stub" which should eventually contain a host of methods for dynamic parallelization
+# Tools for dividing the cores and memory of a machine among (possibly nested) concurrent tasks, and for running those tasks.
 
 
 
 class resources(object):
-	""" just a hint of things to come.  this should be modified and passed down as resources are more restricted at lower layers """
-	def __init__(self,n_cores):
+	"""\
+	The computational resources given to a task:  n_cores cores (by default, the whole core budget below) and max_bytes of memory
+	(None for no particular limit).  A task uses all of its cores, as the threads of the OpenMP kernels it calls (which are told
+	n_threads at each call) or as worker processes.  A task that runs subtasks concurrently hands each one a share of its own
+	resources, obtained from split, so that nesting does not oversubscribe the machine.  For example, to run 4 workers on a
+	32-core node, each calling 8-thread kernels
+		shares = parallel.resources(32).split(4)
+		with parallel.process_pool(4) as pool:
+			results = pool.starmap(task, [(x,share) for x,share in zip(xs,shares)])
+	"""
+	def __init__(self, n_cores=None, max_bytes=None):
+		if n_cores is None:  n_cores = core_budget.n_cores
+		self.n_cores   = n_cores
+		self.max_bytes = max_bytes
+	@property
+	def n_threads(self):
+		return self.n_cores
+	def split(self, k):
+		""" a list of k resources that divide these as evenly as possible (each has at least one core) """
+		if k<1:  raise ValueError("resources must be split into at least one share")
+		max_bytes = None if self.max_bytes is None else self.max_bytes // k
+		return [resources(max(1, (self.n_cores*(i+1))//k - (self.n_cores*i)//k), max_bytes) for i in range(k)]
+	def thread_pool(self, n_workers):
+		""" a thread_pool (see below) of n_workers, each of whose tasks gets an equal share of these cores for its own threads """
+		return thread_pool(n_workers, threads_per_task=max(1, self.n_cores//n_workers))
+	def process_pool(self):
+		""" the persistent pool of worker processes (see process_pool below), with a worker for each core """
+		return process_pool(self.n_cores)
+	def __repr__(self):
+		return "resources(n_cores={}, max_bytes={})".format(self.n_cores, self.max_bytes)
+
+
+
+# Calls into C code through PyC (ctypes.cdll) release the GIL, so independent calls can run concurrently on threads, which share their
+# (read-only) inputs without any copying or pickling.  Since much of that C code is itself multithreaded with OpenMP, the threads of all
+# pools are drawn from one budget of cores for the whole process (by default, the cores this process may run on, or the environment
+# variable QODE_NUM_CORES), so that pools (nested or side by side) do not oversubscribe the machine.  A pool whose tasks each use
+# threads_per_task OpenMP threads reserves that many cores per worker; if the budget is exhausted, it runs its tasks serially.
+
+def _default_n_cores():
+	if "QODE_NUM_CORES" in os.environ:  return int(os.environ["QODE_NUM_CORES"])
+	try:                    return len(os.sched_getaffinity(0))
+	except AttributeError:  return multiprocessing.cpu_count()
+
+class _core_budget(object):
+	def __init__(self, n_cores):
 		self.n_cores = n_cores
+		self.in_use  = 0
+		self._lock   = threading.Lock()
+	def reserve(self, n_wanted):
+		""" reserves (and returns the number of) as many of n_wanted cores as are free """
+		with self._lock:
+			n = max(0, min(n_wanted, self.n_cores-self.in_use))
+			self.in_use += n
+			return n
+	def release(self, n):
+		with self._lock:  self.in_use -= n
+
+core_budget = _core_budget(_default_n_cores())
+
+def set_core_budget(n_cores):
+	core_budget.n_cores = n_cores
+
+class thread_pool(object):
+	"""\
+	A pool of n_workers threads (by default, as many as the core budget allows) for running independent calls concurrently, where
+	each call is expected to use threads_per_task threads of its own (pass this on to the C code).  The cores are reserved from
+	the budget (above) until the pool is closed, and n_workers is reduced to what is available.  Use it as a context manager:
+		with parallel.thread_pool(4, threads_per_task=2) as pool:
+			results = pool.map(func, [(x,y) for x in xs])	# like parallelize_task
+	"""
+	def __init__(self, n_workers=None, threads_per_task=1):
+		if n_workers is None:  n_workers = max(1, core_budget.n_cores // threads_per_task)
+		self.threads_per_task = threads_per_task
+		reserved = core_budget.reserve(n_workers * threads_per_task)
+		self.n_workers = reserved // threads_per_task
+		core_budget.release(reserved - self.n_workers*threads_per_task)
+		self._executor = concurrent.futures.ThreadPoolExecutor(self.n_workers) if self.n_workers>1 else None
+	def imap(self, function, inputs):
+		""" generates function(*i) for each tuple i in inputs, in order, keeping no more than n_workers calls in flight """
+		if self._executor is None:
+			for i in inputs:  yield function(*i)
+		else:
+			pending = collections.deque()
+			for i in inputs:
+				pending.append(self._executor.submit(function, *i))
+				if len(pending)>=self.n_workers:  yield pending.popleft().result()
+			while pending:  yield pending.popleft().result()
+	def map(self, function, inputs):
+		return list(self.imap(function, inputs))
+	def close(self):
+		if self._executor is not None:  self._executor.shutdown()
+		core_budget.release(self.n_workers * self.threads_per_task)
+		self._executor, self.n_workers = None, 0
+	def __enter__(self):
+		return self
+	def __exit__(self, *exception):
+		self.close()
+
+def parallelize_threads(function, inputs, n_workers=None, threads_per_task=1):
+	""" the thread analog of parallelize_task below, for calls that release the GIL """
+	with thread_pool(n_workers, threads_per_task) as pool:  return pool.map(function, inputs)
+
+
+
+# The pool of worker processes used by parallelize_task and aggregate persists between calls.  It is started on first use and only
+# restarted if a different number of workers is requested, or if new callables have been defined in __main__ since (which workers forked
+# earlier could not unpickle).  What is the same for every task (the function and any constant arguments) is pickled once per call into
+# a block of multiprocessing.shared_memory, rather than once per task.  Within it, numpy arrays of at least shared_threshold bytes are
+# placed out-of-band (pickle protocol 5), so that the workers use them in place (read-only) rather than each unpickling a copy.  The
+# results of aggregate are reduced within each chunk of inputs by the worker that computed them, and then pairwise across chunks, as a
+# tree, by the pool.
+
+shared_threshold = 2**16
+
+def _aligned(n, alignment=64):
+	return -(-n // alignment) * alignment
+
+class _broadcast(object):
+	""" an object pickled once into shared memory, to be loaded by workers from its handle (until closed by the owner) """
+	def __init__(self, obj):
+		buffers = []
+		def in_band(buf):
+			if buf.raw().nbytes<shared_threshold:  return True
+			buffers.append(buf.raw())
+			return False
+		data = pickle.dumps(obj, protocol=5, buffer_callback=in_band)
+		pieces, offset = [], 0
+		for piece in [data] + buffers:
+			pieces += [(offset, len(piece) if isinstance(piece,bytes) else piece.nbytes)]
+			offset = _aligned(offset + pieces[-1][1])
+		self._shm = shared_memory.SharedMemory(create=True, size=max(1,offset))
+		for (beg,size),piece in zip(pieces, [data]+buffers):  self._shm.buf[beg:beg+size] = piece
+		self.handle = (self._shm.name, tuple(pieces))
+	def close(self):
+		self._shm.close()
+		self._shm.unlink()	# workers may keep it mapped until they are done with it
+
+_received = collections.OrderedDict()	# in each worker, the most recently loaded broadcasts, keyed by name
+
+def _load(handle):
+	name, ((beg,size), *buffers) = handle
+	if name not in _received:
+		while len(_received)>=2:  _unload(*_received.popitem(last=False)[1])
+		shm = shared_memory.SharedMemory(name=name)
+		obj = pickle.loads(shm.buf[beg:beg+size], buffers=[shm.buf[b:b+s].toreadonly() for b,s in buffers])
+		_received[name] = (shm, obj)
+	return _received[name][1]
+
+def _unload(shm, obj):
+	del obj
+	try:                 shm.close()
+	except BufferError:  pass		# something still refers to the arrays in it, so it stays mapped until the worker exits
+
+def _call_chunk(handle, chunk):
+	function = _load(handle)
+	return [function(*i) for i in chunk]
+
+def _aggregate_chunk(handle, chunk):
+	action, other_arguments, aggregator = _load(handle)
+	result = action(*( chunk[0] + other_arguments ))
+	for inp in chunk[1:]:  result = aggregator(result, action(*( inp + other_arguments )))
+	return result
+
+def _aggregate_pair(handle, out, inc):
+	return _load(handle)[2](out, inc)
+
+def _chunks(inputs, n_workers, per_worker=4):
+	""" splits the list inputs into contiguous chunks, several per worker for load balancing """
+	n_chunks = min(len(inputs), per_worker*n_workers)
+	return [inputs[(i*len(inputs))//n_chunks:((i+1)*len(inputs))//n_chunks] for i in range(n_chunks)]
+
+def _main_callables():
+	main = sys.modules.get("__main__")
+	return frozenset(name for name,value in vars(main).items() if callable(value)) if main is not None else frozenset()
+
+class _process_pool(object):
+	def __init__(self, n_workers):
+		self.n_workers = n_workers
+		self.main_callables = _main_callables()
+		resource_tracker.ensure_running()	# so that forked workers share it, and shared memory they attach to is not reported as leaked by a tracker of their own
+		self._pool = multiprocessing.Pool(n_workers)
+	def starmap(self, function, inputs):
+		return self._pool.starmap(function, inputs, chunksize=1)
+	def terminate(self):
+		self._pool.terminate()
+		self._pool.join()
+	def __enter__(self):
+		return self
+	def __exit__(self, exception_type, *exception):
+		if exception_type is not None:  close_process_pool()	# do not leave workers busy with the tasks of an abandoned call
+
+_process_pool_instance = None
+
+def process_pool(n_workers):
+	"""\
+	Returns the persistent pool of worker processes (see above), (re)starting it as necessary to have n_workers workers.  Use it as a
+	context manager, which terminates the workers if an exception escapes (they are otherwise kept for the next call):
+		with parallel.process_pool(4) as pool:
+			results = pool.starmap(func, [(x,y) for x in xs])	# func must be picklable
+	"""
+	global _process_pool_instance
+	pool = _process_pool_instance
+	if pool is None or pool.n_workers!=n_workers or pool.main_callables!=_main_callables():
+		close_process_pool()
+		_process_pool_instance = _process_pool(n_workers)
+	return _process_pool_instance
+
+def close_process_pool():
+	global _process_pool_instance
+	if _process_pool_instance is not None:  _process_pool_instance.terminate()
+	_process_pool_instance = None
+
+atexit.register(close_process_pool)
 
 
 
@@ -33,19 +251,19 @@ def _serial(function, inputs):
 	""" circumvents some buggy multiprocessing behavior when it is not needed ... good for debugging too """
 	return [function(*i) for i in inputs]
 
-class _function_wrapper(object):
-	def __init__(self,f):  self.f = f
-	def __call__(self,x):  return self.f(*x)
-
 def _simple_multiprocessing(function, inputs, n_workers):
-	wrapped_function = _function_wrapper(function)
-	worker_pool = multiprocessing.Pool(n_workers)
-	outputs = worker_pool.map(wrapped_function,inputs)
-	worker_pool.terminate()		# Needed because repeated calls to parallelize_task will open many processes and exhaust unix file descriptors in /proc
-	return outputs
+	inputs = list(inputs)
+	if len(inputs)==0:  return []
+	shared = _broadcast(function)
+	try:
+		with process_pool(n_workers) as pool:
+			outputs = pool.starmap(_call_chunk, [(shared.handle, chunk) for chunk in _chunks(inputs, n_workers)])
+	finally:
+		shared.close()
+	return [output for chunk in outputs for output in chunk]
 
 def parallelize_task(function,inputs,n_workers=None):
-	if n_workers is None:  n_workers = multiprocessing.cpu_count() - 2
+	if n_workers is None:  n_workers = core_budget.n_cores - core_budget.in_use
 	if n_workers<=1:
 		outputs = _serial(function,inputs)
 	else:
@@ -55,24 +273,6 @@ def parallelize_task(function,inputs,n_workers=None):
 
 
 
-class _f(object):
-	def __init__(self, result_q, aggregator, action, other_arguments):
-		self._result_q        = result_q
-		self._aggregator      = aggregator
-		self._action          = action
-		self._other_arguments = other_arguments
-	def __call__(self, inp):
-		self._aggregate_results( self._action(*( inp + self._other_arguments )) )
-		return None
-	def _aggregate_results(self, out):
-		try:
-			inc = self._result_q.get_nowait()
-		except queue.Empty:
-			self._result_q.put(out)
-		else:
-			out = self._aggregator(out,inc)
-			self._aggregate_results(out)
-
 class aggregate(object):
 	def __init__(self, action, other_arguments, aggregator, num_cores):
 		"""\
@@ -80,9 +280,10 @@ class aggregate(object):
 			its call signature must be action(*(inp+other_arguments)),
 			where inp is a tuple of those arguments that are variable (single arguments must be wrapped as 1-tuples)
 			and other_arguments is a tuple of those arguments that stay the same, passed as the next constructor argument
+			(these are sent to the workers once per run, through shared memory, rather than with each input)
 		aggregator is a function of two outputs that aggregates them into one output of the same type, which is returned.
 			If the output of action is not amenable to repeated unordered pairwise aggregation, then this is the wrong utility to use.
-		num_cores is self explanatory
+		num_cores is self explanatory (the number of workers in the persistent process pool)
 
 		Usage pattern should look something like (for func(x,y,z), where x will vary)
 			A = parallel.aggregate(func, (y,z), value_adder, 10)
@@ -90,23 +291,23 @@ class aggregate(object):
 			start_val = a (likely empty) object of the type returned by func 
 			end_val = A.run(start_val,inputs)	inputs could be any iteratable/iterator object
 		"""
-		self._workers    = multiprocessing.Pool(num_cores)
-		self._result_q   = multiprocessing.Manager().Queue()
-		self._function   = _f(self._result_q, aggregator, action, other_arguments)
-		self._aggregator = aggregator
-	def run(self, aggregate, inputs):					# Have to give a starting point for aggregation otherwise _finalize can fail if no inputs (has happened to me)
-		self._result_q.put(aggregate)
-		self._workers.map(self._function, inputs, chunksize=1)		# Maybe there is a better idea than using map, to avoid making a discarded output object?
-		aggregate = self._finalize()					# Not the same object as incoming aggregate!
-		self._workers.terminate()					# Needed because repeated instantiations of aggregate will open many processes and exhaust unix file descriptors in /proc (must be called after finalize?)
-		return aggregate
-	def _finalize(self):
-		aggregate = self._result_q.get_nowait()
-		while True:
-			try:                 increment = self._result_q.get_nowait()
-			except queue.Empty:  break
-			else:                aggregate = self._aggregator(aggregate,increment)
-		return aggregate
+		self._action          = action
+		self._other_arguments = other_arguments
+		self._aggregator      = aggregator
+		self._num_cores       = num_cores
+	def run(self, aggregate, inputs):					# Have to give a starting point for aggregation, which is the result if there are no inputs
+		inputs = list(inputs)
+		if len(inputs)==0:  return aggregate
+		shared = _broadcast((self._action, self._other_arguments, self._aggregator))
+		try:
+			with process_pool(self._num_cores) as pool:
+				partials = [aggregate] + pool.starmap(_aggregate_chunk, [(shared.handle, chunk) for chunk in _chunks(inputs, self._num_cores)])
+				while len(partials)>1:				# tree reduction, each level pairwise in parallel
+					pairs = [(shared.handle, out, inc) for out,inc in zip(partials[0::2], partials[1::2])]
+					partials = pool.starmap(_aggregate_pair, pairs) + partials[2*len(pairs):]
+		finally:
+			shared.close()
+		return partials[0]					# Not the same object as incoming aggregate!
 
 
 